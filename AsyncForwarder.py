@@ -0,0 +1,274 @@
+"""
+An asyncio engine for forwarding events that carry many SES emails.
+
+The forwarder in SimpleForwarder.py works through a batch on a pool of
+threads, each of which fetches, rewrites and sends one email before it
+starts the next. Here the batch is a pipeline on an event loop: emails
+are fetched and rewritten on one executor and handed through a bounded
+queue to send workers on another, so the next email is downloading
+while the last one is being sent. Each stage has room for 'maxInFlight'
+emails (DEFAULT_IN_FLIGHT unless the configuration says otherwise): that
+many are fetched at once, that many wait in the queue and that many are
+sent at once, which bounds the memory used.
+
+This module needs Python 3.7 or later, while SimpleForwarder.py still
+runs on Python 2.7. Deploy both files and set the handler to
+AsyncForwarder.lambda_handler to use it. The configuration, the
+per-record report and the stage timings are the same as for
+SimpleForwarder.batch_handler.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from SimpleForwarder import LOGGER, S3Object, SESEmailEvent, \
+    SESForwarderError, StageTimer, _container_start, _email_result, \
+    _record_result, create_sender, emit_metrics, get_client, get_config, \
+    get_new_recipients, is_queue_event, is_warmup_event, prepare_email, \
+    process_queue_records, warm_up
+
+DEFAULT_IN_FLIGHT = 8
+
+
+def lambda_handler(event,
+                   context,
+                   ses_client=None,
+                   s3_client=None,
+                   config=None):
+    """
+    Handler function for events that may carry many SES records, or SES
+    notifications delivered through SQS or SNS. Every record is
+    forwarded by process_records_async and the same report as
+    SimpleForwarder.batch_handler's is returned. Keep-warm pings are
+    handed to warm_up.
+    """
+    start = _container_start()
+    if not config:
+        config = get_config()
+    if is_warmup_event(event):
+        return warm_up(ses_client, s3_client, config)
+    LOGGER.info("Got batch event with %d record(s)",
+                len(event.get('Records', [])))
+    LOGGER.debug("Context: %s", context)
+    if is_queue_event(event):
+        return process_queue_records(event, ses_client, s3_client, config,
+                                     start, process_records_async)
+    return process_records_async(event, ses_client, s3_client, config,
+                                 start)
+
+
+def process_records_async(event, ses_client, s3_client, config,
+                          start='warm'):
+    """
+    Forward every record in the event on a new event loop and return a
+    report with one entry per record, in the order of the records.
+    """
+    return asyncio.run(forward_records(event, ses_client, s3_client,
+                                       config, start))
+
+
+async def forward_records(event, ses_client, s3_client, config,
+                          start='warm'):
+    """
+    Forward every record in the event through the pipeline. At most
+    'maxInFlight' records are fetched at once; each prepared email is
+    put on a queue of that size, and as many send workers take emails
+    off it and send them. The executors for fetching and sending are
+    each as large as that limit, so neither stage waits for threads
+    held by the other.
+    """
+    records = event.get('Records', [])
+    in_flight = max(config.get('maxInFlight', DEFAULT_IN_FLIGHT), 1)
+    results = [None] * len(records)
+    limit = asyncio.Semaphore(in_flight)
+    queue = asyncio.Queue(maxsize=in_flight)
+    fetch_pool = ThreadPoolExecutor(max_workers=in_flight)
+    send_pool = ThreadPoolExecutor(max_workers=in_flight)
+    senders = [asyncio.ensure_future(_send_worker(queue, results))
+               for _ in range(in_flight)]
+    try:
+        await asyncio.gather(*[
+            _fetch_record(event, index, ses_client, s3_client, config,
+                          start, limit, queue, results, fetch_pool,
+                          send_pool)
+            for index in range(len(records))])
+        await queue.join()
+    finally:
+        for sender in senders:
+            sender.cancel()
+        fetch_pool.shutdown(wait=False)
+        send_pool.shutdown(wait=False)
+
+    failed = len([r for r in results if r['status'] == 'failed'])
+    return {
+        'processed': len(results),
+        'failed': failed,
+        'succeeded': len(results) - failed,
+        'results': list(results)
+    }
+
+
+async def _fetch_record(event, index, ses_client, s3_client, config,
+                        start, limit, queue, results, fetch_pool, send_pool):
+    timer = StageTimer(start)
+    try:
+        with timer.stage('validate'):
+            email_event = SESEmailEvent(event, index)
+    except SESForwarderError as err:
+        LOGGER.error("Skipping invalid record %d: %s", index, err)
+        results[index] = _record_result(index, None, 'failed', err)
+        return
+    try:
+        async with limit:
+            prepared = await prepare_email_async(
+                email_event, ses_client, s3_client, config, timer,
+                fetch_pool, send_pool)
+    except Exception as err:  # pylint: disable=broad-except
+        emit_metrics(timer, config)
+        results[index] = _email_result(index, email_event, error=err)
+        return
+    if prepared is None:
+        emit_metrics(timer, config)
+        results[index] = _email_result(index, email_event)
+        return
+    # The fetch slot is free by now, so the next email is fetched while
+    # this one waits for a send worker.
+    await queue.put((index, email_event, timer, config, prepared))
+
+
+async def _send_worker(queue, results):
+    while True:
+        index, email_event, timer, config, (sender, email) = \
+            await queue.get()
+        try:
+            response = await send_email_async(sender, email, timer)
+            results[index] = _email_result(index, email_event, response)
+        except Exception as err:  # pylint: disable=broad-except
+            results[index] = _email_result(index, email_event, error=err)
+        finally:
+            emit_metrics(timer, config)
+            queue.task_done()
+
+
+async def forward_email_async(event, ses_client, s3_client, config,
+                              timer=None, fetch_pool=None, send_pool=None):
+    """
+    Like SimpleForwarder.forward_email, but the email is fetched on
+    fetch_pool and sent on send_pool while the event loop gets on with
+    other emails. Returns the SES response, or None if the email was
+    dropped.
+    """
+    timer = timer or StageTimer(_container_start())
+    try:
+        prepared = await prepare_email_async(event, ses_client, s3_client,
+                                             config, timer, fetch_pool,
+                                             send_pool)
+        if prepared is None:
+            return None
+        return await send_email_async(prepared[0], prepared[1], timer)
+    finally:
+        emit_metrics(timer, config)
+
+
+async def prepare_email_async(event, ses_client, s3_client, config, timer,
+                              fetch_pool=None, send_pool=None):
+    """
+    Check, route, fetch and rewrite the email on fetch_pool. Returns
+    the AsyncSESSender (sending on send_pool) and the SESEmail, ready to
+    send, or None if the email was dropped.
+    """
+    timer.set('messageId', event.get_email().get('messageId'))
+    with timer.stage('validate'):
+        rejected = event.is_spam() or event.is_virus()
+    if rejected:
+        LOGGER.error("Skipping email because it failed virus/spam check")
+        return None
+
+    with timer.stage('route'):
+        new_recipients = get_new_recipients(event.get_recipients(), config)
+    timer.set('recipients', len(new_recipients))
+    if not new_recipients:
+        LOGGER.info("Finishing event, no matching recipients")
+        return None
+    LOGGER.info("Rewriting original recipients %s to %s",
+                event.get_recipients(), new_recipients)
+    sender = AsyncSESSender(
+        create_sender(ses_client or get_client('ses', config), config),
+        send_pool)
+    full_email = AsyncS3Object(
+        S3Object(s3_client or get_client('s3', config),
+                 config['emailBucket'],
+                 config.get('emailKeyPrefix', '') +
+                 event.get_email()['messageId']),
+        fetch_pool)
+    email = await full_email.prepare(event, sender.get_sender(), config,
+                                     timer)
+    return sender, email
+
+
+async def send_email_async(sender, email, timer):
+    """
+    Send a SESEmail prepared by prepare_email_async with its sender and
+    return the SES response.
+    """
+    with timer.stage('send'):
+        response = await sender.send(email)
+    LOGGER.info("Send metrics: %s", sender.get_metrics())
+    return response
+
+
+class AsyncS3Object(object):
+    """
+    Wraps an S3Object so that its reads run on an executor (the loop's
+    default one if none is given) and can be awaited.
+    """
+    def __init__(self, s3_object, executor=None):
+        self._object = s3_object
+        self._executor = executor
+
+    async def get(self, section):
+        """ Return the specified section of the object as a blob. """
+        return await self._run(self._object.get, section)
+
+    async def open(self, section, **kwargs):
+        """ Start a streaming read, as S3Object.open does. """
+        return await self._run(lambda: self._object.open(section, **kwargs))
+
+    async def prepare(self, event, sender, config, timer):
+        """
+        Fetch and rewrite the email, as SimpleForwarder.prepare_email
+        does, and return the SESEmail, with the whole message read.
+        """
+        return await self._run(prepare_email, self._object, event, sender,
+                               config, timer)
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+
+class AsyncSESSender(object):
+    """
+    Wraps a SESSender so that sends run on an executor (the loop's
+    default one if none is given) and can be awaited.
+    """
+    def __init__(self, sender, executor=None):
+        self._sender = sender
+        self._executor = executor
+
+    async def send(self, email, per_recipient=None):
+        """
+        Send a SESEmail that was built with the wrapped sender, and
+        return the SES response.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, email.send,
+                                          per_recipient)
+
+    def get_sender(self):
+        """ The wrapped SESSender. """
+        return self._sender
+
+    def get_metrics(self):
+        """ The wrapped sender's metrics. """
+        return self._sender.get_metrics()
@@ -3,17 +3,199 @@ To use, modify the DEFAULT_CONFIG. At a minimum, you'll need to
 provide an emailBucket and change the forwardMapping to the addresses
 you want to handle.
 
+Alternatively, keep the configuration outside the code: set the
+FORWARDER_CONFIG environment variable to a JSON or YAML file, either a
+local path or an s3://bucket/key URL, or put the JSON itself in
+FORWARDER_CONFIG_JSON. It is reloaded, if it has changed, at most every
+FORWARDER_CONFIG_TTL seconds.
+
 """
 
 from __future__ import print_function
 import logging
+import os
+import hashlib
+import json
+import mmap
+import calendar
+import random
 import re
-import boto3
-import botocore
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import getaddresses
+from concurrent.futures import ThreadPoolExecutor
+import botocore.exceptions
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# Upper bound on the number of records processed at the same time when
+# an event carries more than one record. Override with 'maxWorkers' in
+# the configuration.
+DEFAULT_MAX_WORKERS = 4
+
+# Upper bound on the number of send_raw_email calls one message makes at
+# the same time, when its recipients are split into chunks or sent
+# individually. Override with 'sendWorkers' in the configuration.
+DEFAULT_SEND_WORKERS = 10
+
+# AWS clients are created the first time they are needed and then
+# shared by every later invocation in the same container, so warm
+# invocations reuse their pooled connections.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Settings for the AWS clients. Each can be set under 'clientSettings'
+# in the configuration or with the environment variable, which takes
+# precedence. The pool is never smaller than the number of concurrent
+# sends, 'maxWorkers' times 'sendWorkers'.
+DEFAULT_CLIENT_SETTINGS = {
+    'maxPoolConnections': 10,
+    'connectTimeout': 5,
+    'readTimeout': 30,
+    'tcpKeepAlive': True,
+    'retryMode': 'standard',
+    'maxAttempts': 3
+}
+CLIENT_SETTINGS_ENVIRONMENT = {
+    'maxPoolConnections': ('FORWARDER_MAX_POOL_CONNECTIONS', int),
+    'connectTimeout': ('FORWARDER_CONNECT_TIMEOUT', float),
+    'readTimeout': ('FORWARDER_READ_TIMEOUT', float),
+    'tcpKeepAlive': ('FORWARDER_TCP_KEEPALIVE',
+                     lambda value: value.lower() in ('1', 'true', 'yes')),
+    'retryMode': ('FORWARDER_RETRY_MODE', str),
+    'maxAttempts': ('FORWARDER_MAX_ATTEMPTS', int)
+}
+
+# The S3 object is read in chunks of this many bytes into one buffer,
+# which has DEFAULT_HEADROOM spare bytes in front of the message for the
+# rewritten header. Override with 'fetchChunkSize' in the configuration.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_HEADROOM = 4 * 1024
+
+# Objects larger than this many bytes are written to a temporary file in
+# DEFAULT_SPILL_DIRECTORY and memory-mapped, rather than held in memory.
+# Override with 'spillThreshold' and 'spillDirectory' in the
+# configuration.
+DEFAULT_SPILL_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_SPILL_DIRECTORY = '/tmp'
+
+# With 'headersFromEvent', up to this many bytes from the end of the
+# last header field are compared with the stored header, to check that
+# the body is fetched from the right place.
+HEADER_TAIL_SIZE = 64
+
+# SES accepts at most this many destinations per send_raw_email call.
+# Set 'maxDestinations' in the configuration to use smaller chunks.
+MAX_DESTINATIONS = 50
+
+# Sends are paced by a token bucket seeded from the account's SES send
+# quota, unless 'maxSendRate' sets the rate (messages per second) or
+# disables pacing with 0. Sends that are throttled anyway, get a 5xx
+# response or can't connect are retried up to 'throttleRetries' times
+# with jittered exponential backoff starting at 'throttleBackoff'
+# seconds. The SES client itself makes a single attempt.
+DEFAULT_THROTTLE_RETRIES = 5
+DEFAULT_THROTTLE_BACKOFF = 0.1
+MAX_THROTTLE_BACKOFF = 5.0
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException',
+                     'TooManyRequestsException')
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+# Deliveries are recorded in a dedupe store, keyed on the SES messageId
+# and the recipients of each chunk, so a retried invocation skips the
+# chunks it already delivered. Configure it under 'dedupe'; records
+# expire after 'ttl' seconds.
+DEFAULT_DEDUPE_TTL = 24 * 60 * 60
+DEFAULT_DEDUPE_CACHE_SIZE = 10000
+_DEDUPE_STORES = {}
+_DEDUPE_STORES_LOCK = threading.Lock()
+
+# Signature fields that no longer verify once the header is rewritten.
+# The ARC fields are only removed if 'stripArcHeaders' is set.
+SIGNATURE_HEADERS = ('dkim-signature',)
+ARC_HEADERS = ('arc-seal', 'arc-message-signature',
+               'arc-authentication-results')
+
+# Routing indexes built from forwardMapping, keyed on the id of the
+# mapping they were built from.
+MAX_ROUTING_INDEXES = 8
+_ROUTING_INDEXES = {}
+
+# A forwardMapping recipient that is itself an address in the mapping is
+# a group, and is replaced by that address's recipients when the index
+# is built. Groups can nest at most MAX_GROUP_DEPTH deep.
+MAX_GROUP_DEPTH = 8
+
+# A forwardMapping too large to keep in the configuration can be
+# compiled with compile_alias_store, and the file named by 'aliasStore'
+# in the configuration instead. The file starts with ALIAS_STORE_MAGIC
+# and the number of keys, followed by a table of the offsets of the
+# records, in key order. Each record is its key's length, its value's
+# length, the key and the value: the recipients, one per line.
+ALIAS_STORE_MAGIC = b'SFALIAS1'
+_ALIAS_HEADER = struct.Struct('<I')
+_ALIAS_OFFSET = struct.Struct('<I')
+_ALIAS_RECORD = struct.Struct('<HI')
+
+# Header templates built from subjectPrefix, keyed the same way. Each
+# keeps the templates of its most recently used MAX_HEADER_TEMPLATES
+# aliases.
+MAX_HEADER_TEMPLATES = 1024
+_HEADER_TEMPLATES = {}
+
+# Configuration loaded from FORWARDER_CONFIG or FORWARDER_CONFIG_JSON is
+# kept in memory and only checked for changes every
+# FORWARDER_CONFIG_TTL seconds.
+DEFAULT_CONFIG_TTL = 30
+_CONFIG_CACHES = {}
+_CONFIG_CACHES_LOCK = threading.Lock()
+
+# The time spent in each stage of forwarding an email is reported as a
+# CloudWatch Embedded Metric Format record under this namespace.
+# Override with 'metricsNamespace' in the configuration. Records are
+# passed to METRICS_SINK, which writes them to stdout as JSON lines for
+# CloudWatch Logs to pick up; replace it to send them elsewhere, or set
+# it to None to turn them off.
+DEFAULT_METRICS_NAMESPACE = 'SimpleForwarder'
+_WARM = threading.Event()
+
+# Stored emails are re-forwarded from S3 on this many worker threads,
+# unless the backlog event sets 'maxWorkers'. The header of each one is
+# found in its first BACKLOG_HEADER_BYTES, and no new page of objects is
+# started with less than BACKLOG_TIME_MARGIN seconds of the invocation
+# left. SES writes SES_SETUP_NOTIFICATION to the bucket; it isn't mail.
+DEFAULT_BACKLOG_WORKERS = 16
+BACKLOG_HEADER_BYTES = 64 * 1024
+BACKLOG_PAGE_SIZE = 1000
+BACKLOG_TIME_MARGIN = 30
+MAX_CHECKPOINT_FAILURES = 1000
+SES_SETUP_NOTIFICATION = 'AMAZON_SES_SETUP_NOTIFICATION'
+_RECEIVED_FOR = re.compile(r'\bfor\s+<?([^\s<>;]+@[^\s<>;]+)>?')
+
+# A share of invocations, set by 'profileRate' in the configuration or
+# FORWARDER_PROFILE_RATE in the environment (from 0 to 1), are run under
+# cProfile and, on Python 3, tracemalloc. A report of the
+# PROFILE_TOP_N slowest functions and largest allocation sites, and the
+# size of each email, is written as JSON to 'profileSink' or
+# FORWARDER_PROFILE_SINK: a directory, or an s3://bucket/prefix URL.
+DEFAULT_PROFILE_DIRECTORY = '/tmp'
+PROFILE_TOP_N = 30
+_PROFILES = []
+
+# Keep-warm pings: events with 'warmup' set, scheduled EventBridge
+# events and those sent by serverless-plugin-warmup. They set up the
+# container, with warm_up, instead of forwarding anything.
+WARMUP_SOURCES = ('aws.events', 'serverless-plugin-warmup')
+
 DEFAULT_CONFIG = {
     'fromEmail': '',
     'subjectPrefix': {
@@ -48,52 +230,1656 @@ DEFAULT_CONFIG = {
 
 def lambda_handler(event,
                    context,
-                   ses_client=boto3.client('ses'),
-                   s3_client=boto3.resource('s3'),
+                   ses_client=None,
+                   s3_client=None,
                    config=None):
     """
     Handler function to be invoked with an inbound SES email as the
-    event.
+    event. Events with more than one record are handed to
+    process_records and the per-record report is returned, unless a
+    record failed: then SESForwarderError is raised, so that Lambda
+    retries the event as it would a single failed email. SES
+    notifications delivered through SQS or SNS are handed to
+    process_queue_records. The SES and S3 clients default to the shared
+    clients from get_client. Invocations picked by sample_profile are
+    profiled. Keep-warm pings are handed to warm_up.
     """
+    start = _container_start()
     if not config:
-        config = DEFAULT_CONFIG
+        config = get_config()
+    if is_warmup_event(event):
+        return warm_up(ses_client, s3_client, config)
+    profile = sample_profile(config, context)
+    if profile is not None:
+        return profile.run(_handle_event, event, context, ses_client,
+                           s3_client, config, start)
+    return _handle_event(event, context, ses_client, s3_client, config,
+                         start)
+
+
+def _handle_event(event, context, ses_client, s3_client, config, start):
     LOGGER.info("Got event: %s", event)
     LOGGER.debug("Context: %s", context)
-    event = SESEmailEvent(event)
+    if is_queue_event(event):
+        return process_queue_records(event, ses_client, s3_client, config,
+                                     start)
+    if len(event.get('Records', [])) > 1:
+        report = process_records(event, ses_client, s3_client, config,
+                                 start)
+        if report['failed']:
+            raise SESForwarderError(
+                "Failed to forward {0} of {1} records: {2}".format(
+                    report['failed'], report['processed'],
+                    [result for result in report['results']
+                     if result['status'] == 'failed']))
+        return report
+    timer = StageTimer(start)
+    with timer.stage('validate'):
+        email_event = SESEmailEvent(event)
+    forward_email(email_event, ses_client, s3_client, config, timer)
+
+
+def batch_handler(event,
+                  context,
+                  ses_client=None,
+                  s3_client=None,
+                  config=None):
+    """
+    Handler function for events that may carry many SES records. Every
+    record is forwarded and a per-record report is returned. Keep-warm
+    pings are handed to warm_up.
+    """
+    start = _container_start()
+    if not config:
+        config = get_config()
+    if is_warmup_event(event):
+        return warm_up(ses_client, s3_client, config)
+    LOGGER.info("Got batch event with %d record(s)",
+                len(event.get('Records', [])))
+    LOGGER.debug("Context: %s", context)
+    if is_queue_event(event):
+        return process_queue_records(event, ses_client, s3_client, config,
+                                     start)
+    return process_records(event, ses_client, s3_client, config, start)
+
+
+def backlog_handler(event,
+                    context,
+                    ses_client=None,
+                    s3_client=None,
+                    config=None):
+    """
+    Handler function to re-forward emails that are already stored in
+    the bucket, for example after an outage. The event must set 'since'
+    and 'until', the window of the outage, as ISO 8601 times or epoch
+    seconds. It can also set 'startAfter' (a key), 'maxMessages',
+    'maxWorkers', 'maxSendRate', 'allowMissingVerdicts' and
+    'checkpoint' (an s3://bucket/key URL or a file path, where progress
+    is saved after each page). Work
+    stops before the invocation times out; invoke it again with the
+    same checkpoint to carry on. Returns a report ending with the last
+    key reached.
+    """
+    if not config:
+        config = get_config()
+    LOGGER.info("Got backlog event: %s", event)
+    remaining = None
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        remaining = lambda: context.get_remaining_time_in_millis() / 1000.0
+    checkpoint = None
+    if event.get('checkpoint'):
+        checkpoint = get_checkpoint(event['checkpoint'], config)
+    return reforward_backlog(config, ses_client, s3_client,
+                             since=event.get('since'),
+                             until=event.get('until'),
+                             start_after=event.get('startAfter'),
+                             max_messages=event.get('maxMessages'),
+                             max_workers=event.get('maxWorkers'),
+                             max_send_rate=event.get('maxSendRate'),
+                             allow_missing_verdicts=event.get(
+                                 'allowMissingVerdicts', False),
+                             checkpoint=checkpoint, remaining=remaining)
+
+
+def forward_email(event, ses_client, s3_client, config, timer=None):
+    """
+    Fetch, rewrite and send the email described by a single
+    SESEmailEvent. Returns the SES response, or None if the email was
+    dropped. Missing clients are only created once an email is actually
+    going to be forwarded. The time taken by each stage is added to
+    timer, and reported when the email has been dealt with.
+    """
+    timer = timer or StageTimer(_container_start())
+    timer.set('messageId', event.get_email().get('messageId'))
+    try:
+        with timer.stage('validate'):
+            rejected = event.is_spam() or event.is_virus()
+        if rejected:
+            LOGGER.error("Skipping email because it failed virus/spam check")
+            return None
+
+        with timer.stage('route'):
+            new_recipients = get_new_recipients(event.get_recipients(),
+                                                config)
+        timer.set('recipients', len(new_recipients))
+        if len(new_recipients) > 0:
+            LOGGER.info("Rewriting original recipients %s to %s",
+                        event.get_recipients(), new_recipients)
+            sender = create_sender(ses_client or get_client('ses', config),
+                                   config)
+            email = prepare_email(
+                S3Object(s3_client or get_client('s3', config),
+                         config['emailBucket'],
+                         config.get('emailKeyPrefix', '') +
+                         event.get_email()['messageId']),
+                event, sender, config, timer)
+            with timer.stage('send'):
+                response = email.send()
+            LOGGER.info("Send metrics: %s", sender.get_metrics())
+            return response
+        else:
+            LOGGER.info("Finishing event, no matching recipients")
+            return None
+    finally:
+        emit_metrics(timer, config)
+
+
+def create_sender(ses_client, config):
+    """ A SESSender for ses_client, set up from the configuration. """
+    return SESSender(ses_client, LOGGER,
+                     config.get('sendWorkers', DEFAULT_SEND_WORKERS),
+                     config.get('maxDestinations', MAX_DESTINATIONS),
+                     get_rate_limiter(ses_client, config),
+                     config.get('throttleRetries', DEFAULT_THROTTLE_RETRIES),
+                     config.get('throttleBackoff', DEFAULT_THROTTLE_BACKOFF),
+                     get_dedupe_store(config))
+
+
+def prepare_email(full_email, event, sender, config, timer):
+    """
+    Fetch and rewrite the email stored in the S3Object full_email and
+    return it as a SESEmail, ready to send. The message is rendered
+    here, so every read from S3 is done by the time this returns.
+    """
+    if config.get('headersFromEvent') and event.get_headers():
+        # The header comes from the event, and only the body is
+        # fetched, when the email is rendered.
+        with timer.stage('rewrite'):
+            email = SESEmail(full_email, event, sender, config, LOGGER)
+    else:
+        with timer.stage('fetch'):
+            blob = open_email(full_email, config)
+        # Reading the header is counted as part of the rewrite.
+        with timer.stage('rewrite'):
+            email = SESEmail(blob, event, sender, config, LOGGER)
+    with timer.stage('fetch'):
+        timer.set('messageSize', len(email.email()))
+    return email
+
+
+def process_records(event, ses_client, s3_client, config, start='warm'):
+    """
+    Parse every record in the event, then forward them on a bounded
+    pool of worker threads. Returns a report with one entry per record,
+    in the same order as the records in the event. start is 'cold' if
+    this is the container's first invocation.
+    """
+    records = event.get('Records', [])
+    results = [None] * len(records)
+    pending = []
+    for index in range(len(records)):
+        timer = StageTimer(start)
+        try:
+            with timer.stage('validate'):
+                pending.append((index, SESEmailEvent(event, index), timer))
+        except SESForwarderError as err:
+            LOGGER.error("Skipping invalid record %d: %s", index, err)
+            results[index] = _record_result(index, None, 'failed', err)
+
+    if pending:
+        workers = min(config.get('maxWorkers', DEFAULT_MAX_WORKERS),
+                      len(pending))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = [(index, email_event,
+                        pool.submit(forward_email, email_event,
+                                    ses_client, s3_client, config, timer))
+                       for index, email_event, timer in pending]
+            for index, email_event, future in futures:
+                results[index] = _future_result(index, email_event, future)
+
+    failed = len([r for r in results if r['status'] == 'failed'])
+    return {
+        'processed': len(results),
+        'failed': failed,
+        'succeeded': len(results) - failed,
+        'results': results
+    }
+
 
-    if event.is_spam() or event.is_virus():
-        LOGGER.error("Skipping email because it failed virus/spam check")
+def is_warmup_event(event):
+    """ Whether the event is a keep-warm ping rather than mail. """
+    if not isinstance(event, dict) or 'Records' in event:
+        return False
+    return bool(event.get('warmup')) or \
+        event.get('source') in WARMUP_SOURCES
+
+
+def warm_up(ses_client=None, s3_client=None, config=None):
+    """
+    Do the set-up the first email in a new container would otherwise
+    wait for: import boto3 and create the clients, load the
+    configuration, build the routing index and header templates, create
+    the rate limiter and dedupe store, and open a connection to SES and
+    to S3. A request that is refused still leaves its connection in the
+    pool, so only failures to connect are reported. Returns a summary.
+    """
+    began = time.time()
+    config = config or get_config()
+    ses_client = ses_client or get_client('ses', config)
+    s3_client = s3_client or get_client('s3', config)
+    routes = len(get_routing_index(config))
+    get_header_templates(config)
+    get_rate_limiter(ses_client, config)
+    get_dedupe_store(config)
+    connections = []
+    for service, connect in (
+            ('ses', ses_client.get_send_quota),
+            ('s3', lambda: s3_client.head_bucket(
+                Bucket=config['emailBucket']))):
+        try:
+            connect()
+        except botocore.exceptions.ClientError as err:
+            LOGGER.debug("Warm-up request to %s refused: %s", service, err)
+        except botocore.exceptions.BotoCoreError as err:
+            LOGGER.warning("Unable to connect to %s: %s", service, err)
+            continue
+        connections.append(service)
+    summary = {
+        'warmup': True,
+        'routes': routes,
+        'connections': connections,
+        'elapsedTime': (time.time() - began) * 1000.0
+    }
+    LOGGER.info("Warmed up: %s", summary)
+    return summary
+
+
+def is_queue_event(event):
+    """ Whether the event's records come from SQS or SNS. """
+    records = event.get('Records') or [{}]
+    return records[0].get('eventSource') == 'aws:sqs' or \
+        records[0].get('EventSource') == 'aws:sns'
+
+
+def process_queue_records(event, ses_client, s3_client, config,
+                          start='warm', process=process_records):
+    """
+    Unwrap the SES notifications in an SQS or SNS event and forward
+    them concurrently with process (process_records, unless another
+    engine is given). For SQS, returns the
+    batchItemFailures report, so only the messages that failed are
+    delivered again. SNS can't take a partial failure, so any failure
+    is raised and the whole notification is retried.
+    """
+    unwrapped = []
+    failures = []
+    for record in event.get('Records', []):
+        item = record.get('messageId') or \
+            record.get('Sns', {}).get('MessageId')
+        try:
+            ses_record = unwrap_record(record)
+        except SESForwarderError as err:
+            LOGGER.error("Failed to unwrap message %s: %s", item, err)
+            failures.append(item)
+            continue
+        if ses_record is None:
+            LOGGER.info("Skipping message %s, which isn't a received email",
+                        item)
+            continue
+        unwrapped.append((item, ses_record))
+
+    report = process({'Records': [r for _, r in unwrapped]},
+                     ses_client, s3_client, config, start)
+    for (item, _), result in zip(unwrapped, report['results']):
+        if result['status'] == 'failed':
+            failures.append(item)
+    if failures and event['Records'][0].get('EventSource') == 'aws:sns':
+        raise SESForwarderError(
+            "Failed to forward notification(s): {}".format(failures))
+    return {'batchItemFailures': [{'itemIdentifier': item}
+                                  for item in failures]}
+
+
+def unwrap_record(record):
+    """
+    Return the SES record carried by an SQS message or an SNS
+    notification, or None if it isn't about a received email. The SQS
+    message can be an SNS notification, or the SES notification itself
+    if the subscription uses raw message delivery. Other records are
+    returned unchanged.
+    """
+    try:
+        if record.get('eventSource') == 'aws:sqs':
+            body = json.loads(record['body'])
+            if 'Type' in body:
+                if body['Type'] != 'Notification':
+                    return None
+                body = json.loads(body['Message'])
+        elif record.get('EventSource') == 'aws:sns':
+            body = json.loads(record['Sns']['Message'])
+        else:
+            return record
+        if body.get('notificationType') != 'Received':
+            return None
+        return {
+            'eventSource': 'aws:ses',
+            'eventVersion': '1.0',
+            'ses': {'mail': body['mail'], 'receipt': body['receipt']}
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as err:
+        raise SESForwarderError("Invalid notification: {}".format(err))
+
+
+def _future_result(index, email_event, future):
+    try:
+        response = future.result()
+    except Exception as err:  # pylint: disable=broad-except
+        return _email_result(index, email_event, error=err)
+    return _email_result(index, email_event, response)
+
+
+def _email_result(index, email_event, response=None, error=None):
+    message_id = email_event.get_email().get('messageId')
+    if error is not None:
+        LOGGER.error("Failed to forward record %d (%s): %s",
+                     index, message_id, error)
+        return _record_result(index, message_id, 'failed', error)
+    if response is None:
+        return _record_result(index, message_id, 'skipped')
+    result = _record_result(index, message_id, 'sent')
+    result['sesMessageId'] = response.get('MessageId')
+    return result
+
+
+def _record_result(index, message_id, status, error=None):
+    result = {'index': index, 'messageId': message_id, 'status': status}
+    if error is not None:
+        result['error'] = str(error)
+    return result
+
+
+def reforward_backlog(config, ses_client=None, s3_client=None, since=None,
+                      until=None, start_after=None, max_messages=None,
+                      max_workers=None, max_send_rate=None,
+                      allow_missing_verdicts=False, checkpoint=None,
+                      remaining=None):
+    """
+    Forward the emails stored under emailKeyPrefix in emailBucket that
+    were written from since up to (but not including) until, in key
+    order, one page of keys at a time on a pool of worker threads. The
+    window is required: keys are random message IDs, so key order says
+    nothing about when mail arrived, and without it every email in the
+    bucket would be sent again. since and until are ISO 8601 times,
+    epoch seconds or datetimes, and are compared with each object's
+    LastModified.
+    Sends are paced by the usual rate limiter, at max_send_rate if it is
+    given. An email without a spam or virus verdict in its header is
+    skipped unless allow_missing_verdicts is set, in which case the
+    missing verdict is taken as a pass.
+    After each page, the last key and any keys that failed are
+    saved to checkpoint, and a run without start_after resumes from it.
+    remaining returns the seconds left to run, if there is a limit.
+    """
+    if since is None or until is None:
+        raise SESForwarderError(
+            "The backlog needs a 'since' and 'until' window.")
+    since, until = _epoch(since), _epoch(until)
+    if since >= until:
+        raise SESForwarderError(
+            "The backlog window must end after it starts.")
+    config = dict(config)
+    config['headersFromEvent'] = True
+    config['maxWorkers'] = max_workers or DEFAULT_BACKLOG_WORKERS
+    if max_send_rate is not None:
+        config['maxSendRate'] = max_send_rate
+    config['allowMissingVerdicts'] = bool(allow_missing_verdicts)
+    s3_client = s3_client or get_client('s3', config)
+    ses_client = ses_client or get_client('ses', config)
+    prefix = config.get('emailKeyPrefix', '')
+    state = checkpoint.load() if checkpoint else {}
+    if start_after is None:
+        start_after = state.get('startAfter')
+    report = {'processed': 0, 'sent': 0, 'skipped': 0, 'failed': 0,
+              'outsideWindow': 0,
+              'failedKeys': list(state.get('failedKeys', [])),
+              'done': False}
+    with ThreadPoolExecutor(max_workers=config['maxWorkers']) as pool:
+        while True:
+            if remaining is not None and remaining() < BACKLOG_TIME_MARGIN:
+                LOGGER.info("Stopping the backlog at %s to avoid timing out",
+                            start_after)
+                break
+            page_size = BACKLOG_PAGE_SIZE
+            if max_messages is not None:
+                page_size = min(page_size, max_messages - report['processed'])
+                if page_size <= 0:
+                    break
+            kwargs = {'Bucket': config['emailBucket'], 'Prefix': prefix,
+                      'MaxKeys': page_size}
+            if start_after:
+                kwargs['StartAfter'] = start_after
+            listing = s3_client.list_objects_v2(**kwargs)
+            contents = listing.get('Contents', [])
+            keys = [item['Key'] for item in contents]
+            futures = []
+            for item in contents:
+                if item['Key'].endswith(SES_SETUP_NOTIFICATION):
+                    continue
+                if not since <= _epoch(item['LastModified']) < until:
+                    report['outsideWindow'] += 1
+                    continue
+                futures.append((item['Key'], pool.submit(
+                    reforward_stored_email, item['Key'], ses_client,
+                    s3_client, config)))
+            for key, future in futures:
+                _backlog_result(report, key, future)
+            if keys:
+                start_after = keys[-1]
+            report['startAfter'] = start_after
+            if checkpoint:
+                checkpoint.save({
+                    'startAfter': start_after,
+                    'failedKeys': report['failedKeys'][
+                        -MAX_CHECKPOINT_FAILURES:]
+                })
+            if not listing.get('IsTruncated'):
+                report['done'] = True
+                break
+    LOGGER.info("Backlog: processed %d, sent %d, skipped %d, failed %d",
+                report['processed'], report['sent'], report['skipped'],
+                report['failed'])
+    return report
+
+
+def _epoch(value):
+    # Seconds since the epoch of a datetime (naive ones are taken to be
+    # UTC), an ISO 8601 time or a number.
+    if not hasattr(value, 'utctimetuple'):
+        # botocore.utils pulls in a lot, and only the backlog needs it.
+        from botocore.utils import parse_timestamp
+        try:
+            value = parse_timestamp(value)
+        except (TypeError, ValueError) as err:
+            raise SESForwarderError("Invalid time {0!r}: {1}".format(
+                value, err))
+    return calendar.timegm(value.utctimetuple())
+
+
+def _backlog_result(report, key, future):
+    report['processed'] += 1
+    try:
+        response = future.result()
+    except Exception as err:  # pylint: disable=broad-except
+        LOGGER.error("Failed to re-forward %s: %s", key, err)
+        report['failed'] += 1
+        report['failedKeys'].append(key)
         return
+    report['sent' if response is not None else 'skipped'] += 1
 
-    new_recipients = get_new_recipients(event.get_recipients(), config)
-    if len(new_recipients) > 0:
-        LOGGER.info("Rewriting original recipients %s to %s",
-                    event.get_recipients(), new_recipients)
-        sender = SESSender(ses_client, LOGGER)
-        full_email = S3Object(s3_client,
-                              config['emailBucket'],
-                              event.get_email()['messageId'])
-        email = SESEmail(full_email.get('Body'),
-                         event, sender, config, LOGGER)
-        email.send()
+
+def reforward_stored_email(key, ses_client, s3_client, config):
+    """
+    Forward the email stored under key. Its recipients and spam and
+    virus verdicts are read from its header, which is fetched with a
+    ranged GET; the body is fetched separately, from the end of the
+    header. Returns the SES response, or None if it wasn't forwarded.
+    """
+    prefix = config.get('emailKeyPrefix', '')
+    start = S3Object(s3_client, config['emailBucket'], key).get_start(
+        'Body', BACKLOG_HEADER_BYTES)
+    end = start.find(b'\r\n\r\n')
+    if end < 0:
+        if len(start) >= BACKLOG_HEADER_BYTES or \
+                not start.endswith(b'\r\n'):
+            raise SESForwarderError(
+                "No end of header in the first {0} bytes of {1}".format(
+                    BACKLOG_HEADER_BYTES, key))
+        end = len(start) - 2
+    header = EmailHeader(_header_text(start[:end]).split('\r\n'))
+    event = SESEmailEvent(stored_email_event(
+        key[len(prefix):], header, get_routing_index(config),
+        config.get('allowMissingVerdicts', False)))
+    return forward_email(event, ses_client, s3_client, config)
+
+
+def stored_email_event(message_id, header, routing_index,
+                       allow_missing_verdicts=False):
+    """
+    Build an SES event for a stored email from its EmailHeader. The
+    recipients are the address in the Received field SES added, and the
+    To and Cc addresses that match a key in routing_index other than
+    the catch-all: anyone else there is an outside address, and must
+    not become the original recipient the email is sent from. The
+    verdicts come from the X-SES-*-Verdict fields. A missing one is
+    MISSING, so the email is treated as spam or a virus, unless
+    allow_missing_verdicts is set, when it is PASS.
+    """
+    missing = 'PASS' if allow_missing_verdicts else 'MISSING'
+    recipients = []
+    received = header.get_value('Received')
+    if received:
+        match = _RECEIVED_FOR.search(unfold(received))
+        if match:
+            recipients.append(match.group(1))
+    for name in ('To', 'Cc'):
+        value = header.get_value(name)
+        if not value:
+            continue
+        for _, address in getaddresses([unfold(value)]):
+            if routing_index.has_route(address) and address.lower() not in \
+                    [recipient.lower() for recipient in recipients]:
+                recipients.append(address)
+    return {
+        'Records': [{
+            'eventSource': 'aws:ses',
+            'eventVersion': '1.0',
+            'ses': {
+                'mail': {
+                    'messageId': message_id,
+                    'headers': [{'name': name, 'value': value}
+                                for name, value in header.items()],
+                    'headersTruncated': False
+                },
+                'receipt': {
+                    'recipients': recipients,
+                    'spamVerdict': {
+                        'status': header.get_value('X-SES-Spam-Verdict') or
+                        missing
+                    },
+                    'virusVerdict': {
+                        'status': header.get_value('X-SES-Virus-Verdict') or
+                        missing
+                    }
+                }
+            }
+        }]
+    }
+
+
+def get_checkpoint(location, config=None):
+    """
+    Return a checkpoint for backlog progress at location: an
+    s3://bucket/key URL or a local file path.
+    """
+    if location.startswith('s3://'):
+        bucket, _, key = location[len('s3://'):].partition('/')
+        if not bucket or not key:
+            raise SESForwarderError(
+                "Invalid checkpoint location: {}".format(location))
+        return S3Checkpoint(get_client('s3', config), bucket, key)
+    return FileCheckpoint(location)
+
+
+def emit_metrics(timer, config):
+    """
+    Pass the stage timings for one email to METRICS_SINK. A failing
+    sink is logged and otherwise ignored.
+    """
+    if METRICS_SINK is None and not _PROFILES:
+        return
+    namespace = config.get('metricsNamespace', DEFAULT_METRICS_NAMESPACE)
+    try:
+        record = timer.get_record(namespace)
+        for profile in _PROFILES:
+            profile.add_email(record)
+        if METRICS_SINK is not None:
+            METRICS_SINK(record)
+    except Exception as err:  # pylint: disable=broad-except
+        LOGGER.warning("Failed to emit metrics: %s", err)
+
+
+def sample_profile(config, context=None):
+    """
+    Return a Profile for this invocation if the sampling rate picks it,
+    otherwise None.
+    """
+    rate = config.get('profileRate')
+    if rate is None:
+        rate = os.environ.get('FORWARDER_PROFILE_RATE')
+    if not rate or random.random() >= float(rate):
+        return None
+    location = config.get('profileSink') or \
+        os.environ.get('FORWARDER_PROFILE_SINK') or DEFAULT_PROFILE_DIRECTORY
+    return Profile(get_profile_sink(location, config),
+                   getattr(context, 'aws_request_id', None))
+
+
+def get_profile_sink(location, config=None):
+    """
+    Return a sink for profile reports at location: an
+    s3://bucket/prefix URL or a local directory.
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        if not bucket:
+            raise SESForwarderError(
+                "Invalid profile location: {}".format(location))
+        return S3ProfileSink(get_client('s3', config), bucket, prefix)
+    return FileProfileSink(location)
+
+
+def print_metrics(record):
+    """ Write an EMF record to stdout as one line of JSON. """
+    print(json.dumps(record, separators=(',', ':')))
+
+
+METRICS_SINK = print_metrics
+
+
+def _container_start():
+    # 'cold' for the first invocation in this container, 'warm' after.
+    start = 'warm' if _WARM.is_set() else 'cold'
+    _WARM.set()
+    return start
+
+
+def get_config():
+    """
+    Return the configuration. If FORWARDER_CONFIG or
+    FORWARDER_CONFIG_JSON is set, it is loaded from there, validated
+    and cached; otherwise DEFAULT_CONFIG is used.
+    """
+    location = os.environ.get('FORWARDER_CONFIG')
+    if location:
+        key = 'location:' + location
+    elif os.environ.get('FORWARDER_CONFIG_JSON'):
+        key = 'environment'
     else:
-        LOGGER.info("Finishing event, no matching recipients")
+        return DEFAULT_CONFIG
+    cache = _CONFIG_CACHES.get(key)
+    if cache is None:
+        with _CONFIG_CACHES_LOCK:
+            cache = _CONFIG_CACHES.get(key)
+            if cache is None:
+                if location:
+                    source = _config_source(location)
+                else:
+                    source = EnvironmentConfigSource('FORWARDER_CONFIG_JSON')
+                ttl = float(os.environ.get('FORWARDER_CONFIG_TTL',
+                                           DEFAULT_CONFIG_TTL))
+                cache = ConfigCache(source, ttl)
+                _CONFIG_CACHES[key] = cache
+    return cache.get()
+
+
+def _config_source(location):
+    if location.startswith('s3://'):
+        bucket, _, key = location[len('s3://'):].partition('/')
+        if not bucket or not key:
+            raise SESForwarderError(
+                "Invalid config location: {}".format(location))
+        return S3ConfigSource(get_client('s3'), bucket, key)
+    return FileConfigSource(location)
+
+
+def parse_config(text, name=''):
+    """
+    Parse configuration text as YAML if name ends in .yaml or .yml
+    (which needs PyYAML), and as JSON otherwise.
+    """
+    if name.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise SESForwarderError(
+                "PyYAML is needed to read {}".format(name))
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as err:
+            raise SESForwarderError(
+                "Invalid YAML in {0}: {1}".format(name, err))
+    try:
+        return json.loads(text)
+    except ValueError as err:
+        raise SESForwarderError("Invalid JSON in {0}: {1}".format(name, err))
+
+
+def validate_config(raw):
+    """
+    Check that a loaded configuration has what the forwarder needs and
+    return a normalized copy, with the optional keys filled in.
+    """
+    if not isinstance(raw, dict):
+        raise SESForwarderError("Config must be a mapping, got: {}".format(
+            type(raw).__name__))
+    config = dict(raw)
+    if not config.get('emailBucket'):
+        raise SESForwarderError("Config is missing 'emailBucket'.")
+    if config.get('aliasStore') and config.get('forwardMapping') is None:
+        config['forwardMapping'] = {}
+    check_forward_mapping(config.get('forwardMapping'))
+    prefixes = config.get('subjectPrefix') or {}
+    if not isinstance(prefixes, dict):
+        raise SESForwarderError("Config 'subjectPrefix' must be a mapping.")
+    config['subjectPrefix'] = dict(prefixes)
+    config['subjectPrefix'].setdefault('Default', '')
+    config['fromEmail'] = config.get('fromEmail') or ''
+    config['emailKeyPrefix'] = config.get('emailKeyPrefix') or ''
+    # Build the routing index now, so that problems such as a cycle of
+    # groups are reported when the configuration is loaded.
+    get_routing_index(config)
+    return config
+
+
+def check_forward_mapping(mapping):
+    """
+    Check that a forwardMapping is a mapping of aliases to lists of
+    recipients.
+    """
+    if not isinstance(mapping, dict):
+        raise SESForwarderError("Config 'forwardMapping' must be a mapping.")
+    for alias, recipients in mapping.items():
+        if not isinstance(recipients, list):
+            raise SESForwarderError(
+                "Recipients for {} must be a list.".format(alias))
+
+
+def get_client(service, config=None):
+    """
+    Return the shared low-level client for an AWS service, creating it
+    on first use with the settings from get_client_settings. boto3
+    itself is only imported at that point, which keeps it out of the
+    cold-start import.
+    """
+    settings = get_client_settings(config)
+    if service == 'ses':
+        # SESSender retries sends itself, charging the rate limiter for
+        # every attempt, so botocore mustn't retry them as well.
+        settings['maxAttempts'] = 1
+    key = (service, tuple(sorted(settings.items())))
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                import boto3
+                LOGGER.debug("Creating %s client with %s", service, settings)
+                client = boto3.client(service,
+                                      config=_botocore_config(settings))
+                _CLIENTS[key] = client
+    return client
+
+
+def get_client_settings(config=None):
+    """
+    Merge the default client settings with any from the configuration's
+    'clientSettings' and then the environment. The connection pool is
+    made large enough for every concurrent send: each of 'maxWorkers'
+    emails (or 'maxInFlight', for AsyncForwarder) can be sending on
+    'sendWorkers' threads at once.
+    """
+    settings = dict(DEFAULT_CLIENT_SETTINGS)
+    if config:
+        emails = max(config.get('maxWorkers', DEFAULT_MAX_WORKERS),
+                     config.get('maxInFlight', 0))
+        settings['maxPoolConnections'] = max(
+            settings['maxPoolConnections'],
+            emails * config.get('sendWorkers', DEFAULT_SEND_WORKERS))
+        settings.update(config.get('clientSettings', {}))
+    for name, (variable, convert) in CLIENT_SETTINGS_ENVIRONMENT.items():
+        value = os.environ.get(variable)
+        if value:
+            try:
+                settings[name] = convert(value)
+            except ValueError:
+                raise SESForwarderError(
+                    "Invalid value for {0}: {1}".format(variable, value))
+    return settings
+
+
+def _botocore_config(settings):
+    from botocore.config import Config
+    options = {
+        'max_pool_connections': settings['maxPoolConnections'],
+        'connect_timeout': settings['connectTimeout'],
+        'read_timeout': settings['readTimeout'],
+        'retries': {
+            'mode': settings['retryMode'],
+            'max_attempts': settings['maxAttempts']
+        }
+    }
+    # Older versions of botocore don't support TCP keep-alive.
+    if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+        options['tcp_keepalive'] = settings['tcpKeepAlive']
+    return Config(**options)
+
+
+def get_rate_limiter(ses_client, config):
+    """
+    Return the RateLimiter shared by every send in the container, or
+    None if sends aren't paced. Unless 'maxSendRate' is set, the rate is
+    looked up once from the account's send quota. The limiter only
+    paces this container, so the quota is shared out between the
+    'expectedContainers' that may be sending at once (1 by default).
+    """
+    rate = config.get('maxSendRate')
+    containers = max(config.get('expectedContainers', 1), 1)
+    key = ('quota', containers) if rate is None else rate
+    if key in _RATE_LIMITERS:
+        return _RATE_LIMITERS[key]
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            if rate is None:
+                rate = _get_max_send_rate(ses_client)
+                if rate:
+                    rate = rate / float(containers)
+            _RATE_LIMITERS[key] = RateLimiter(rate) if rate else None
+    return _RATE_LIMITERS[key]
+
+
+def _get_max_send_rate(ses_client):
+    try:
+        rate = float(ses_client.get_send_quota()['MaxSendRate'])
+        LOGGER.info("Pacing sends at the SES quota of %s per second", rate)
+        return rate
+    except (botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError,
+            KeyError, TypeError, ValueError) as err:
+        LOGGER.warning("Unable to get the SES send quota, sending without "
+                       "a rate limit: %s", err)
+        return None
+
+
+def get_dedupe_store(config):
+    """
+    Return the dedupe store described by the configuration's 'dedupe'
+    settings, or None if there are none. Stores are created once per
+    container. The settings are:
+
+    * backend: 'memory', 'sqlite' or 'dynamodb'.
+    * path: the SQLite database file.
+    * table: the DynamoDB table, with a string hash key named 'key'.
+    * ttl: seconds to remember a delivery (a day by default).
+    * cacheSize: deliveries kept in the in-memory LRU in front of a
+      durable backend.
+    """
+    settings = config.get('dedupe')
+    if not settings:
+        return None
+    key = json.dumps(settings, sort_keys=True)
+    if key not in _DEDUPE_STORES:
+        with _DEDUPE_STORES_LOCK:
+            if key not in _DEDUPE_STORES:
+                _DEDUPE_STORES[key] = _create_dedupe_store(settings, config)
+    return _DEDUPE_STORES[key]
+
+
+def _create_dedupe_store(settings, config):
+    ttl = settings.get('ttl', DEFAULT_DEDUPE_TTL)
+    cache = MemoryDedupeStore(
+        ttl, settings.get('cacheSize', DEFAULT_DEDUPE_CACHE_SIZE))
+    backend = settings.get('backend', 'memory')
+    if backend == 'memory':
+        return cache
+    if backend == 'sqlite':
+        return TieredDedupeStore(cache,
+                                 SQLiteDedupeStore(settings['path'], ttl))
+    if backend == 'dynamodb':
+        return TieredDedupeStore(cache, DynamoDBDedupeStore(
+            get_client('dynamodb', config), settings['table'], ttl))
+    raise SESForwarderError("Unknown dedupe backend: {}".format(backend))
+
+
+def dedupe_key(message_id, recipients):
+    """ The dedupe store key for one chunk of a message's recipients. """
+    digest = hashlib.sha1(
+        '\n'.join(recipients).lower().encode('utf-8')).hexdigest()
+    return message_id + ':' + digest
+
+
+def open_email(s3_object, config, offset=None):
+    """
+    Start reading the stored email, from offset if given, with the
+    fetch settings in the configuration.
+    """
+    return s3_object.open(
+        'Body',
+        chunk_size=config.get('fetchChunkSize', DEFAULT_CHUNK_SIZE),
+        max_size=config.get('maxEmailSize'),
+        chunk_timeout=config.get('fetchChunkTimeout'),
+        spill_threshold=config.get('spillThreshold', DEFAULT_SPILL_THRESHOLD),
+        spill_directory=config.get('spillDirectory', DEFAULT_SPILL_DIRECTORY),
+        offset=offset)
 
 
 def get_new_recipients(original_recipients, config):
     """ Find the new recipients. """
-    original = [x.lower() for x in original_recipients]
-    new_recipients = []
-    forward_mapping = config['forwardMapping']
-    for recipient in original:
-        if recipient in forward_mapping:
-            new_recipients.extend(forward_mapping[recipient])
-        else:
-            domain = recipient.split('@')[1]
-            if domain in forward_mapping:
-                new_recipients.extend(forward_mapping[domain])
-    new_recipients = list(set(new_recipients))
-    return new_recipients
+    return get_routing_index(config).get_recipients(original_recipients)
+
+
+def get_routing_index(config):
+    """
+    Return the RoutingIndex for the config's forwardMapping. The index
+    is built the first time a mapping is seen and reused by later
+    invocations in the same container, so the mapping should not be
+    modified in place once it is in use. If the config names an
+    'aliasStore', a MappedRoutingIndex of that file is used instead.
+    """
+    path = config.get('aliasStore')
+    if path:
+        cached = _ROUTING_INDEXES.get(path)
+        if cached is None:
+            if len(_ROUTING_INDEXES) >= MAX_ROUTING_INDEXES:
+                _ROUTING_INDEXES.clear()
+            cached = (path, MappedRoutingIndex(path))
+            _ROUTING_INDEXES[path] = cached
+        return cached[1]
+    mapping = config['forwardMapping']
+    cached = _ROUTING_INDEXES.get(id(mapping))
+    if cached is None or cached[0] is not mapping:
+        if len(_ROUTING_INDEXES) >= MAX_ROUTING_INDEXES:
+            _ROUTING_INDEXES.clear()
+        cached = (mapping, RoutingIndex(mapping))
+        _ROUTING_INDEXES[id(mapping)] = cached
+    return cached[1]
+
+
+def get_header_templates(config):
+    """
+    Return the HeaderTemplates for the config's subjectPrefix, fromEmail
+    and stripArcHeaders. Like the routing index, they are built once and
+    reused while the subjectPrefix mapping is the same object.
+    """
+    prefixes = config['subjectPrefix']
+    settings = (config.get('fromEmail') or '',
+                bool(config.get('stripArcHeaders')))
+    cached = _HEADER_TEMPLATES.get(id(prefixes))
+    if cached is None or cached[0] is not prefixes or \
+            cached[1] != settings:
+        if len(_HEADER_TEMPLATES) >= MAX_ROUTING_INDEXES:
+            _HEADER_TEMPLATES.clear()
+        cached = (prefixes, settings, HeaderTemplates(config))
+        _HEADER_TEMPLATES[id(prefixes)] = cached
+    return cached[2]
+
+
+class StageTimer(object):
+    """
+    Times the stages of forwarding one email, and turns them into a
+    CloudWatch Embedded Metric Format record with one metric per stage,
+    in milliseconds. Time spent in a stage more than once is added up.
+    start ('cold' or 'warm') is the record's only dimension.
+    """
+    def __init__(self, start='warm', clock=time.time):
+        self._start = start
+        self._clock = clock
+        self._began = clock()
+        self._stages = OrderedDict()
+        self._properties = {}
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the body of a with statement as the named stage. """
+        began = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = (self._clock() - began) * 1000.0
+            self._stages[name] = self._stages.get(name, 0.0) + elapsed
+
+    def set(self, name, value):
+        """ Add a property, such as the message size, to the record. """
+        self._properties[name] = value
+
+    def get_stages(self):
+        """ Milliseconds spent in each stage so far. """
+        return dict(self._stages)
+
+    def get_record(self, namespace=DEFAULT_METRICS_NAMESPACE):
+        """ The timings so far, as an EMF record. """
+        record = dict(self._properties)
+        metrics = []
+        for name, elapsed in self._stages.items():
+            record[name + 'Time'] = elapsed
+            metrics.append({'Name': name + 'Time', 'Unit': 'Milliseconds'})
+        record['totalTime'] = (self._clock() - self._began) * 1000.0
+        metrics.append({'Name': 'totalTime', 'Unit': 'Milliseconds'})
+        for name, unit in (('messageSize', 'Bytes'), ('recipients', 'Count')):
+            if name in record:
+                metrics.append({'Name': name, 'Unit': unit})
+        record['start'] = self._start
+        record['_aws'] = {
+            'Timestamp': int(self._began * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['start']],
+                'Metrics': metrics
+            }]
+        }
+        return record
+
+
+class Profile(object):
+    """
+    Runs one invocation under cProfile and, where it is available,
+    tracemalloc, and writes a report to a sink: the functions with the
+    most cumulative time, the lines that allocated the most memory, and
+    the size of every email forwarded. Only the calling thread is
+    profiled, so work done on worker threads shows up as time spent
+    waiting for them.
+    """
+    def __init__(self, sink, request_id=None, top=PROFILE_TOP_N,
+                 clock=time.time):
+        self._sink = sink
+        self._request_id = request_id or '{0:08x}'.format(
+            random.getrandbits(32))
+        self._top = top
+        self._clock = clock
+        self._emails = []
+
+    def add_email(self, record):
+        """ Add the size and timings of an email from its EMF record. """
+        self._emails.append(dict(
+            (name, record[name]) for name in
+            ('messageId', 'messageSize', 'recipients', 'totalTime')
+            if name in record))
+
+    def run(self, function, *args):
+        """
+        Call function with args under the profilers, write the report
+        and return the result. A report that can't be written is logged
+        and otherwise ignored.
+        """
+        # Imported here so that they don't slow every cold start.
+        import cProfile
+        import pstats
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+        tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        began = self._clock()
+        report = {'requestId': self._request_id,
+                  'timestamp': int(began * 1000)}
+        _PROFILES.append(self)
+        try:
+            return profiler.runcall(function, *args)
+        except Exception as err:
+            report['error'] = str(err)
+            raise
+        finally:
+            _PROFILES.remove(self)
+            report['elapsedTime'] = (self._clock() - began) * 1000.0
+            report['emails'] = self._emails
+            report['functions'] = self._functions(
+                pstats.Stats(profiler).stats)
+            if tracing:
+                report['peakMemory'] = tracemalloc.get_traced_memory()[1]
+                report['allocations'] = self._allocations(tracemalloc)
+                tracemalloc.stop()
+            self._write(report)
+
+    def _functions(self, stats):
+        slowest = sorted(stats.items(), key=lambda item: item[1][3],
+                         reverse=True)[:self._top]
+        return [{'function': '{0}:{1}({2})'.format(*function),
+                 'calls': calls,
+                 'ownTime': own * 1000.0,
+                 'cumulativeTime': cumulative * 1000.0}
+                for function, (_, calls, own, cumulative, _) in slowest]
+
+    def _allocations(self, tracemalloc):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [{'line': '{0}:{1}'.format(stat.traceback[0].filename,
+                                          stat.traceback[0].lineno),
+                 'size': stat.size,
+                 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:self._top]]
+
+    def _write(self, report):
+        name = '{0}-{1}.json'.format(
+            time.strftime('%Y%m%dT%H%M%S', time.gmtime(
+                report['timestamp'] / 1000.0)), self._request_id)
+        try:
+            location = self._sink.write(name, report)
+            LOGGER.info("Wrote profile to %s", location)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.warning("Failed to write profile: %s", err)
+
+
+class FileProfileSink(object):
+    """ Writes profile reports to files in a local directory. """
+    def __init__(self, directory):
+        self._directory = directory
+
+    def write(self, name, report):
+        """ Write report to the named file and return its path. """
+        path = os.path.join(self._directory, name)
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file)
+        return path
+
+
+class S3ProfileSink(object):
+    """ Writes profile reports to S3, under a key prefix. """
+    def __init__(self, awsStorageClient, bucket, prefix=''):
+        self._client = awsStorageClient
+        self._bucket = bucket
+        self._prefix = prefix
+
+    def write(self, name, report):
+        """ Write report under the prefix and return its URL. """
+        key = self._prefix + name
+        self._client.put_object(Bucket=self._bucket, Key=key,
+                                Body=json.dumps(report).encode('utf-8'))
+        return 's3://{0}/{1}'.format(self._bucket, key)
+
+
+class RoutingIndex(object):
+    """
+    Lookup table compiled from a forwardMapping. Keys are normalized
+    once, when the index is built, so resolving a recipient costs a
+    handful of dictionary lookups whatever the size of the mapping.
+
+    A recipient is matched, in order, against:
+
+    * its exact address ('info@example.com'),
+    * its address without a plus tag ('info+news@example.com' matches
+      'info@example.com'),
+    * its domain and then each parent domain ('example.com' or
+      '@example.com' match 'info@mail.example.com'),
+    * the catch-all key '@', if there is one.
+
+    Groups in the mapping are expanded by expand_groups first, so the
+    cost of a lookup doesn't depend on how deeply they nest.
+    """
+    def __init__(self, forward_mapping):
+        self._addresses = {}
+        self._domains = {}
+        self._catch_all = None
+        for key, recipients in expand_groups(forward_mapping).items():
+            key = _routing_key(key)
+            recipients = tuple(recipients)
+            if key == '@':
+                self._catch_all = recipients
+            elif '@' in key:
+                self._addresses[key] = recipients
+            else:
+                self._domains[key] = recipients
+
+    def __len__(self):
+        return len(self._addresses) + len(self._domains) + \
+            (1 if self._catch_all is not None else 0)
+
+    def lookup(self, recipient):
+        """
+        Return the tuple of addresses the recipient forwards to, or None
+        if nothing in the mapping matches.
+        """
+        found = self._match(recipient)
+        return self._catch_all if found is None else found
+
+    def has_route(self, recipient):
+        """
+        Return True if a key other than the catch-all matches the
+        recipient.
+        """
+        return '@' in recipient and self._match(recipient) is not None
+
+    def _match(self, recipient):
+        return _match_key(self._addresses, self._domains, recipient)
+
+    def get_recipients(self, original_recipients):
+        """
+        Resolve every original recipient and return the new recipients
+        in the order they were found, without duplicates.
+        """
+        seen = set()
+        new_recipients = []
+        for recipient in original_recipients:
+            for new_recipient in self.lookup(recipient) or ():
+                key = new_recipient.lower()
+                if key not in seen:
+                    seen.add(key)
+                    new_recipients.append(new_recipient)
+        return new_recipients
+
+
+def _match_key(addresses, domains, recipient):
+    # The value of the first key to match recipient: its exact address,
+    # its address without a plus tag, then its domain and each parent
+    # domain. addresses and domains are keyed by _routing_key.
+    address = _normalize_address(recipient)
+    found = addresses.get(address)
+    if found is not None:
+        return found
+    local, _, domain = address.rpartition('@')
+    if '+' in local:
+        found = addresses.get(local.split('+', 1)[0] + '@' + domain)
+        if found is not None:
+            return found
+    while domain:
+        found = domains.get(domain)
+        if found is not None:
+            return found
+        domain = domain.partition('.')[2]
+    return None
+
+
+def _normalize_address(address):
+    return address.strip().lower()
+
+
+def _routing_key(key):
+    # The key a forwardMapping entry is indexed under: the address, the
+    # domain without a leading '@', or '@' for the catch-all.
+    key = _normalize_address(key)
+    if key == '@' or '@' in key.lstrip('@'):
+        return key
+    return key.lstrip('@')
+
+
+def expand_groups(forward_mapping, max_depth=MAX_GROUP_DEPTH):
+    """
+    Return a copy of forward_mapping in which every recipient that is
+    itself an address in the mapping (a group, such as 'all@' forwarding
+    to 'admin@' and 'members@') is replaced by that address's
+    recipients, expanded in turn. An address that lists itself is
+    delivered to, not expanded. Each list keeps the order in which
+    recipients were found, without duplicates. Raises
+    SESForwarderError if groups form a cycle or nest more than
+    max_depth deep.
+    """
+    groups = {}
+    for key, recipients in forward_mapping.items():
+        key = _routing_key(key)
+        if key != '@' and '@' in key:
+            groups[key] = recipients
+    # The expanded recipients of each group, and how many levels of
+    # groups it holds, itself included.
+    expanded = {}
+
+    def members(recipients, path):
+        seen = set()
+        result = []
+        depth = 0
+        for recipient in recipients:
+            key = _normalize_address(recipient)
+            if key in groups and key != path[-1]:
+                found, nested = expand(key, path)
+                depth = max(depth, nested)
+            else:
+                found = (recipient,)
+            for member in found:
+                if member.lower() not in seen:
+                    seen.add(member.lower())
+                    result.append(member)
+        return result, depth
+
+    def expand(key, path):
+        if key in path:
+            raise SESForwarderError(
+                "forwardMapping groups form a cycle: {}".format(
+                    ' -> '.join(path[path.index(key):] + [key])))
+        if key not in expanded:
+            found, depth = members(groups[key], path + [key])
+            expanded[key] = (tuple(found), depth + 1)
+        found, depth = expanded[key]
+        if len(path) + depth > max_depth:
+            raise SESForwarderError(
+                "forwardMapping groups nest more than {0} deep, under "
+                "{1}".format(max_depth, ' -> '.join(path + [key])))
+        return found, depth
+
+    return dict((key, members(recipients, [_routing_key(key)])[0])
+                for key, recipients in forward_mapping.items())
+
+
+def compile_alias_store(forward_mapping, path):
+    """
+    Write forward_mapping to path as an alias store, for a
+    MappedRoutingIndex to read, and return the number of keys. Groups
+    are expanded and keys normalized as the RoutingIndex does. The file
+    is replaced in one step, so a running function never sees it half
+    written.
+    """
+    entries = {}
+    for key, recipients in expand_groups(forward_mapping).items():
+        entries[_utf8(_routing_key(key))] = _utf8('\n'.join(recipients))
+    keys = sorted(entries)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as store:
+        store.write(ALIAS_STORE_MAGIC + _ALIAS_HEADER.pack(len(keys)))
+        offset = len(ALIAS_STORE_MAGIC) + _ALIAS_HEADER.size + \
+            _ALIAS_OFFSET.size * len(keys)
+        for key in keys:
+            store.write(_ALIAS_OFFSET.pack(offset))
+            offset += _ALIAS_RECORD.size + len(key) + len(entries[key])
+        for key in keys:
+            store.write(_ALIAS_RECORD.pack(len(key), len(entries[key])))
+            store.write(key + entries[key])
+    os.rename(temporary, path)
+    return len(keys)
+
+
+class AliasStore(object):
+    """
+    A read-only alias store written by compile_alias_store. The file is
+    memory-mapped rather than loaded, and keys are found by a binary
+    search of its offset table, so opening it costs the same however
+    many aliases it holds, and only the pages a lookup touches are read.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as store:
+            self._map = mmap.mmap(store.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        start = len(ALIAS_STORE_MAGIC)
+        if self._map[:start] != ALIAS_STORE_MAGIC:
+            raise SESForwarderError("Not an alias store: {}".format(path))
+        self._count = _ALIAS_HEADER.unpack_from(self._map, start)[0]
+        self._offsets = start + _ALIAS_HEADER.size
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key, default=None):
+        """ The tuple of recipients stored for key, or default. """
+        target = _utf8(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset = _ALIAS_OFFSET.unpack_from(
+                self._map, self._offsets + middle * _ALIAS_OFFSET.size)[0]
+            key_length, value_length = _ALIAS_RECORD.unpack_from(
+                self._map, offset)
+            start = offset + _ALIAS_RECORD.size
+            found = self._map[start:start + key_length]
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                start += key_length
+                value = self._map[start:start + value_length]
+                if not value:
+                    return ()
+                return tuple(value.decode('utf-8').split('\n'))
+        return default
+
+
+class MappedRoutingIndex(RoutingIndex):
+    """
+    A RoutingIndex read from an AliasStore file instead of built from a
+    forwardMapping. Addresses, domains and the catch-all can share the
+    one store, since their keys never collide.
+    """
+    def __init__(self, path):
+        self._store = AliasStore(path)
+        self._addresses = self._store
+        self._domains = self._store
+        self._catch_all = self._store.get('@')
+
+    def __len__(self):
+        return len(self._store)
+
+
+def _utf8(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+class HeaderTemplates(object):
+    """
+    The per-alias parts of a rewritten header, worked out from the
+    configuration once per alias rather than once per email. Aliases
+    are matched against the keys of subjectPrefix the way RoutingIndex
+    matches them: exact address, address without a plus tag, then
+    domain and parent domains, ignoring case and surrounding space.
+    Templates are kept in an LRU of at most max_size aliases.
+    """
+    def __init__(self, config, max_size=MAX_HEADER_TEMPLATES):
+        prefixes = config['subjectPrefix']
+        self._default = _native(prefixes.get('Default', ''))
+        self._addresses = {}
+        self._domains = {}
+        for key, prefix in prefixes.items():
+            if key == 'Default':
+                continue
+            key = _routing_key(key)
+            if '@' in key:
+                self._addresses[key] = _native(prefix)
+            else:
+                self._domains[key] = _native(prefix)
+        self._from_email = _native(config.get('fromEmail') or '')
+        removed = ('reply-to', 'return-path', 'sender') + SIGNATURE_HEADERS
+        if config.get('stripArcHeaders'):
+            removed += ARC_HEADERS
+        self._removed = removed
+        self._max_size = max_size
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, alias):
+        """ The HeaderTemplate for mail sent to alias. """
+        with self._lock:
+            template = self._templates.pop(alias, None)
+            if template is None:
+                prefix = _match_key(self._addresses, self._domains, alias)
+                template = HeaderTemplate(
+                    self._default if prefix is None else prefix,
+                    self._from_email or _native(alias),
+                    self._removed)
+            self._templates[alias] = template
+            while len(self._templates) > self._max_size:
+                self._templates.popitem(last=False)
+            return template
+
+
+class HeaderTemplate(object):
+    """
+    How the header of an email sent to one alias is rewritten: the
+    prefix added to its subject, the address its From field is given,
+    and the fields that are removed.
+    """
+    def __init__(self, subject_prefix, from_address, removed):
+        self.subject_prefix = subject_prefix
+        self.from_address = from_address
+        self._changes = dict((name, None) for name in removed)
+
+    def changes(self, from_value, subject):
+        """
+        The changes to pass to EmailHeader.rewrite for an email with
+        these From and Subject values (subject may be None).
+        """
+        changes = dict(self._changes)
+        name = unfold(from_value).strip(' \r\n\t')
+        name = name.replace('<', 'at ').replace('>', '')
+        changes['from'] = 'From: ' + name + ' <' + self.from_address + '>'
+        if subject is not None:
+            changes['subject'] = 'Subject: ' + self.subject_prefix + subject
+        return changes
+
+
+class ConfigCache(object):
+    """
+    Holds the configuration loaded from a source. The source is only
+    asked for changes once the ttl has passed, and sources only return
+    the configuration if it has changed since it was last loaded. If a
+    refresh fails, the configuration already loaded is kept.
+    """
+    def __init__(self, source, ttl=DEFAULT_CONFIG_TTL, clock=time.time):
+        self._source = source
+        self._ttl = ttl
+        self._clock = clock
+        self._config = None
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """ The current configuration, refreshed if the ttl has passed. """
+        if self._checked is not None and \
+                self._clock() - self._checked < self._ttl:
+            return self._config
+        with self._lock:
+            if self._checked is None or \
+                    self._clock() - self._checked >= self._ttl:
+                self._refresh()
+        return self._config
+
+    def _refresh(self):
+        try:
+            loaded = self._source.fetch(self._version)
+            if loaded is not None:
+                text, version = loaded
+                self._config = validate_config(
+                    parse_config(text, self._source.get_name()))
+                self._version = version
+                LOGGER.info("Loaded config from %s (version %s)",
+                            self._source.get_name(), version)
+        except SESForwarderError as err:
+            if self._config is None:
+                raise
+            LOGGER.error("Keeping the current config, reload failed: %s",
+                         err)
+        self._checked = self._clock()
+
+
+class S3ConfigSource(object):
+    """ Configuration stored as an S3 object, versioned by its ETag. """
+    def __init__(self, awsStorageClient, bucket, key):
+        self._client = awsStorageClient
+        self._bucket = bucket
+        self._key = key
+
+    def get_name(self):
+        """ Where the configuration comes from. """
+        return 's3://{0}/{1}'.format(self._bucket, self._key)
+
+    def fetch(self, version=None):
+        """
+        Return (text, version), or None if the object's ETag still
+        matches version.
+        """
+        kwargs = {'Bucket': self._bucket, 'Key': self._key}
+        if version:
+            kwargs['IfNoneMatch'] = version
+        try:
+            response = self._client.get_object(**kwargs)
+        except botocore.exceptions.ClientError as err:
+            if err.response.get('Error', {}).get('Code') in \
+                    ('304', 'NotModified'):
+                return None
+            raise SESForwarderError("Failed to get config {0}: {1}".format(
+                self.get_name(), err))
+        except botocore.exceptions.BotoCoreError as err:
+            raise SESForwarderError("Failed to get config {0}: {1}".format(
+                self.get_name(), err))
+        return response['Body'].read(), response.get('ETag')
+
+
+class FileConfigSource(object):
+    """ Configuration in a local file, versioned by size and mtime. """
+    def __init__(self, path):
+        self._path = path
+
+    def get_name(self):
+        """ Where the configuration comes from. """
+        return self._path
+
+    def fetch(self, version=None):
+        """
+        Return (text, version), or None if the file hasn't changed
+        since version.
+        """
+        try:
+            stat = os.stat(self._path)
+            current = '{0}:{1}'.format(stat.st_size, stat.st_mtime)
+            if current == version:
+                return None
+            with open(self._path) as config_file:
+                return config_file.read(), current
+        except (IOError, OSError) as err:
+            raise SESForwarderError("Failed to read config {0}: {1}".format(
+                self._path, err))
+
+
+class S3Checkpoint(object):
+    """ Backlog progress saved as a JSON document in S3. """
+    def __init__(self, awsStorageClient, bucket, key):
+        self._client = awsStorageClient
+        self._bucket = bucket
+        self._key = key
+
+    def load(self):
+        """ Return the saved progress, or {} if there is none yet. """
+        try:
+            response = self._client.get_object(Bucket=self._bucket,
+                                               Key=self._key)
+        except botocore.exceptions.ClientError as err:
+            if err.response.get('Error', {}).get('Code') in \
+                    ('404', 'NoSuchKey'):
+                return {}
+            raise SESForwarderError(
+                "Failed to read checkpoint s3://{0}/{1}: {2}".format(
+                    self._bucket, self._key, err))
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def save(self, state):
+        """ Replace the saved progress with state. """
+        self._client.put_object(Bucket=self._bucket, Key=self._key,
+                                Body=json.dumps(state).encode('utf-8'))
+
+
+class FileCheckpoint(object):
+    """ Backlog progress saved as a JSON document in a local file. """
+    def __init__(self, path):
+        self._path = path
+
+    def load(self):
+        """ Return the saved progress, or {} if there is none yet. """
+        if not os.path.exists(self._path):
+            return {}
+        with open(self._path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def save(self, state):
+        """
+        Replace the saved progress with state. The file is replaced in
+        one step, so a crash can't leave it half written.
+        """
+        temporary = self._path + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.rename(temporary, self._path)
+
+
+class EnvironmentConfigSource(object):
+    """ Configuration as JSON in an environment variable. """
+    def __init__(self, variable):
+        self._variable = variable
+
+    def get_name(self):
+        """ Where the configuration comes from. """
+        return self._variable
+
+    def fetch(self, version=None):
+        """
+        Return (text, version), or None if the variable hasn't changed
+        since version.
+        """
+        text = os.environ.get(self._variable, '')
+        encoded = text if isinstance(text, bytes) else text.encode('utf-8')
+        current = hashlib.sha1(encoded).hexdigest()
+        if current == version:
+            return None
+        return text, current
 
 
 class SESForwarderError(Exception):
@@ -106,77 +1892,479 @@ class SESForwarderError(Exception):
         return repr(self.value)
 
 
+class SESSendError(SESForwarderError):
+    """ Some chunks of a send failed. chunks holds every chunk's result. """
+    def __init__(self, value, chunks):
+        super(SESSendError, self).__init__(value)
+        self.chunks = chunks
+
+    def get_failed_recipients(self):
+        """ The recipients whose chunks failed. """
+        return [recipient for chunk in self.chunks if 'Error' in chunk
+                for recipient in chunk['Destinations']]
+
+
 class SESEmailEvent(object):
-    """ Wraps an event with some simple getters."""
-    def __init__(self, event):
+    """ Wraps one record of an event with some simple getters."""
+    def __init__(self, event, record=0):
         self._event = event
+        self._record = record
         if not self._validate_event():
             raise SESForwarderError("Invalid event: {}".format(event))
 
     def get_email(self):
         """ return just the email part of the event"""
-        return self._event['Records'][0]['ses']['mail']
+        return self._get_record()['ses']['mail']
 
     def get_recipients(self):
         """ Return just the recipients part of the event."""
-        return self._event['Records'][0]['ses']['receipt']['recipients']
+        return self._get_record()['ses']['receipt']['recipients']
+
+    def get_headers(self):
+        """
+        Return the email's header fields as a list of dicts with 'name'
+        and 'value', or None if SES didn't include all of them.
+        """
+        mail = self.get_email()
+        if mail.get('headersTruncated') or not mail.get('headers'):
+            return None
+        return mail['headers']
 
     def is_spam(self):
         """ Return whether this may be spam."""
-        evnt = self._event
-        stat = evnt['Records'][0]['ses']['receipt']['spamVerdict']['status']
+        stat = self._get_record()['ses']['receipt']['spamVerdict']['status']
         return stat != "PASS"
 
     def is_virus(self):
         """ Return whether this may contain a virus."""
-        evnt = self._event
-        stat = evnt['Records'][0]['ses']['receipt']['virusVerdict']['status']
+        stat = self._get_record()['ses']['receipt']['virusVerdict']['status']
         return stat != "PASS"
 
+    def _get_record(self):
+        return self._event['Records'][self._record]
+
     def _validate_event(self):
         """ Ensure that we have the bits we need. """
         if 'Records' in self._event:
-            if len(self._event['Records']) > 0:
-                record = self._event['Records'][0]
+            if len(self._event['Records']) > self._record:
+                record = self._get_record()
                 if 'eventSource' in record and 'eventVersion' in record:
                     return record['eventSource'] == 'aws:ses'
 
 
+def _chunk_result(chunk, response):
+    result = {'Destinations': chunk, 'MessageId': response['MessageId']}
+    if response.get('Duplicate'):
+        result['Duplicate'] = True
+    return result
+
+
 class SESSender(object):
     """Wraps sending functionality for dependency injection during
        testing."""
-    def __init__(self, awsClient, logger):
+    def __init__(self, awsClient, logger, max_workers=DEFAULT_SEND_WORKERS,
+                 chunk_size=MAX_DESTINATIONS, rate_limiter=None,
+                 max_retries=DEFAULT_THROTTLE_RETRIES,
+                 backoff=DEFAULT_THROTTLE_BACKOFF, dedupe_store=None):
         self._client = awsClient
         self._logger = logger
         self._email = None
+        self._max_workers = max_workers
+        self._chunk_size = min(chunk_size, MAX_DESTINATIONS)
+        self._rate_limiter = rate_limiter
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._dedupe_store = dedupe_store
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'sends': 0,
+            'throttled': 0,
+            'waitTime': 0.0,
+            'sendTime': 0.0
+        }
 
-    def send(self, recipients, original_recipient):
-        """ Send the email to the specified recipients. """
+    def send(self, recipients, original_recipient, per_recipient=False,
+             message_id=None):
+        """
+        Send the email to the specified recipients. If there are more
+        recipients than SES accepts in one call, they are split into
+        chunks that are sent concurrently. With per_recipient, every
+        recipient is sent their own copy, in a chunk of one. Returns
+        the first chunk's 'MessageId' and a 'Chunks' list with the
+        'Destinations' and 'MessageId' of every chunk, however many
+        there are. If any of several chunks fails, SESSendError is
+        raised with the result of every chunk; a single chunk's error
+        is raised as it is. If there is a dedupe store, chunks already
+        delivered for message_id are skipped and marked 'Duplicate', so
+        a retry of the whole send only sends the chunks that failed.
+        """
         if not self._email:
             raise SESForwarderError("No email set before sending.")
+        size = 1 if per_recipient else self._chunk_size
+        chunks = [recipients[i:i + size]
+                  for i in range(0, len(recipients), size)]
+        if len(chunks) <= 1:
+            result = _chunk_result(recipients, self._send_chunk(
+                recipients, original_recipient, message_id))
+            return {'MessageId': result['MessageId'], 'Chunks': [result]}
+
+        self._logger.info("Sending to %d recipients in %d chunks",
+                          len(recipients), len(chunks))
+        workers = max(min(self._max_workers, len(chunks)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [(chunk, pool.submit(self._send_chunk, chunk,
+                                           original_recipient, message_id))
+                       for chunk in chunks]
+            results = []
+            for chunk, future in futures:
+                try:
+                    results.append(_chunk_result(chunk, future.result()))
+                except (botocore.exceptions.BotoCoreError,
+                        botocore.exceptions.ClientError) as err:
+                    results.append({'Destinations': chunk,
+                                    'Error': str(err)})
+
+        failed = [result for result in results if 'Error' in result]
+        if failed:
+            error = SESSendError(
+                "Failed to send {0} of {1} chunks.".format(len(failed),
+                                                          len(results)),
+                results)
+            self._logger.error("Not sent to %s", error.get_failed_recipients())
+            raise error
+        return {'MessageId': results[0]['MessageId'], 'Chunks': results}
+
+    def get_metrics(self):
+        """
+        Return counts of sends and throttled attempts, and the seconds
+        spent waiting (for the rate limiter or backing off) and sending.
+        """
+        with self._metrics_lock:
+            return dict(self._metrics)
+
+    def _send_chunk(self, recipients, original_recipient, message_id=None):
+        key = None
+        if self._dedupe_store is not None and message_id:
+            key = dedupe_key(message_id, recipients)
+            delivered = self._get_delivered(key)
+            if delivered:
+                self._logger.info("Skipping %s, already delivered as %s",
+                                  recipients, delivered)
+                return {'MessageId': delivered, 'Duplicate': True}
+        self._logger.debug("Sending email from: %s", original_recipient)
+        self._logger.debug("Sending destination: %s", recipients)
+        self._logger.debug("Sending email: %s", self._email)
+        response = self._send_raw(recipients, original_recipient)
+        if key:
+            self._set_delivered(key, response['MessageId'])
+        return response
+
+    def _get_delivered(self, key):
+        # A store that can't be reached mustn't stop mail being sent.
         try:
-            self._logger.debug("Sending email from: %s", original_recipient)
-            self._logger.debug("Sending destination: %s", recipients)
-            self._logger.debug("Sending email: %s", self._email)
-            return self._client.send_raw_email(
-                Destinations=recipients,
-                Source=original_recipient,
-                RawMessage={
-                    'Data': self._email
-                })
-        except botocore.exceptions.ClientError as err:
-            self._logger.error("Failed to send message. Error: %s", err)
-            raise
+            return self._dedupe_store.get(key)
+        except SESForwarderError as err:
+            self._logger.warning("Unable to check dedupe store: %s", err)
+            return None
+
+    def _set_delivered(self, key, ses_message_id):
+        try:
+            self._dedupe_store.put(key, ses_message_id)
+        except SESForwarderError as err:
+            self._logger.warning("Unable to update dedupe store: %s", err)
+
+    def _send_raw(self, recipients, original_recipient):
+        attempt = 0
+        while True:
+            waited = 0.0
+            if self._rate_limiter:
+                # SES counts every recipient against the send rate.
+                waited = self._rate_limiter.acquire(len(recipients))
+            start = time.time()
+            try:
+                response = self._client.send_raw_email(
+                    Destinations=recipients,
+                    Source=original_recipient,
+                    RawMessage={
+                        'Data': self._email
+                    })
+                self._record(waited, time.time() - start, sends=1)
+                return response
+            except (botocore.exceptions.ClientError,
+                    botocore.exceptions.EndpointConnectionError) as err:
+                elapsed = time.time() - start
+                throttled = _is_throttling(err)
+                if not (throttled or _is_transient(err)) or \
+                        attempt >= self._max_retries:
+                    self._record(waited, elapsed)
+                    self._logger.error("Failed to send message. Error: %s",
+                                       err)
+                    raise
+                delay = random.uniform(
+                    0, min(MAX_THROTTLE_BACKOFF, self._backoff * 2 ** attempt))
+                self._logger.warning("Send failed, retrying in %.2fs: %s",
+                                     delay, err)
+                self._record(waited + delay, elapsed,
+                             throttled=1 if throttled else 0)
+                time.sleep(delay)
+                attempt += 1
+
+    def _record(self, waited, sending, sends=0, throttled=0):
+        with self._metrics_lock:
+            self._metrics['sends'] += sends
+            self._metrics['throttled'] += throttled
+            self._metrics['waitTime'] += waited
+            self._metrics['sendTime'] += sending
 
     def set_email(self, email):
-        """ Set the email to be sent."""
-        self._email = bytearray(email, 'utf-8')
+        """
+        Set the email to be sent. Bytes-like emails are used as they
+        are, without a copy; text is encoded as UTF-8.
+        """
+        if not isinstance(email, (bytes, bytearray, memoryview, mmap.mmap)):
+            email = bytearray(email, 'utf-8')
+        self._email = email
 
     def get_email(self):
         """ Get the currently set email."""
         return self._email
 
 
+def _is_throttling(err):
+    if not isinstance(err, botocore.exceptions.ClientError):
+        return False
+    error = err.response.get('Error', {})
+    # SES reports an exhausted daily quota as Throttling too, but that
+    # won't clear by backing off.
+    return error.get('Code') in THROTTLING_ERRORS and \
+        'daily' not in error.get('Message', '').lower()
+
+
+def _is_transient(err):
+    # An error SES may not return next time: a 5xx response, or no
+    # connection at all, in which case nothing was sent.
+    if isinstance(err, botocore.exceptions.EndpointConnectionError):
+        return True
+    status = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status in TRANSIENT_STATUS_CODES
+
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket. Tokens are added at rate per second, up
+    to a burst of one second's worth. A request for more tokens than the
+    bucket holds waits for a full bucket and leaves it in debt, so large
+    requests are still paced correctly.
+    """
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self._rate = float(rate)
+        self._capacity = max(self._rate, 1.0)
+        self._tokens = self._capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self._waited = 0.0
+
+    def acquire(self, tokens=1):
+        """ Wait until tokens are available and return the seconds waited. """
+        needed = min(tokens, self._capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self._capacity, self._tokens +
+                                   (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    self._waited += waited
+                    return waited
+                delay = (needed - self._tokens) / self._rate
+            self._sleep(delay)
+            waited += delay
+
+    def get_rate(self):
+        """ Tokens added per second. """
+        return self._rate
+
+    def get_total_wait(self):
+        """ Seconds every caller has spent waiting for tokens. """
+        return self._waited
+
+
+class MemoryDedupeStore(object):
+    """
+    Dedupe store held in memory, as an LRU of at most max_size entries.
+    Entries expire ttl seconds after they were written.
+    """
+    def __init__(self, ttl=DEFAULT_DEDUPE_TTL,
+                 max_size=DEFAULT_DEDUPE_CACHE_SIZE, clock=time.time):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ The SES MessageId the key was delivered as, or None. """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= self._clock():
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, ses_message_id, expires=None):
+        """ Record that key was delivered as ses_message_id. """
+        if expires is None:
+            expires = self._clock() + self._ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (ses_message_id, expires)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+class SQLiteDedupeStore(object):
+    """
+    Dedupe store in a local SQLite database. Expired entries are
+    deleted as new ones are written.
+    """
+    def __init__(self, path, ttl=DEFAULT_DEDUPE_TTL, clock=time.time):
+        # Imported here so that other stores don't pay for it.
+        import sqlite3
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._error = sqlite3.Error
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS delivered ("
+                             "key TEXT PRIMARY KEY, "
+                             "message_id TEXT NOT NULL, "
+                             "expires REAL NOT NULL)")
+            # Expired entries are deleted on every put, so find them
+            # without scanning the table.
+            self._db.execute("CREATE INDEX IF NOT EXISTS delivered_expires "
+                             "ON delivered (expires)")
+            self._db.commit()
+        except sqlite3.Error as err:
+            raise SESForwarderError(
+                "Failed to open dedupe database {0}: {1}".format(path, err))
+
+    def get(self, key):
+        """ The SES MessageId the key was delivered as, or None. """
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key):
+        """ (SES MessageId, expiry time) for the key, or None. """
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT message_id, expires FROM delivered "
+                    "WHERE key = ? AND expires > ?",
+                    (key, self._clock())).fetchone()
+            except self._error as err:
+                raise SESForwarderError(
+                    "Failed to read dedupe database: {}".format(err))
+        return tuple(row) if row else None
+
+    def put(self, key, ses_message_id):
+        """ Record that key was delivered as ses_message_id. """
+        now = self._clock()
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM delivered WHERE expires <= ?",
+                                 (now,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO delivered VALUES (?, ?, ?)",
+                    (key, ses_message_id, now + self._ttl))
+                self._db.commit()
+            except self._error as err:
+                raise SESForwarderError(
+                    "Failed to write dedupe database: {}".format(err))
+
+
+class DynamoDBDedupeStore(object):
+    """
+    Dedupe store in a DynamoDB table with a string hash key named 'key'.
+    Items carry their expiry time in 'expires', which can be used as
+    the table's TTL attribute so that DynamoDB deletes them.
+    """
+    def __init__(self, awsClient, table, ttl=DEFAULT_DEDUPE_TTL,
+                 clock=time.time):
+        self._client = awsClient
+        self._table = table
+        self._ttl = ttl
+        self._clock = clock
+
+    def get(self, key):
+        """ The SES MessageId the key was delivered as, or None. """
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key):
+        """ (SES MessageId, expiry time) for the key, or None. """
+        try:
+            item = self._client.get_item(TableName=self._table,
+                                         Key={'key': {'S': key}},
+                                         ConsistentRead=True).get('Item')
+        except (botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError) as err:
+            raise SESForwarderError(
+                "Failed to read dedupe table {0}: {1}".format(self._table,
+                                                              err))
+        # DynamoDB removes expired items lazily, so check the expiry.
+        if not item or float(item['expires']['N']) <= self._clock():
+            return None
+        return item['messageId']['S'], float(item['expires']['N'])
+
+    def put(self, key, ses_message_id):
+        """ Record that key was delivered as ses_message_id. """
+        expires = int(self._clock() + self._ttl)
+        try:
+            self._client.put_item(TableName=self._table, Item={
+                'key': {'S': key},
+                'messageId': {'S': ses_message_id},
+                'expires': {'N': str(expires)}
+            })
+        except (botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError) as err:
+            raise SESForwarderError(
+                "Failed to write dedupe table {0}: {1}".format(self._table,
+                                                               err))
+
+
+class TieredDedupeStore(object):
+    """
+    An in-memory store in front of a durable one. Lookups are answered
+    from memory when possible, and writes go to both.
+    """
+    def __init__(self, cache, backend):
+        self._cache = cache
+        self._backend = backend
+
+    def get(self, key):
+        """ The SES MessageId the key was delivered as, or None. """
+        found = self._cache.get(key)
+        if found is None:
+            entry = self._backend.get_entry(key)
+            if entry:
+                found = entry[0]
+                self._cache.put(key, found, entry[1])
+        return found
+
+    def put(self, key, ses_message_id):
+        """ Record that key was delivered as ses_message_id. """
+        self._backend.put(key, ses_message_id)
+        self._cache.put(key, ses_message_id)
+
+
 class S3Object(object):
     """Wraps getting an object from an S3 bucket for dependency injection
        during testing."""
@@ -188,8 +2376,54 @@ class S3Object(object):
     def get(self, section):
         """ Return the specified section of the object as a blob"""
         try:
-            return self._client.Object(
-                self._bucket, self._id).get()[section].read()
+            return self._client.get_object(
+                Bucket=self._bucket, Key=self._id)[section].read()
+        except botocore.exceptions.ClientError:
+            raise SESForwarderError(
+                "Failed to get object from s3 bucket: {0}, key: {1}".format(
+                    self._bucket, self._id))
+
+    def open(self, section, chunk_size=DEFAULT_CHUNK_SIZE,
+             max_size=None, chunk_timeout=None, spill_threshold=None,
+             spill_directory=DEFAULT_SPILL_DIRECTORY, offset=None):
+        """
+        Start a streaming read of the specified section of the object
+        and return it as an S3Download. Nothing beyond the response
+        headers is read until the download is iterated. If the object
+        is larger than spill_threshold, it is read into a temporary
+        file in spill_directory instead of memory. If offset is given,
+        only the object from that byte onwards is read.
+        """
+        kwargs = {}
+        if offset:
+            kwargs['Range'] = 'bytes={0}-'.format(offset)
+        try:
+            response = self._client.get_object(Bucket=self._bucket,
+                                               Key=self._id, **kwargs)
+        except botocore.exceptions.ClientError:
+            raise SESForwarderError(
+                "Failed to get object from s3 bucket: {0}, key: {1}".format(
+                    self._bucket, self._id))
+        length = response.get('ContentLength')
+        if spill_threshold is not None and length is not None and \
+                length > spill_threshold:
+            return SpilledDownload(response[section], length,
+                                   self._bucket, self._id,
+                                   chunk_size, max_size, chunk_timeout,
+                                   directory=spill_directory)
+        return S3Download(response[section], length,
+                          self._bucket, self._id,
+                          chunk_size, max_size, chunk_timeout)
+
+    def get_start(self, section, size):
+        """
+        Return the first size bytes of the specified section of the
+        object as a blob, fetched with a ranged GET.
+        """
+        try:
+            return self._client.get_object(
+                Bucket=self._bucket, Key=self._id,
+                Range='bytes=0-{0}'.format(size - 1))[section].read()
         except botocore.exceptions.ClientError:
             raise SESForwarderError(
                 "Failed to get object from s3 bucket: {0}, key: {1}".format(
@@ -204,15 +2438,205 @@ class S3Object(object):
         return self._id
 
 
+class S3Download(object):
+    """
+    A bounded, chunked read of an S3 object body. The body is read
+    into a single buffer, sized up front from ContentLength, one chunk
+    at a time. Iterating yields each chunk as it arrives, so callers can
+    start work before the whole object has been downloaded. The buffer
+    starts with headroom bytes of free space, so a rewritten header can
+    be put in front of the body without moving it.
+    """
+    def __init__(self, stream, content_length, bucket, objectId,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_size=None,
+                 chunk_timeout=None, headroom=DEFAULT_HEADROOM):
+        if max_size is not None and content_length is not None and \
+                content_length > max_size:
+            raise SESForwarderError(
+                "Object too large: {0} bytes, limit {1}. Bucket: {2}, "
+                "key: {3}".format(content_length, max_size,
+                                  bucket, objectId))
+        self._stream = stream
+        self._length = content_length
+        self._bucket = bucket
+        self._id = objectId
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._start = headroom
+        self._buffer = self._allocate(headroom + (content_length or 0))
+        self._read = 0
+        self._done = False
+        if chunk_timeout is not None and \
+                hasattr(stream, 'set_socket_timeout'):
+            stream.set_socket_timeout(chunk_timeout)
+
+    def __iter__(self):
+        while not self._done:
+            chunk = self._read_chunk()
+            if chunk:
+                yield chunk
+
+    def read_all(self):
+        """
+        Read whatever is left and return the whole body, as a
+        memoryview of the buffer rather than a copy.
+        """
+        for _ in self:
+            pass
+        return _view(self._buffer, self._start, self._start + self._read)
+
+    def splice(self, header, body_offset):
+        """
+        Read whatever is left, replace everything before body_offset
+        with header and return the result. The header is written into
+        the buffer just in front of the body, which is then trimmed in
+        place, so the body is never copied and the download can't be
+        reused.
+        """
+        self.read_all()
+        body = self._start + body_offset
+        if len(header) > body:
+            # Not enough room in front of the body, so copy it once.
+            return _join_message(header, memoryview(self._buffer)[body:])
+        self._buffer[body - len(header):body] = header
+        del self._buffer[:body - len(header)]
+        return self._buffer
+
+    def get_bytes_read(self):
+        """ Number of bytes received so far. """
+        return self._read
+
+    def get_content_length(self):
+        """ Size of the object, as reported by S3. """
+        return self._length
+
+    def _read_chunk(self):
+        try:
+            chunk = self._stream.read(self._chunk_size)
+        except (socket.timeout, botocore.exceptions.ReadTimeoutError):
+            raise SESForwarderError(
+                "Timed out reading s3 object after {0} of {1} bytes. "
+                "Bucket: {2}, key: {3}".format(self._read, self._length,
+                                               self._bucket, self._id))
+        if not chunk:
+            self._done = True
+            if self._length is not None and self._read != self._length:
+                raise SESForwarderError(
+                    "Incomplete read of s3 object: {0} of {1} bytes. "
+                    "Bucket: {2}, key: {3}".format(
+                        self._read, self._length, self._bucket, self._id))
+            return chunk
+        end = self._read + len(chunk)
+        limit = self._length if self._length is not None else self._max_size
+        if limit is not None and end > limit:
+            raise SESForwarderError(
+                "Read past the expected {0} bytes of s3 object. "
+                "Bucket: {1}, key: {2}".format(limit, self._bucket, self._id))
+        self._store(chunk)
+        self._read = end
+        return chunk
+
+    def _allocate(self, size):
+        return bytearray(size)
+
+    def _store(self, chunk):
+        if self._length is not None:
+            start = self._start + self._read
+            self._buffer[start:start + len(chunk)] = chunk
+        else:
+            self._buffer.extend(chunk)
+
+
+class SpilledDownload(S3Download):
+    """
+    An S3Download that is written to an unnamed temporary file, for
+    objects too large to hold in memory. Chunks read by iterating, such
+    as the header, are kept in memory until the download is spliced or
+    read in full; the rest goes straight to the file, which is then
+    memory-mapped so its pages can be dropped and read back as needed.
+    """
+    def __init__(self, stream, content_length, bucket, objectId,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_size=None,
+                 chunk_timeout=None, directory=DEFAULT_SPILL_DIRECTORY):
+        self._directory = directory
+        self._pending = []
+        self._file = None
+        self._map = None
+        super(SpilledDownload, self).__init__(
+            stream, content_length, bucket, objectId, chunk_size,
+            max_size, chunk_timeout, headroom=0)
+
+    def read_all(self):
+        """
+        Read whatever is left and return the whole body, as a view of
+        the memory-mapped file.
+        """
+        if self._map is None:
+            self._spill(b'', 0)
+        return _view(self._map, 0, len(self._map))
+
+    def splice(self, header, body_offset):
+        """
+        Write header and then the body to the file, and return the
+        memory-mapped result. The map is a bytes-like, file-like object
+        that can be sent as it is.
+        """
+        if self._map is not None:
+            # Already read in full, so copy the body once.
+            return _join_message(header, _view(self._map, body_offset,
+                                               len(self._map)))
+        self._spill(header, body_offset)
+        return self._map
+
+    def _allocate(self, size):
+        return None
+
+    def _store(self, chunk):
+        if self._file is None:
+            self._pending.append(chunk)
+        else:
+            self._file.write(chunk)
+
+    def _spill(self, header, skip):
+        self._file = tempfile.TemporaryFile(dir=self._directory)
+        self._file.write(header)
+        for chunk in self._pending:
+            if skip < len(chunk):
+                self._file.write(chunk[skip:])
+            skip = max(skip - len(chunk), 0)
+        self._pending = []
+        for _ in self:
+            pass
+        self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._file.close()
+
+
 class SESEmail(object):
-    """ Wraps the email and methods to transform it.  """
+    """
+    Wraps the email and methods to transform it. The email can be given
+    as bytes or as an S3Download. Only the header is decoded and
+    rewritten; the body is passed through as bytes. Given an S3Object
+    instead, the header is taken from the event, and only the body is
+    fetched, when the email is first rendered.
+    """
     def __init__(self, emailS3Blob, event,
                  sender, config, logger):
-        whole = emailS3Blob.split('\r\n')
-        start_body = whole.index('')
-        self._header = whole[0:start_body]
-        self._body = whole[start_body:]
+        self._message = None
         self._event = event
+        self._object = None
+        self._data = None
+        self._download = None
+        if hasattr(emailS3Blob, 'read_all'):
+            self._download = emailS3Blob
+            self._header = self._read_header(emailS3Blob)
+        elif hasattr(emailS3Blob, 'open'):
+            self._object = emailS3Blob
+            self._header = EmailHeader(
+                _event_header_lines(event.get_headers()))
+        else:
+            self._data = emailS3Blob
+            self._header = self._parse_header(emailS3Blob)
         self._recipients = get_new_recipients(event.get_recipients(), config)
         self._sender = sender
         self._config = config
@@ -220,99 +2644,324 @@ class SESEmail(object):
         self._rewrite_header()
 
     def email(self):
-        """ Return the processed email. """
-        result = '\r\n'.join(self._header) + '\r\n' + '\r\n'.join(self._body)
-        # Remove all DKIM-Signature headers, since we've modified the
-        # message and they'll be invalid anyway. We have to do this with
-        # regular expressions because they span lines.
-        pattern = re.compile(r"DKIM-Signature: .+\r\n(\s+.+\r\n)+",
-                             re.MULTILINE)
-        return pattern.sub("", result)
-
-    def send(self):
-        """ Send the email. """
+        """
+        Return the processed email: a bytearray, or the memory-mapped
+        file for a SpilledDownload. The rewritten header is
+        the only part that is newly encoded. When the email came from an
+        S3Download, the header is written into the download's buffer
+        just in front of the body, so the body is never copied and the
+        download can't be reused.
+        """
+        if self._message is None:
+            header = _header_bytes(self._header.render() + '\r\n')
+            if self._object is not None:
+                self._download = self._open_body()
+            if self._download is not None:
+                self._message = self._download.splice(header,
+                                                      self._body_offset)
+            else:
+                self._message = _join_message(
+                    header, memoryview(self._data)[self._body_offset:])
+        return self._message
+
+    def send(self, per_recipient=None):
+        """
+        Send the email. Each recipient gets a separate copy if
+        per_recipient is set or, when it is None, if one of the original
+        recipients is listed in the configuration's
+        'perRecipientDelivery'.
+        """
         self._sender.set_email(self.email())
         self._logger.info("Sending email. New: %s, Original: %s",
                           self._recipients,
                           self._event.get_recipients())
+        if per_recipient is None:
+            per_recipient = self._is_per_recipient()
         if len(self._recipients) and len(self._event.get_recipients()):
             return self._sender.send(self._recipients,
-                                     self._event.get_recipients()[0])
+                                     self._event.get_recipients()[0],
+                                     per_recipient,
+                                     self._event.get_email().get('messageId'))
         else:
             raise SESForwarderError(
                 "Attempt to send with no recipients or original_recipients.")
 
+    def _is_per_recipient(self):
+        aliases = self._config.get('perRecipientDelivery')
+        if aliases is True or not aliases:
+            return bool(aliases)
+        aliases = set(_normalize_address(alias) for alias in aliases)
+        return any(_normalize_address(recipient) in aliases
+                   for recipient in self._event.get_recipients())
+
+    def _parse_header(self, data):
+        end = data.find(b'\r\n\r\n')
+        if end < 0:
+            if not data.endswith(b'\r\n'):
+                raise SESForwarderError(
+                    "Unable to find the end of the header.")
+            end = len(data) - 2
+        self._body_offset = end + 2
+        return EmailHeader(_header_text(data[:end]).split('\r\n'))
+
+    def _read_header(self, download):
+        received = self._find_body(download)
+        return EmailHeader(
+            _header_text(received[:self._body_offset - 2]).split('\r\n'))
+
+    def _find_body(self, download):
+        # Only consume chunks until the blank line ending the header
+        # has arrived; the body is read when the email is rendered.
+        received = b''
+        for chunk in download:
+            received += chunk
+            end = received.find(b'\r\n\r\n')
+            if end >= 0:
+                self._body_offset = end + 2
+                return received
+        if not received.endswith(b'\r\n'):
+            raise SESForwarderError("Unable to find the end of the header.")
+        self._body_offset = len(received)
+        return received
+
+    def _open_body(self):
+        # The stored header is usually at least as long as the event's
+        # fields written out without folding, so fetch from a little
+        # before where that puts the blank line ending it, and skip to
+        # it. The estimate is wrong if the event's values take more
+        # bytes than the stored ones (8-bit text that SES decoded, for
+        # example): then the blank line found is in the body. So the
+        # header must be seen to end with the last field's value, or
+        # the whole message is fetched instead.
+        headers = self._event.get_headers()
+        tail = _header_tail(headers[-1])
+        offset = _event_header_size(headers) - 2 - len(tail) - 2
+        if offset > 0:
+            download = open_email(self._object, self._config, offset)
+            received = self._find_body(download)
+            if received[:self._body_offset - 2].rstrip(b' \t').endswith(
+                    tail):
+                return download
+            self._logger.info("Header doesn't end at %d, fetching the "
+                              "whole email", offset)
+        download = open_email(self._object, self._config)
+        self._find_body(download)
+        return download
+
     def _rewrite_header(self):
-        self._add_reply_to()
-        self._replace_from()
-        self._add_subject_prefix()
-        self._remove_return_path()
-        self._remove_sender_header()
-
-    def _add_reply_to(self):
-        prev_reply_to = self._get_header_section('Reply-To: ')
-        if len(prev_reply_to) > 0:
-            # remove any existing reply-to header
-            self._logger.info("removing exist reply-to header: %s",
-                              prev_reply_to)
-            self._header = self._remove_header_section('Reply-To: ')
-        from_line = self._get_header_section('From: ')
-        if len(from_line) > 0:
-            reply_to = 'Reply-To: ' + from_line[0].replace('From: ', '')
-            self._logger.info("Adding Reply-To to the header: %s",
-                              reply_to)
-            self._header.append(reply_to)
-        else:
-            self._logger.error("Unable to extract From address.")
-
-    def _replace_from(self):
-        # Replace the message's From: and Return-Path: headers with
-        # either the hard-coded from address from the configuration or
-        # the first, original recipient. Either is a verified
-        # domain. SES won't let us send from an unverified "From"
-        # address, so error out if this fails.
-        from_line = self._get_header_section('From: ')
-        if not len(self._event.get_recipients()) or len(from_line) == 0:
+        # Work out every change from the parsed header first, then
+        # apply them all in a single pass over the fields.
+        from_value = self._header.get_value('From')
+        if not len(self._event.get_recipients()) or from_value is None:
+            if from_value is None:
+                self._logger.error("Unable to extract From address.")
             raise SESForwarderError(
                 "Failed to rewrite 'from' address. Header: {}".format(
-                    self._header))
-
-        self._logger.info("Original from address: %s", from_line[0])
-        new_from = from_line[0]
-        original = self._config['fromEmail'] or self._event.get_recipients()[0]
-        self._logger.info("Replacing from address with: %s", original)
-        new_from = new_from.strip(' \r\n\t')
-        new_from = new_from.replace('<', 'at ')
-        new_from = new_from.replace('>', '')
-        new_from = new_from + ' <' + original + '>'
-        self._header[self._header.index(from_line[0])] = new_from
-
-        # do similar to the Return-Path line, if it exists
-        return_path = self._get_header_section('Return-Path: ')
-        if len(return_path) > 0:
-            index = self._header.index(return_path[0])
-            self._header[index] = "Return-Path: <" + original + ">"
-
-    def _add_subject_prefix(self):
-        prefix = self._config['subjectPrefix']['Default']
-        first_recipient = self._event.get_recipients()[0]
-        if first_recipient in self._config['subjectPrefix']:
-            prefix = self._config['subjectPrefix'][first_recipient]
-        subject = self._get_header_section('Subject: ')[0]
-        if subject:
-            indx = self._header.index(subject)
-            self._header[indx] = 'Subject: ' + \
-                                 prefix + \
-                                 subject.replace('Subject: ', '')
-
-    def _remove_return_path(self):
-        self._header = self._remove_header_section('Return-Path: ')
-
-    def _remove_sender_header(self):
-        self._header = self._remove_header_section('Sender: ')
-
-    def _get_header_section(self, start):
-        return [elem for elem in self._header if elem.startswith(start)]
-
-    def _remove_header_section(self, start):
-        return [elem for elem in self._header if not elem.startswith(start)]
+                    self._header.render()))
+
+        if self._header.has_field('Reply-To'):
+            self._logger.info("removing exist reply-to header: %s",
+                              self._header.get_value('Reply-To'))
+        reply_to = 'Reply-To: ' + from_value
+        self._logger.info("Adding Reply-To to the header: %s", reply_to)
+
+        # Replace the message's From: header with either the hard-coded
+        # from address from the configuration or the first, original
+        # recipient. Either is a verified domain. SES won't let us send
+        # from an unverified "From" address. DKIM (and optionally ARC)
+        # signatures won't verify once we've modified the message, so
+        # the template drops them.
+        template = get_header_templates(self._config).get(
+            self._event.get_recipients()[0])
+        self._logger.info("Original from address: %s", from_value)
+        self._logger.info("Replacing from address with: %s",
+                          template.from_address)
+        changes = template.changes(from_value,
+                                   self._header.get_value('Subject'))
+        self._header.rewrite(changes, [reply_to])
+
+
+class EmailHeader(object):
+    """
+    The header of an email, parsed once into fields. A field keeps all
+    of its lines, so folded (multi-line) fields survive rewriting, and
+    fields are indexed by lower-cased name for constant-time lookups.
+    """
+    def __init__(self, lines):
+        self._fields = []
+        self._index = {}
+        for line in lines:
+            if line[:1] in (' ', '\t') and self._fields:
+                self._fields[-1][1].append(line)
+                continue
+            name = line.partition(':')[0].strip()
+            self._index.setdefault(name.lower(), []).append(
+                len(self._fields))
+            self._fields.append((name, [line]))
+
+    def __len__(self):
+        return len(self._fields)
+
+    def has_field(self, name):
+        """ Whether the header contains at least one field called name. """
+        return name.lower() in self._index
+
+    def get_value(self, name):
+        """
+        Return the value of the first field called name, including any
+        continuation lines, or None if there is no such field.
+        """
+        positions = self._index.get(name.lower())
+        if not positions:
+            return None
+        lines = self._fields[positions[0]][1]
+        value = '\r\n'.join(lines).partition(':')[2]
+        return value.lstrip(' \t')
+
+    def rewrite(self, changes, additions=()):
+        """
+        Apply changes in one pass over the fields. changes maps a
+        lower-cased field name to the replacement text for that field,
+        which replaces the first field with the name and drops any
+        others, or to None to drop every field with that name.
+        additions are appended to the end of the header.
+        """
+        fields = []
+        index = {}
+        replaced = set()
+        for name, lines in self._fields:
+            key = name.lower()
+            if key in changes:
+                if changes[key] is None or key in replaced:
+                    continue
+                replaced.add(key)
+                lines = changes[key].split('\r\n')
+            index.setdefault(key, []).append(len(fields))
+            fields.append((name, lines))
+        self._fields = fields
+        self._index = index
+        for addition in additions:
+            name = addition.partition(':')[0].strip()
+            self._index.setdefault(name.lower(), []).append(len(fields))
+            fields.append((name, addition.split('\r\n')))
+
+    def items(self):
+        """
+        (name, value) for every field, in order, with values as
+        get_value returns them.
+        """
+        return [(name, '\r\n'.join(lines).partition(':')[2].lstrip(' \t'))
+                for name, lines in self._fields]
+
+    def lines(self):
+        """ Every line of the header, in order. """
+        return [line for _, lines in self._fields for line in lines]
+
+    def render(self):
+        """ The header as text, without the blank line that ends it. """
+        return '\r\n'.join(self.lines())
+
+
+def unfold(value):
+    """ Join the lines of a folded header value. """
+    return value.replace('\r\n', '')
+
+
+def _event_header_lines(headers):
+    # The header lines for the fields SES lists in the event.
+    lines = []
+    for field in headers:
+        lines.extend(_native(field['name'] + ': ' + field['value'])
+                     .split('\r\n'))
+    return lines
+
+
+def _event_header_size(headers):
+    # The fewest bytes these fields can take up in the stored header:
+    # each one at least "name:value\r\n".
+    return sum(len(_header_bytes(_native(field['name']))) +
+               len(_header_bytes(_native(field['value']))) + 3
+               for field in headers)
+
+
+def _header_tail(field):
+    # The end of the field's value, as it should appear just before the
+    # blank line ending the stored header.
+    value = _header_bytes(_native(field['value']))
+    tail = value.split(b'\r\n')[-1].rstrip(b' \t')[-HEADER_TAIL_SIZE:]
+    return tail or _header_bytes(_native(field['name'])) + b':'
+
+
+def _header_text(data):
+    # Header bytes as the native str type. On Python 3, undecodable
+    # bytes are kept as surrogates so they survive the round trip.
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if str is bytes:
+        return data
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def _header_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    if str is bytes:
+        return text.encode('utf-8')
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def _native(text):
+    # Configuration strings (unicode when loaded from JSON on Python 2)
+    # as the native str type, so they can be joined with header text.
+    if str is bytes and not isinstance(text, bytes):
+        return text.encode('utf-8')
+    return text
+
+
+def _view(data, start, end):
+    # A zero-copy slice of data. Python 2 can't make a memoryview of an
+    # mmap, so it gets a buffer object instead.
+    try:
+        return memoryview(data)[start:end]
+    except TypeError:
+        return buffer(data, start, end - start)
+
+
+def _join_message(header, body):
+    # Assign through a memoryview: slice assignment on the bytearray
+    # itself takes a temporary copy of the body first.
+    message = bytearray(len(header) + len(body))
+    view = memoryview(message)
+    view[:len(header)] = header
+    view[len(header):] = body
+    del view
+    return message
+
+
+def main(args):
+    """
+    Compile the forwardMapping in a JSON or YAML configuration file
+    into an alias store:
+
+        python SimpleForwarder.py compile-aliases CONFIG STORE
+    """
+    if len(args) != 3 or args[0] != 'compile-aliases':
+        print(main.__doc__.strip(), file=sys.stderr)
+        return 2
+    try:
+        with open(args[1]) as config_file:
+            raw = parse_config(config_file.read(), args[1])
+        if not isinstance(raw, dict) or 'forwardMapping' not in raw:
+            raise SESForwarderError(
+                "No forwardMapping in {0}".format(args[1]))
+        check_forward_mapping(raw['forwardMapping'])
+        count = compile_alias_store(raw['forwardMapping'], args[2])
+    except (IOError, OSError, SESForwarderError) as err:
+        print("compile-aliases: {0}".format(err), file=sys.stderr)
+        return 1
+    print("Wrote {0} keys to {1}".format(count, args[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
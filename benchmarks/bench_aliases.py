@@ -0,0 +1,161 @@
+"""
+Benchmark a compiled alias store against a forwardMapping dict.
+
+For each size, a mapping of that many aliases is written out two ways:
+as a Python module holding the mapping as a dict literal, the way
+DEFAULT_CONFIG holds it, and as an alias store compiled with
+compile_alias_store. A fresh interpreter then loads each one and
+reports:
+
+* load: time to import the module and build the RoutingIndex, or to
+  open the MappedRoutingIndex,
+* rss: growth of the process's resident memory while loading,
+* lookup: mean time to resolve a recipient, over a mix of known and
+  unknown addresses,
+* size: bytes on disk.
+
+Use --json to print one JSON line per size. Run from the repository
+root:
+
+    python benchmarks/bench_aliases.py [--sizes N,N,...] [--json]
+
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import SimpleForwarder  # noqa: E402
+from common import revision  # noqa: E402
+
+DOMAINS = 50
+LOOKUPS = 20000
+KINDS = ['dict', 'store']
+
+
+def build_mapping(size):
+    """ A mapping of size aliases, with two recipients each. """
+    mapping = {}
+    for i in range(size):
+        address = 'alias{0}@domain{1}.example.com'.format(i, i % DOMAINS)
+        mapping[address] = ['user{0}@example.net'.format(i),
+                            'user{0}@example.org'.format(i)]
+    return mapping
+
+
+def recipients(size):
+    """ Known aliases, plus-addressed aliases and unknown addresses. """
+    result = []
+    for i in range(LOOKUPS):
+        alias = (i * 7919) % size
+        address = 'alias{0}@domain{1}.example.com'.format(alias,
+                                                          alias % DOMAINS)
+        if i % 3 == 1:
+            address = address.replace('@', '+tag@')
+        elif i % 3 == 2:
+            address = 'unknown' + address
+        result.append(address)
+    return result
+
+
+def rss():
+    """ Resident memory of this process, in bytes. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def child(kind, path, size):
+    """ Load one representation and print the measurements as JSON. """
+    before = rss()
+    start = time.time()
+    if kind == 'dict':
+        sys.path.insert(0, os.path.dirname(path))
+        module = __import__(os.path.basename(path)[:-len('.py')])
+        index = SimpleForwarder.RoutingIndex(module.FORWARD_MAPPING)
+    else:
+        index = SimpleForwarder.MappedRoutingIndex(path)
+    load = time.time() - start
+    grown = rss() - before
+
+    addresses = recipients(size)
+    start = time.time()
+    for address in addresses:
+        index.lookup(address)
+    lookup = (time.time() - start) / len(addresses)
+    print(json.dumps({'load': load, 'rss': grown, 'lookup': lookup}))
+
+
+def write_files(directory, size):
+    mapping = build_mapping(size)
+    module = os.path.join(directory, 'aliases{0}.py'.format(size))
+    with open(module, 'w') as fp:
+        fp.write('FORWARD_MAPPING = {\n')
+        for alias in sorted(mapping):
+            fp.write('    {0!r}: {1!r},\n'.format(alias, mapping[alias]))
+        fp.write('}\n')
+    store = os.path.join(directory, 'aliases{0}.db'.format(size))
+    SimpleForwarder.compile_alias_store(mapping, store)
+    return {'dict': module, 'store': store}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,300000')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        kind, path, size = args.child
+        return child(kind, path, int(size))
+
+    directory = tempfile.mkdtemp()
+    try:
+        if not args.json:
+            print('python {0}'.format(platform.python_version()))
+            print('{0:>8} {1:>6} {2:>11} {3:>10} {4:>10} {5:>10}'.format(
+                'aliases', '', 'load ms', 'rss MiB', 'lookup us',
+                'disk MiB'))
+        for size in [int(size) for size in args.sizes.split(',')]:
+            paths = write_files(directory, size)
+            for kind in KINDS:
+                output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), '--child',
+                     kind, paths[kind], str(size)])
+                result = json.loads(
+                    output.decode('utf-8').strip().splitlines()[-1])
+                result['size'] = os.path.getsize(paths[kind])
+                report(args, size, kind, result)
+    finally:
+        shutil.rmtree(directory)
+
+
+def report(args, size, kind, result):
+    if args.json:
+        result.update({'aliases': size, 'kind': kind,
+                       'revision': revision(),
+                       'python': platform.python_version(),
+                       'timestamp': int(time.time())})
+        print(json.dumps(result, sort_keys=True))
+        return
+    print('{0:>8} {1:>6} {2:>11.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f}'.format(
+        size, kind, result['load'] * 1000, result['rss'] / 1048576.0,
+        result['lookup'] * 1000000, result['size'] / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
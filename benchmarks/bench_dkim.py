@@ -0,0 +1,109 @@
+"""
+Benchmark DKIM-Signature stripping on adversarial messages.
+
+The header model strips signatures by walking the header once, so the
+time taken grows linearly with the size of the message. For comparison,
+the regular expression the forwarder used to run over the whole message
+is timed too. Its nested quantifiers backtrack badly on long runs of
+whitespace, so it is only run on the smaller inputs. Run from the
+repository root:
+
+    python benchmarks/bench_dkim.py
+
+"""
+
+from __future__ import print_function
+import logging
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from SimpleForwarder import SESEmail, SESEmailEvent  # noqa: E402
+
+SIZES = [1000, 4000, 16000, 64000]
+LEGACY_LIMIT = 16000
+LEGACY_PATTERN = re.compile(r"DKIM-Signature: .+\r\n(\s+.+\r\n)+",
+                            re.MULTILINE)
+
+CONFIG = {
+    'fromEmail': '',
+    'subjectPrefix': {'Default': ''},
+    'emailBucket': 'bucket',
+    'emailKeyPrefix': '',
+    'forwardMapping': {'info@example.com': ['user1@example.com']}
+}
+
+EVENT = {
+    'Records': [{
+        'eventSource': 'aws:ses',
+        'eventVersion': '1.0',
+        'ses': {
+            'mail': {'messageId': 'benchmark'},
+            'receipt': {
+                'recipients': ['info@example.com'],
+                'spamVerdict': {'status': 'PASS'},
+                'virusVerdict': {'status': 'PASS'}
+            }
+        }
+    }]
+}
+
+HEADER = 'From: a <a@example.net>\r\nSubject: b\r\nTo: info@example.com\r\n'
+
+
+def whitespace_run(size):
+    """
+    Signature-like text followed by a long, unterminated run of
+    whitespace, which makes the legacy pattern backtrack quadratically.
+    """
+    return (HEADER + '\r\n' + 'DKIM-Signature: v=1\r\n' + ' ' * size)
+
+
+def many_signatures(size):
+    """ size/20 folded signatures in a row. """
+    sig = 'DKIM-Signature: v=1\r\n\tb=abc\r\n'
+    return sig * (size // 20) + HEADER + '\r\nBody.\r\n'
+
+
+def signature_in_body(size):
+    """ Signature-like text repeated through a large body. """
+    return (HEADER + '\r\n' +
+            'DKIM-Signature: x\r\n ' + ' \r\n' * (size // 3) + 'x\r\n')
+
+
+INPUTS = [
+    ('whitespace run', whitespace_run),
+    ('many signatures', many_signatures),
+    ('signature in body', signature_in_body),
+]
+
+
+def main():
+    logger = logging.getLogger('benchmark')
+    logger.disabled = True
+    event = SESEmailEvent(EVENT)
+    print('{0:<18} {1:>8} {2:>14} {3:>14}'.format(
+        'input', 'bytes', 'header (ms)', 'regex (ms)'))
+    for name, build in INPUTS:
+        for size in SIZES:
+            text = build(size)
+            # SESEmail takes the message as it comes from S3, as bytes.
+            email = text.encode('ascii')
+            header = timeit.timeit(
+                lambda: SESEmail(email, event, None, CONFIG, logger).email(),
+                number=5) / 5
+            if size <= LEGACY_LIMIT:
+                legacy = '{0:14.3f}'.format(timeit.timeit(
+                    lambda: LEGACY_PATTERN.sub('', text), number=1) * 1000)
+            else:
+                legacy = '{0:>14}'.format('skipped')
+            print('{0:<18} {1:>8} {2:>14.3f} {3}'.format(
+                name, len(email), header * 1000, legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark the header rewrite of SESEmail against messages with an
+increasing number of Received: fields.
+
+Rewriting should take time proportional to the size of the header, so
+the cost per field should stay roughly constant. Run from the
+repository root:
+
+    python benchmarks/bench_header.py
+
+"""
+
+from __future__ import print_function
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from SimpleForwarder import SESEmail, SESEmailEvent  # noqa: E402
+
+SIZES = [10, 100, 1000, 10000]
+ROUNDS = 20
+
+CONFIG = {
+    'fromEmail': '',
+    'subjectPrefix': {'Default': '[Fwd] '},
+    'emailBucket': 'bucket',
+    'emailKeyPrefix': '',
+    'forwardMapping': {'info@example.com': ['user1@example.com']}
+}
+
+EVENT = {
+    'Records': [{
+        'eventSource': 'aws:ses',
+        'eventVersion': '1.0',
+        'ses': {
+            'mail': {'messageId': 'benchmark'},
+            'receipt': {
+                'recipients': ['info@example.com'],
+                'spamVerdict': {'status': 'PASS'},
+                'virusVerdict': {'status': 'PASS'}
+            }
+        }
+    }]
+}
+
+
+def build_email(received):
+    """ A message with `received` folded Received: fields. """
+    lines = ['Return-Path: <someone@someplace.com>']
+    for i in range(received):
+        lines.append('Received: from relay{0}.example.net'.format(i))
+        lines.append('\tby relay{0}.example.net; Fri, 30 Dec 2016'.format(
+            i + 1))
+    lines.extend(['From: Some One <someone@someplace.com>',
+                  'Subject: Benchmark',
+                  'To: info@example.com',
+                  '',
+                  'Body.',
+                  ''])
+    return '\r\n'.join(lines).encode('ascii')
+
+
+def main():
+    logger = logging.getLogger('benchmark')
+    logger.disabled = True
+    event = SESEmailEvent(EVENT)
+    print('{0:>8} {1:>12} {2:>16}'.format('fields', 'total (ms)',
+                                          'per field (us)'))
+    for size in SIZES:
+        email = build_email(size)
+        elapsed = timeit.timeit(
+            lambda: SESEmail(email, event, None, CONFIG, logger).email(),
+            number=ROUNDS) / ROUNDS
+        print('{0:>8} {1:>12.3f} {2:>16.3f}'.format(
+            size, elapsed * 1000, elapsed * 1e6 / size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark recipient lookups against forwardMappings of increasing size.
+
+The cost of a lookup through the RoutingIndex should stay flat as the
+mapping grows. Run from the repository root:
+
+    python benchmarks/bench_routing.py
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from SimpleForwarder import RoutingIndex  # noqa: E402
+
+SIZES = [100, 1000, 10000, 100000]
+DOMAINS = 50
+LOOKUPS = 20000
+
+
+def build_mapping(size):
+    """ A mapping of `size` aliases spread over DOMAINS domains. """
+    mapping = {}
+    for i in range(size):
+        address = 'alias{0}@domain{1}.example.com'.format(i, i % DOMAINS)
+        mapping[address] = ['user{0}@example.net'.format(i)]
+    for i in range(DOMAINS):
+        mapping['@domain{0}.example.com'.format(i)] = ['catch@example.net']
+    return mapping
+
+
+def recipients(size):
+    """ A mix of exact, plus-addressed, subdomain and unknown recipients. """
+    result = []
+    for i in range(0, size, max(size // 100, 1)):
+        domain = 'domain{0}.example.com'.format(i % DOMAINS)
+        result.append('alias{0}@{1}'.format(i, domain))
+        result.append('ALIAS{0}+tag@{1}'.format(i, domain))
+        result.append('someone@mail.{0}'.format(domain))
+        result.append('someone@unknown.example.org')
+    return result
+
+
+def main():
+    print('{0:>8} {1:>12} {2:>14}'.format('aliases', 'build (ms)',
+                                          'lookup (us)'))
+    for size in SIZES:
+        mapping = build_mapping(size)
+        build = timeit.timeit(lambda: RoutingIndex(mapping), number=1)
+        index = RoutingIndex(mapping)
+        addresses = recipients(size)
+        rounds = max(LOOKUPS // len(addresses), 1)
+        elapsed = timeit.timeit(
+            lambda: [index.lookup(a) for a in addresses], number=rounds)
+        per_lookup = elapsed / (rounds * len(addresses))
+        print('{0:>8} {1:>12.2f} {2:>14.3f}'.format(size, build * 1000,
+                                                    per_lookup * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark cold-start cost of the forwarder.
+
+Each run starts a fresh interpreter and reports:
+
+* import: time to import SimpleForwarder,
+* clients: time to create the SES and S3 clients (including importing
+  boto3, which SimpleForwarder defers until a client is needed),
+* first: latency of the first lambda_handler invocation,
+* warm: latency of a second invocation in the same process.
+
+The SES and S3 clients are stubbed with botocore's Stubber, so no
+network calls are made. Use --json to print one JSON line per summary,
+which can be appended to a file to track cold starts over time. Run from
+the repository root:
+
+    python benchmarks/bench_startup.py [--runs N] [--json]
+
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from common import revision
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STAGES = ['import', 'clients', 'first', 'warm']
+
+
+def child():
+    """ Measure one cold start and print the timings as JSON. """
+    timings = {}
+    start = time.time()
+    sys.path.insert(0, ROOT)
+    import SimpleForwarder
+    timings['import'] = time.time() - start
+
+    import io
+    from botocore.response import StreamingBody
+    from botocore.stub import Stubber
+
+    with open(os.path.join(ROOT, 'emailBody.txt'), 'rb') as fp:
+        data = fp.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+    config = {
+        'fromEmail': '',
+        'subjectPrefix': {'Default': ''},
+        'emailBucket': 'bucket',
+        'emailKeyPrefix': '',
+        'forwardMapping': {'info@example.com': ['user1@example.com']}
+    }
+    event = {
+        'Records': [{
+            'eventSource': 'aws:ses',
+            'eventVersion': '1.0',
+            'ses': {
+                'mail': {'messageId': 'benchmark'},
+                'receipt': {
+                    'recipients': ['info@example.com'],
+                    'spamVerdict': {'status': 'PASS'},
+                    'virusVerdict': {'status': 'PASS'}
+                }
+            }
+        }]
+    }
+
+    start = time.time()
+    # With the handler's configuration, so that it gets these clients.
+    ses = SimpleForwarder.get_client('ses', config)
+    s3 = SimpleForwarder.get_client('s3', config)
+    timings['clients'] = time.time() - start
+
+    ses_stub = Stubber(ses)
+    s3_stub = Stubber(s3)
+    for _ in range(2):
+        s3_stub.add_response('get_object', {
+            'Body': StreamingBody(io.BytesIO(data), len(data)),
+            'ContentLength': len(data)
+        })
+        ses_stub.add_response('send_raw_email', {'MessageId': 'benchmark'})
+    ses_stub.activate()
+    s3_stub.activate()
+    SimpleForwarder.LOGGER.disabled = True
+
+    for stage in ['first', 'warm']:
+        start = time.time()
+        SimpleForwarder.lambda_handler(event, {}, config=config)
+        timings[stage] = time.time() - start
+    print(json.dumps(timings))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child'], env=env)
+        runs.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+    summary = dict((stage, median([run[stage] for run in runs]) * 1000)
+                   for stage in STAGES)
+    if args.json:
+        summary.update({'runs': args.runs, 'revision': revision(),
+                        'python': platform.python_version(),
+                        'timestamp': int(time.time())})
+        print(json.dumps(summary, sort_keys=True))
+    else:
+        print('median of {0} runs, python {1}'.format(
+            args.runs, platform.python_version()))
+        for stage in STAGES:
+            print('{0:>8} {1:>10.2f} ms'.format(stage, summary[stage]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import os
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def revision():
+    """ The short git revision of the repository, or None. """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,334 @@
+"""
+Replay a directory of emails through the forwarder and measure it.
+
+Every .eml file in the directory becomes an SES event. The recipients
+are taken from its To and Cc headers, and it is given the message's
+header fields the way SES would. The messages are served from an
+in-process stand-in for S3, and sent to a stub SES that records every
+send. The stub can add latency and fail a share of sends, either with
+throttling errors (which the forwarder retries) or with rejections.
+lambda_handler is then driven serially, or from several threads with
+--concurrency, and the run is summarised as:
+
+* messages per second, over the whole run,
+* percentiles of the end-to-end latency of each invocation,
+* percentiles of each stage, taken from the forwarder's stage timings,
+* the number of sends, recipients and failures.
+
+Every address in the corpus is forwarded to --fanout recipients. Use
+--json to print the summary as one JSON line, tagged with the git
+revision, which can be appended to a file to compare versions. With
+--async, the events are forwarded by AsyncForwarder.lambda_handler,
+which needs Python 3.7 or later. Run from the repository root:
+
+    python benchmarks/replay.py DIRECTORY [--concurrency N] [--repeat N]
+        [--fanout N] [--batch N] [--ses-latency MS] [--s3-latency MS]
+        [--throttle-rate P] [--error-rate P] [--headers-from-event]
+        [--async] [--seed N] [--json]
+
+"""
+
+from __future__ import print_function
+import argparse
+import email.parser
+import email.utils
+import glob
+import io
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import botocore.exceptions  # noqa: E402
+import SimpleForwarder  # noqa: E402
+from common import revision  # noqa: E402
+
+PERCENTILES = [50, 90, 99]
+STAGES = ['validate', 'route', 'fetch', 'rewrite', 'send', 'total']
+
+
+class StubS3(object):
+    """ Serves stored emails by key, like get_object on an S3 client. """
+    def __init__(self, objects, latency=0.0):
+        self._objects = objects
+        self._latency = latency
+        self.requests = 0
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.requests += 1
+        if self._latency:
+            time.sleep(self._latency)
+        data = self._objects[Key]
+        if Range:
+            data = data[int(Range[len('bytes='):-1]):]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+
+class StubSES(object):
+    """
+    Records calls to send_raw_email, after an optional delay. A share
+    of the calls fail with a throttling error or a rejection.
+    """
+    def __init__(self, latency=0.0, throttle_rate=0.0, error_rate=0.0,
+                 seed=None):
+        self._latency = latency
+        self._throttle_rate = throttle_rate
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sends = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def get_send_quota(self):
+        return {'MaxSendRate': 1000000.0}
+
+    def send_raw_email(self, Source, Destinations, RawMessage):
+        if self._latency:
+            time.sleep(self._latency)
+        with self._lock:
+            draw = self._random.random()
+            if draw < self._throttle_rate:
+                self.throttled += 1
+                raise self._error('Throttling', 'Maximum sending rate '
+                                  'exceeded.')
+            if draw < self._throttle_rate + self._error_rate:
+                self.rejected += 1
+                raise self._error('MessageRejected', 'Injected failure.')
+            self.sends += 1
+            self.recipients += len(Destinations)
+            self.bytes += len(RawMessage['Data'])
+        return {'MessageId': 'replay-{0}'.format(self.sends)}
+
+    def _error(self, code, message):
+        return botocore.exceptions.ClientError(
+            {'Error': {'Code': code, 'Message': message}}, 'SendRawEmail')
+
+
+def load_corpus(directory):
+    """
+    Read every .eml file in directory, with CRLF line endings, and
+    return a list of (key, data, recipients, headers).
+    """
+    corpus = []
+    parser = email.parser.HeaderParser()
+    for path in sorted(glob.glob(os.path.join(directory, '*.eml'))):
+        with open(path, 'rb') as fp:
+            data = fp.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        header = data.split(b'\r\n\r\n', 1)[0].decode('utf-8', 'replace')
+        message = parser.parsestr(header.replace('\r\n', '\n'))
+        recipients = [address for _, address in email.utils.getaddresses(
+            message.get_all('To', []) + message.get_all('Cc', []))
+            if '@' in address] or ['info@example.com']
+        headers = [{'name': name, 'value': str(value).replace('\n', '')}
+                   for name, value in message.items()]
+        corpus.append((os.path.basename(path), data, recipients, headers))
+    return corpus
+
+
+def make_record(key, recipients, headers):
+    return {
+        'eventSource': 'aws:ses',
+        'eventVersion': '1.0',
+        'ses': {
+            'mail': {
+                'messageId': key,
+                'destination': recipients,
+                'headers': headers,
+                'headersTruncated': False
+            },
+            'receipt': {
+                'recipients': recipients,
+                'spamVerdict': {'status': 'PASS'},
+                'virusVerdict': {'status': 'PASS'}
+            }
+        }
+    }
+
+
+def make_events(corpus, repeat, batch):
+    records = [make_record(key, recipients, headers)
+               for _ in range(repeat)
+               for key, _, recipients, headers in corpus]
+    return [{'Records': records[start:start + batch]}
+            for start in range(0, len(records), batch)]
+
+
+def make_config(args):
+    return {
+        'fromEmail': '',
+        'subjectPrefix': {'Default': '[Replay] '},
+        'emailBucket': 'replay',
+        'emailKeyPrefix': '',
+        'forwardMapping': {
+            '@': ['user{0}@example.net'.format(index)
+                  for index in range(args.fanout)]
+        },
+        'maxSendRate': 0,
+        'throttleBackoff': 0.001,
+        'headersFromEvent': args.headers_from_event
+    }
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def replay(events, ses, s3, config, concurrency, handler):
+    """
+    Invoke handler once per event and return the latency of each
+    invocation, in seconds, and the number of messages that failed.
+    """
+    def invoke(event):
+        start = time.time()
+        try:
+            result = handler(event, {}, ses, s3, config)
+            failed = result['failed'] if result else 0
+        except Exception:  # pylint: disable=broad-except
+            failed = 1
+        return time.time() - start, failed
+
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(invoke, events))
+    else:
+        results = [invoke(event) for event in events]
+    return ([latency for latency, _ in results],
+            sum(failed for _, failed in results))
+
+
+def summarise(args, corpus, events, latencies, failures, records, ses,
+              elapsed):
+    messages = len(corpus) * args.repeat
+    summary = {
+        'messages': messages,
+        'invocations': len(events),
+        'failures': failures,
+        'seconds': elapsed,
+        'messagesPerSecond': messages / elapsed if elapsed else None,
+        'sends': ses.sends,
+        'recipients': ses.recipients,
+        'throttled': ses.throttled,
+        'rejected': ses.rejected,
+        'latency': dict(('p{0}'.format(percent),
+                         percentile(latencies, percent) * 1000)
+                        for percent in PERCENTILES),
+        'stages': {}
+    }
+    summary['latency']['max'] = max(latencies) * 1000
+    for stage in STAGES:
+        values = [record[stage + 'Time'] for record in records
+                  if stage + 'Time' in record]
+        if values:
+            summary['stages'][stage] = dict(
+                ('p{0}'.format(percent), percentile(values, percent))
+                for percent in PERCENTILES)
+    return summary
+
+
+def report(args, summary):
+    if args.json:
+        summary.update({
+            'concurrency': args.concurrency,
+            'batch': args.batch,
+            'fanout': args.fanout,
+            'sesLatency': args.ses_latency,
+            's3Latency': args.s3_latency,
+            'throttleRate': args.throttle_rate,
+            'errorRate': args.error_rate,
+            'headersFromEvent': args.headers_from_event,
+            'async': args.use_async,
+            'revision': revision(),
+            'python': platform.python_version(),
+            'timestamp': int(time.time())
+        })
+        print(json.dumps(summary, sort_keys=True))
+        return
+    print('{0} messages in {1:.2f} s, {2:.1f} messages/s, concurrency {3}, '
+          'python {4}'.format(summary['messages'], summary['seconds'],
+                              summary['messagesPerSecond'] or 0,
+                              args.concurrency, platform.python_version()))
+    print('{0} sends to {1} recipients, {2} throttled, {3} rejected, '
+          '{4} failed messages'.format(
+              summary['sends'], summary['recipients'], summary['throttled'],
+              summary['rejected'], summary['failures']))
+    print('{0:>10} {1}'.format('', ' '.join(
+        '{0:>10}'.format('p{0}'.format(percent))
+        for percent in PERCENTILES)))
+    rows = [('invocation', summary['latency'])] + \
+        [(stage, summary['stages'][stage]) for stage in STAGES
+         if stage in summary['stages']]
+    for name, values in rows:
+        print('{0:>10} {1} ms'.format(name, ' '.join(
+            '{0:>10.2f}'.format(values['p{0}'.format(percent)])
+            for percent in PERCENTILES)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory', help='directory of .eml files')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='invocations in flight at once')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='passes over the directory')
+    parser.add_argument('--fanout', type=int, default=1,
+                        help='recipients each address is forwarded to')
+    parser.add_argument('--batch', type=int, default=1,
+                        help='records per event')
+    parser.add_argument('--ses-latency', type=float, default=0.0,
+                        help='milliseconds added to every send')
+    parser.add_argument('--s3-latency', type=float, default=0.0,
+                        help='milliseconds added to every fetch')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='share of sends that are throttled')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of sends that are rejected')
+    parser.add_argument('--headers-from-event', action='store_true',
+                        help='build headers from the event (headersFromEvent)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='forward with AsyncForwarder.lambda_handler')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.directory)
+    if not corpus:
+        parser.error('no .eml files in {0}'.format(args.directory))
+    s3 = StubS3(dict((key, data) for key, data, _, _ in corpus),
+                args.s3_latency / 1000.0)
+    ses = StubSES(args.ses_latency / 1000.0, args.throttle_rate,
+                  args.error_rate, args.seed)
+    config = SimpleForwarder.validate_config(make_config(args))
+    events = make_events(corpus, args.repeat, args.batch)
+    handler = SimpleForwarder.lambda_handler
+    if args.use_async:
+        import AsyncForwarder
+        handler = AsyncForwarder.lambda_handler
+
+    records = []
+    SimpleForwarder.METRICS_SINK = records.append
+    SimpleForwarder.LOGGER.disabled = True
+    start = time.time()
+    latencies, failures = replay(events, ses, s3, config, args.concurrency,
+                                 handler)
+    elapsed = time.time() - start
+    report(args, summarise(args, corpus, events, latencies, failures,
+                           records, ses, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,10 @@
 profile='home'
 function_name='exampleEmailHandler'
 zip_file='SimpleForwarder.zip'
-code_file='SimpleForwarder.py'
+code_files='SimpleForwarder.py AsyncForwarder.py'
 
 # Zip code
-zip $zip_file $code_file
+zip $zip_file $code_files
 
 # update code on lambda
 aws --profile $profile lambda update-function-code --function-name $function_name --zip-file fileb://$zip_file --publish 
@@ -224,10 +224,11 @@ def step_impl(context, text):
     }
     S3_MOCK.reset_mock()
     address = text.replace('"', '')
-    read_dict = {'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY))}
-    get_mock = MagicMock()
-    get_mock.__getitem__.side_effect = read_dict.__getitem__
-    S3_MOCK.Object.return_value.get.return_value = get_mock
+    get_mock = {
+        'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY)),
+        'ContentLength': len(TEST_EMAIL_BODY)
+    }
+    S3_MOCK.get_object.return_value = get_mock
     config = TEST_CONFIG['forwardMapping']
     config[address + '@example.com'] = TEST_EMAILS[address]
 
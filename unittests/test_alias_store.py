@@ -0,0 +1,129 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from SimpleForwarder import AliasStore, MappedRoutingIndex, RoutingIndex, \
+    compile_alias_store, get_new_recipients, get_routing_index, main, \
+    validate_config, SESForwarderError
+from mock import patch
+from StringIO import StringIO
+from test_util import *
+
+MAPPING = {
+    'Info@Example.com': ['user1@example.com', 'user2@example.com'],
+    'admin@example.com': ['user2@example.com', 'user3@example.com'],
+    'example.com': ['postmaster@example.com'],
+    '@lists.example.org': ['lists@example.com'],
+    'nobody@example.org': [],
+    '@': ['everything@example.com']
+}
+
+RECIPIENTS = ['info@example.com', ' INFO@example.COM ',
+              'info+news@example.com', 'nobody@example.com',
+              'nobody@mail.example.com', 'a@b.lists.example.org',
+              'nobody@example.org', 'someone@elsewhere.net']
+
+
+class testAliasStore(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'aliases.db')
+        compile_alias_store(MAPPING, self._path)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_get(self):
+        store = AliasStore(self._path)
+        self.assertEqual(6, len(store))
+        self.assertEqual(('user1@example.com', 'user2@example.com'),
+                         store.get('info@example.com'))
+        self.assertEqual(('postmaster@example.com',),
+                         store.get('example.com'))
+        self.assertEqual((), store.get('nobody@example.org'))
+        self.assertIsNone(store.get('missing@example.com'))
+
+    def test_same_lookups_as_routing_index(self):
+        index = RoutingIndex(MAPPING)
+        mapped = MappedRoutingIndex(self._path)
+        for recipient in RECIPIENTS:
+            self.assertEqual(index.lookup(recipient),
+                             mapped.lookup(recipient))
+        self.assertEqual(index.get_recipients(RECIPIENTS),
+                         mapped.get_recipients(RECIPIENTS))
+
+    def test_no_catch_all(self):
+        mapping = dict(MAPPING)
+        del mapping['@']
+        compile_alias_store(mapping, self._path)
+        self.assertIsNone(
+            MappedRoutingIndex(self._path).lookup('someone@elsewhere.net'))
+
+    def test_many_keys(self):
+        mapping = dict(('alias{0}@example.com'.format(i),
+                        ['user{0}@example.net'.format(i)])
+                       for i in range(1000))
+        self.assertEqual(1000, compile_alias_store(mapping, self._path))
+        store = AliasStore(self._path)
+        for i in range(1000):
+            self.assertEqual(('user{0}@example.net'.format(i),),
+                             store.get('alias{0}@example.com'.format(i)))
+        self.assertIsNone(store.get('alias1000@example.com'))
+
+    def test_not_a_store(self):
+        with open(self._path, 'wb') as fp:
+            fp.write(b'{"forwardMapping": {}}')
+        self.assertRaises(SESForwarderError, AliasStore, self._path)
+
+    def test_config(self):
+        config = validate_config({'emailBucket': 'bucket',
+                                  'aliasStore': self._path})
+        self.assertEqual({}, config['forwardMapping'])
+        self.assertIsInstance(get_routing_index(config), MappedRoutingIndex)
+        self.assertIs(get_routing_index(config), get_routing_index(config))
+        self.assertEqual(['user1@example.com', 'user2@example.com'],
+                         get_new_recipients(['info@example.com'], config))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_main(self, stdout):
+        source = os.path.join(self._directory, 'config.json')
+        with open(source, 'w') as fp:
+            json.dump({'emailBucket': 'bucket', 'forwardMapping': MAPPING},
+                      fp)
+        self.assertEqual(0, main(['compile-aliases', source, self._path]))
+        self.assertIn('Wrote 6 keys', stdout.getvalue())
+        self.assertEqual(('everything@example.com',),
+                         AliasStore(self._path).get('@'))
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_main_invalid(self, stderr):
+        source = os.path.join(self._directory, 'config.json')
+        store = os.path.join(self._directory, 'new.db')
+        for document in [MAPPING, ['a@example.com'],
+                         {'forwardMapping': {'a@example.com': 'b@x.com'}},
+                         {'forwardMapping': ['a@example.com']}]:
+            with open(source, 'w') as fp:
+                json.dump(document, fp)
+            self.assertEqual(1, main(['compile-aliases', source, store]))
+            self.assertFalse(os.path.exists(store))
+        self.assertIn('No forwardMapping in', stderr.getvalue())
+        self.assertIn('Recipients for a@example.com must be a list',
+                      stderr.getvalue())
+        self.assertIn("'forwardMapping' must be a mapping", stderr.getvalue())
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_main_missing_file(self, stderr):
+        self.assertEqual(1, main(['compile-aliases', self._path + '.json',
+                                  self._path]))
+        self.assertIn('compile-aliases: ', stderr.getvalue())
+
+    @patch('sys.stderr', new_callable=StringIO)
+    def test_main_usage(self, stderr):
+        self.assertEqual(2, main([]))
+        self.assertIn('compile-aliases', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
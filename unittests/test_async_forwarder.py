@@ -0,0 +1,113 @@
+import unittest
+import copy
+import io
+import json
+import sys
+import threading
+import time
+from botocore.exceptions import ClientError
+from test_util import *
+
+if sys.version_info >= (3, 7):
+    from AsyncForwarder import lambda_handler
+else:
+    lambda_handler = None
+
+LATENCY = 0.1
+
+
+def make_event(count):
+    event = {'Records': []}
+    for index in range(count):
+        record = copy.deepcopy(TEST_EVENT['Records'][0])
+        record['ses']['mail']['messageId'] = 'email-{0}'.format(index)
+        event['Records'].append(record)
+    return event
+
+
+class SlowS3(object):
+    """ Serves TEST_EMAIL_BODY after a delay. """
+
+    def get_object(self, Bucket, Key):
+        time.sleep(LATENCY)
+        if Key == 'missing':
+            raise ClientError(ERROR_RESPONSE, 'GetObject')
+        body = TEST_EMAIL_BODY.encode('ascii')
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+
+class SlowSES(object):
+    """ Records sends, after a delay, and the most sends in progress. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.most_active = 0
+        self.sent = []
+
+    def send_raw_email(self, Source, Destinations, RawMessage):
+        with self._lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(LATENCY)
+        with self._lock:
+            self.active -= 1
+            self.sent.append(bytes(RawMessage['Data']))
+        return {'MessageId': 'id'}
+
+
+@unittest.skipIf(lambda_handler is None, 'needs Python 3.7 or later')
+class testAsyncForwarder(unittest.TestCase):
+
+    def setUp(self):
+        self._ses = SlowSES()
+        self._config = dict(TEST_CONFIG, maxSendRate=0)
+
+    def forward(self, event):
+        return lambda_handler(event, {}, self._ses, SlowS3(), self._config)
+
+    def test_report(self):
+        report = self.forward(make_event(3))
+        self.assertEqual(3, report['succeeded'])
+        self.assertEqual(['email-0', 'email-1', 'email-2'],
+                         [r['messageId'] for r in report['results']])
+        self.assertEqual([TEST_SEND_EMAIL] * 3, self._ses.sent)
+
+    def test_stages_overlap(self):
+        # One email at a time, 8 emails take 16 delays if each is fetched
+        # and then sent, but about 9 if the next is fetched while the
+        # last is sent.
+        self._config['maxInFlight'] = 1
+        began = time.time()
+        report = self.forward(make_event(8))
+        elapsed = time.time() - began
+        self.assertEqual(8, report['succeeded'])
+        self.assertEqual(1, self._ses.most_active)
+        self.assertLess(elapsed, 12 * LATENCY)
+
+    def test_in_flight_limit(self):
+        self._config['maxInFlight'] = 2
+        self.forward(make_event(6))
+        self.assertEqual(2, self._ses.most_active)
+
+    def test_failures_reported(self):
+        event = make_event(3)
+        event['Records'][1]['ses']['mail']['messageId'] = 'missing'
+        event['Records'][2]['ses']['receipt']['spamVerdict']['status'] = \
+            'FAIL'
+        event['Records'].append({})
+        report = self.forward(event)
+        self.assertEqual(['sent', 'failed', 'skipped', 'failed'],
+                         [r['status'] for r in report['results']])
+
+    def test_queue_event(self):
+        record = TEST_EVENT['Records'][0]['ses']
+        message = dict(record, notificationType='Received')
+        event = {'Records': [{'messageId': 'item-1', 'eventSource': 'aws:sqs',
+                              'body': json.dumps(message)}]}
+        self.assertEqual({'batchItemFailures': []}, self.forward(event))
+        self.assertEqual(1, len(self._ses.sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+from SimpleForwarder import backlog_handler, forward_email, \
+    reforward_backlog, stored_email_event, EmailHeader, FileCheckpoint, \
+    RoutingIndex, S3Checkpoint, SESEmailEvent, SESForwarderError
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+from mock import Mock, patch
+from StringIO import StringIO
+from test_util import *
+
+STORED_EMAIL = ('Received: from mail.someplace.com by inbound-smtp.'
+                'eu-west-1.amazonaws.com with SMTP id abc\r\n'
+                ' for info@example.com; Mon, 1 Jan 2018 00:00:00 +0000\r\n'
+                'X-SES-Spam-Verdict: PASS\r\n'
+                'X-SES-Virus-Verdict: PASS\r\n' + TEST_EMAIL_BODY)
+
+STORED = datetime.datetime(2018, 1, 1, 0, 0, 5, tzinfo=tzutc())
+
+
+class FakeS3(object):
+    """ Enough of an S3 client to list, get and put objects. """
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.modified = {}
+        self.get_object = Mock(side_effect=self._get_object)
+        self.put_object = Mock(side_effect=self._put_object)
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000,
+                        StartAfter=''):
+        keys = sorted(key for key in self.objects
+                      if key.startswith(Prefix) and key > StartAfter)
+        return {
+            'Contents': [{'Key': key,
+                          'LastModified': self.modified.get(key, STORED)}
+                         for key in keys[:MaxKeys]],
+            'IsTruncated': len(keys) > MaxKeys
+        }
+
+    def _get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self.objects[Key]
+        if Range:
+            first, _, last = Range[len('bytes='):].partition('-')
+            data = data[int(first):int(last) + 1 if last else None]
+        return {'Body': StringIO(data), 'ContentLength': len(data)}
+
+    def _put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+
+class testStoredEmailEvent(unittest.TestCase):
+
+    def setUp(self):
+        mapping = dict(TEST_CONFIG['forwardMapping'])
+        mapping['@'] = ['everything@example.com']
+        self._index = RoutingIndex(mapping)
+
+    def header(self, text):
+        return EmailHeader(text[:text.index('\r\n\r\n')].split('\r\n'))
+
+    def event(self, text):
+        return SESEmailEvent(stored_email_event('some-id', self.header(text),
+                                                self._index))
+
+    def test_event(self):
+        event = self.event(STORED_EMAIL)
+        self.assertEqual('some-id', event.get_email()['messageId'])
+        self.assertEqual(['info@example.com'], event.get_recipients())
+        self.assertFalse(event.is_spam())
+        self.assertEqual('Some One <someone@someplace.com>',
+                         dict((field['name'], field['value'])
+                              for field in event.get_headers())['From'])
+
+    def test_verdicts(self):
+        event = self.event(STORED_EMAIL.replace('Spam-Verdict: PASS',
+                                                'Spam-Verdict: FAIL'))
+        self.assertTrue(event.is_spam())
+        self.assertFalse(event.is_virus())
+
+    def test_no_verdicts(self):
+        event = self.event(TEST_EMAIL_BODY)
+        self.assertTrue(event.is_spam())
+        self.assertTrue(event.is_virus())
+        self.assertEqual(['info@example.com'], event.get_recipients())
+
+    def test_missing_verdicts_allowed(self):
+        event = SESEmailEvent(stored_email_event(
+            'some-id', self.header(TEST_EMAIL_BODY), self._index, True))
+        self.assertFalse(event.is_spam())
+        self.assertFalse(event.is_virus())
+        event = SESEmailEvent(stored_email_event(
+            'some-id', self.header(STORED_EMAIL.replace(
+                'Virus-Verdict: PASS', 'Virus-Verdict: FAIL')),
+            self._index, True))
+        self.assertTrue(event.is_virus())
+
+    def test_outside_addresses_dropped(self):
+        event = self.event(TEST_EMAIL_BODY.replace(
+            'To: info@example.com',
+            'To: Bob <bob@gmail.com>\r\nCc: Admin@example.com, '
+            'info+news@example.com'))
+        self.assertEqual(['Admin@example.com', 'info+news@example.com'],
+                         event.get_recipients())
+
+    def test_received_for_trusted(self):
+        event = self.event(STORED_EMAIL.replace(
+            'for info@example.com', 'for bob@elsewhere.net'))
+        self.assertEqual(['bob@elsewhere.net', 'info@example.com'],
+                         event.get_recipients())
+
+
+class testBacklog(unittest.TestCase):
+
+    def setUp(self):
+        self._config = dict(TEST_CONFIG)
+        self._config['emailKeyPrefix'] = 'mail/'
+        self._s3 = FakeS3(dict(('mail/id{0:02d}'.format(index), STORED_EMAIL)
+                               for index in range(25)))
+        self._s3.objects['mail/AMAZON_SES_SETUP_NOTIFICATION'] = 'Setup'
+        self._s3.objects['other/id'] = STORED_EMAIL
+        self._ses = Mock()
+        self._ses.send_raw_email.return_value = {'MessageId': 'some_id'}
+        patcher = patch('SimpleForwarder.BACKLOG_PAGE_SIZE', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reforward(self, **kwargs):
+        kwargs.setdefault('since', '2018-01-01T00:00:00Z')
+        kwargs.setdefault('until', '2018-01-01T01:00:00Z')
+        return reforward_backlog(self._config, self._ses, self._s3,
+                                 max_send_rate=0, **kwargs)
+
+    def test_prefix_used_for_single_email(self):
+        self._s3.objects['mail/' + TEST_EVENT['Records'][0]['ses']['mail'][
+            'messageId']] = TEST_EMAIL_BODY
+        forward_email(SESEmailEvent(TEST_EVENT), self._ses, self._s3,
+                      self._config)
+        self.assertTrue(self._s3.get_object.call_args[1]['Key'].startswith(
+            'mail/'))
+
+    def test_drain(self):
+        report = self.reforward()
+        self.assertEqual(25, report['processed'])
+        self.assertEqual(25, report['sent'])
+        self.assertTrue(report['done'])
+        self.assertEqual('mail/id24', report['startAfter'])
+        self.assertEqual(25, self._ses.send_raw_email.call_count)
+        raw = self._ses.send_raw_email.call_args[1]['RawMessage']['Data']
+        self.assertTrue(raw.startswith(b'Received: '))
+        self.assertTrue(raw.endswith(TEST_SEND_EMAIL))
+
+    def test_missing_verdicts(self):
+        self._s3.objects['mail/id03'] = TEST_EMAIL_BODY
+        report = self.reforward(max_messages=5)
+        self.assertEqual(4, report['sent'])
+        self.assertEqual(1, report['skipped'])
+        report = self.reforward(max_messages=5, allow_missing_verdicts=True)
+        self.assertEqual(5, report['sent'])
+
+    def test_header_then_body_fetched(self):
+        self.reforward(max_messages=1)
+        ranges = [call[1]['Range']
+                  for call in self._s3.get_object.call_args_list]
+        self.assertEqual('bytes=0-65535', ranges[0])
+        self.assertTrue(int(ranges[1][len('bytes='):-1]) > 0)
+
+    def test_max_messages(self):
+        report = self.reforward(max_messages=12)
+        self.assertEqual(12, report['processed'])
+        self.assertFalse(report['done'])
+        self.assertEqual('mail/id11', report['startAfter'])
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = S3Checkpoint(self._s3, 'bucket', 'checkpoint')
+        self.reforward(max_messages=12, checkpoint=checkpoint)
+        self.assertEqual('mail/id11', checkpoint.load()['startAfter'])
+        report = self.reforward(checkpoint=checkpoint)
+        self.assertEqual(13, report['processed'])
+        self.assertEqual(25, self._ses.send_raw_email.call_count)
+
+    def test_failures_recorded(self):
+        self._s3.objects['mail/id03'] = 'No header end'
+        checkpoint = S3Checkpoint(self._s3, 'bucket', 'checkpoint')
+        report = self.reforward(checkpoint=checkpoint)
+        self.assertEqual(1, report['failed'])
+        self.assertEqual(['mail/id03'], report['failedKeys'])
+        self.assertEqual(['mail/id03'], checkpoint.load()['failedKeys'])
+
+    def test_window(self):
+        self._s3.modified['mail/id00'] = STORED - datetime.timedelta(days=1)
+        self._s3.modified['mail/id01'] = datetime.datetime(2018, 1, 1, 1)
+        self._s3.modified['mail/id02'] = datetime.datetime(2018, 1, 1)
+        report = self.reforward()
+        self.assertEqual(23, report['processed'])
+        self.assertEqual(2, report['outsideWindow'])
+        self.assertTrue(report['done'])
+
+    def test_window_as_epoch_seconds(self):
+        report = self.reforward(since=1514764800, until=1514764805)
+        self.assertEqual(0, report['processed'])
+        self.assertEqual(25, report['outsideWindow'])
+        report = self.reforward(since=1514764805, until=1514764806)
+        self.assertEqual(25, report['processed'])
+
+    def test_window_required(self):
+        self.assertRaises(SESForwarderError, self.reforward, since=None)
+        self.assertRaises(SESForwarderError, self.reforward, until=None)
+        self.assertRaises(SESForwarderError, self.reforward,
+                          until='2017-12-31T00:00:00Z')
+        self.assertRaises(SESForwarderError, self.reforward, since='soon')
+        self.assertFalse(self._ses.send_raw_email.called)
+
+    def test_stops_before_timeout(self):
+        report = self.reforward(remaining=lambda: 10)
+        self.assertEqual(0, report['processed'])
+        self.assertFalse(report['done'])
+
+    def test_handler(self):
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = 300000
+        with patch('SimpleForwarder.get_client', return_value=self._s3):
+            report = backlog_handler({'maxMessages': 5, 'maxSendRate': 0,
+                                      'since': '2018-01-01T00:00:00Z',
+                                      'until': '2018-01-02T00:00:00Z',
+                                      'checkpoint': 's3://bucket/progress'},
+                                     context, self._ses, self._s3,
+                                     self._config)
+        self.assertEqual(5, report['sent'])
+        self.assertEqual('mail/id04', S3Checkpoint(
+            self._s3, 'bucket', 'progress').load()['startAfter'])
+
+
+class testFileCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_round_trip(self):
+        checkpoint = FileCheckpoint(self._path)
+        self.assertEqual({}, checkpoint.load())
+        checkpoint.save({'startAfter': 'mail/id01', 'failedKeys': []})
+        self.assertEqual('mail/id01', checkpoint.load()['startAfter'])
+
+
+class testS3Checkpoint(unittest.TestCase):
+
+    def test_missing(self):
+        self.assertEqual({}, S3Checkpoint(FakeS3({}), 'bucket', 'key').load())
+
+    def test_error(self):
+        client = Mock()
+        client.get_object.side_effect = ClientError(ERROR_RESPONSE,
+                                                    'GetObject')
+        self.assertRaises(SESForwarderError,
+                          S3Checkpoint(client, 'bucket', 'key').load)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import os
+import SimpleForwarder
+from SimpleForwarder import get_client, get_client_settings, \
+    lambda_handler, SESForwarderError, DEFAULT_CLIENT_SETTINGS
+from mock import Mock, patch
+from StringIO import StringIO
+from test_util import *
+
+
+class testGetClient(unittest.TestCase):
+
+    def setUp(self):
+        SimpleForwarder._CLIENTS.clear()
+
+    def tearDown(self):
+        SimpleForwarder._CLIENTS.clear()
+
+    @patch('boto3.client')
+    def test_created_once(self, client_mock):
+        client_mock.side_effect = lambda *args, **kwargs: Mock()
+        first = get_client('ses')
+        self.assertIs(first, get_client('ses'))
+        self.assertIsNot(first, get_client('s3'))
+        self.assertEqual(2, client_mock.call_count)
+
+    @patch('boto3.client')
+    def test_settings_passed(self, client_mock):
+        get_client('ses', {'clientSettings': {'maxPoolConnections': 50,
+                                              'readTimeout': 3}})
+        config = client_mock.call_args[1]['config']
+        self.assertEqual(50, config.max_pool_connections)
+        self.assertEqual(3, config.read_timeout)
+        self.assertEqual(5, config.connect_timeout)
+        self.assertEqual({'mode': 'standard', 'max_attempts': 1},
+                         config.retries)
+
+    @patch('boto3.client')
+    def test_only_ses_sends_once(self, client_mock):
+        # SESSender retries sends itself.
+        get_client('s3')
+        self.assertEqual(3, client_mock.call_args[1]['config']
+                         .retries['max_attempts'])
+
+    @patch('boto3.client')
+    def test_new_settings_new_client(self, client_mock):
+        client_mock.side_effect = lambda *args, **kwargs: Mock()
+        first = get_client('ses', {'clientSettings': {'readTimeout': 3}})
+        self.assertIsNot(first, get_client('ses'))
+        self.assertIs(first,
+                      get_client('ses', {'clientSettings': {'readTimeout': 3}}))
+
+    @patch('SimpleForwarder.get_client')
+    def test_not_created_without_recipients(self, get_client_mock):
+        event = SimpleForwarder.SESEmailEvent(TEST_EVENT)
+        config = dict(TEST_CONFIG)
+        config['forwardMapping'] = {}
+        self.assertIsNone(SimpleForwarder.forward_email(event, None, None,
+                                                        config))
+        self.assertFalse(get_client_mock.called)
+
+    @patch('SimpleForwarder.get_client')
+    def test_created_when_forwarding(self, get_client_mock):
+        s3_mock = Mock()
+        s3_mock.get_object.return_value = {
+            'Body': StringIO(TEST_EMAIL_BODY),
+            'ContentLength': len(TEST_EMAIL_BODY)
+        }
+        ses_mock = Mock()
+        ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        get_client_mock.side_effect = \
+            lambda service, config=None: {'s3': s3_mock, 'ses': ses_mock}[service]
+        lambda_handler(TEST_EVENT, {}, config=TEST_CONFIG)
+        self.assertTrue(ses_mock.send_raw_email.called)
+        s3_mock.get_object.assert_called_with(
+            Bucket='test-bucket',
+            Key='3bnsm1c2akm1gded3speted0hpnglijt74jbd201')
+
+
+class testGetClientSettings(unittest.TestCase):
+
+    def tearDown(self):
+        for name in ['FORWARDER_READ_TIMEOUT', 'FORWARDER_TCP_KEEPALIVE',
+                     'FORWARDER_MAX_ATTEMPTS']:
+            os.environ.pop(name, None)
+
+    def test_defaults(self):
+        self.assertEqual(DEFAULT_CLIENT_SETTINGS, get_client_settings())
+
+    def test_config(self):
+        settings = get_client_settings({
+            'maxWorkers': 32,
+            'clientSettings': {'retryMode': 'adaptive'}
+        })
+        self.assertEqual('adaptive', settings['retryMode'])
+        self.assertEqual(320, settings['maxPoolConnections'])
+
+    def test_pool_fits_concurrent_sends(self):
+        self.assertEqual(40, get_client_settings(
+            {'emailBucket': 'bucket'})['maxPoolConnections'])
+        self.assertEqual(160, get_client_settings({
+            'maxWorkers': 16, 'sendWorkers': 10})['maxPoolConnections'])
+        self.assertEqual(64, get_client_settings({
+            'maxInFlight': 8, 'sendWorkers': 8})['maxPoolConnections'])
+        self.assertEqual(10, get_client_settings({
+            'maxWorkers': 1, 'sendWorkers': 1})['maxPoolConnections'])
+
+    def test_environment(self):
+        os.environ['FORWARDER_READ_TIMEOUT'] = '2.5'
+        os.environ['FORWARDER_TCP_KEEPALIVE'] = 'false'
+        settings = get_client_settings(
+            {'clientSettings': {'readTimeout': 10}})
+        self.assertEqual(2.5, settings['readTimeout'])
+        self.assertFalse(settings['tcpKeepAlive'])
+
+    def test_invalid_environment(self):
+        os.environ['FORWARDER_MAX_ATTEMPTS'] = 'lots'
+        self.assertRaises(SESForwarderError, get_client_settings)
+
+
+if __name__ == '__main__':
+    unittest.main()
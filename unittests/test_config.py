@@ -0,0 +1,158 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import SimpleForwarder
+from SimpleForwarder import ConfigCache, S3ConfigSource, FileConfigSource, \
+    EnvironmentConfigSource, SESForwarderError, DEFAULT_CONFIG, get_config, \
+    parse_config, validate_config
+from mock import Mock, patch
+from StringIO import StringIO
+from botocore.exceptions import ClientError
+from test_util import *
+
+NOT_MODIFIED = {'Error': {'Code': '304', 'Message': 'Not Modified'}}
+
+
+class testValidateConfig(unittest.TestCase):
+
+    def test_defaults(self):
+        config = validate_config({'emailBucket': 'bucket',
+                                  'forwardMapping': {}})
+        self.assertEqual({'Default': ''}, config['subjectPrefix'])
+        self.assertEqual('', config['fromEmail'])
+        self.assertEqual('', config['emailKeyPrefix'])
+
+    def test_test_config(self):
+        self.assertEqual(TEST_CONFIG, validate_config(TEST_CONFIG))
+
+    def test_invalid(self):
+        for raw in [[], {'forwardMapping': {}},
+                    {'emailBucket': 'b', 'forwardMapping': []},
+                    {'emailBucket': 'b', 'forwardMapping': {'a@b': 'c@d'}},
+                    {'emailBucket': 'b', 'forwardMapping': {},
+                     'subjectPrefix': 'x'}]:
+            self.assertRaises(SESForwarderError, validate_config, raw)
+
+    def test_parse_json(self):
+        self.assertEqual({'a': 1}, parse_config('{"a": 1}', 'c.json'))
+        self.assertRaises(SESForwarderError, parse_config, '{', 'c.json')
+
+
+class testConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.source = Mock()
+        self.source.get_name.return_value = 'config.json'
+        self.source.fetch.return_value = (json.dumps(TEST_CONFIG), 'v1')
+        self.cache = ConfigCache(self.source, 30, self.clock)
+
+    def test_cached_within_ttl(self):
+        first = self.cache.get()
+        self.clock.now += 29
+        self.assertIs(first, self.cache.get())
+        self.assertEqual(1, self.source.fetch.call_count)
+
+    def test_conditional_refresh(self):
+        first = self.cache.get()
+        self.source.fetch.return_value = None
+        self.clock.now += 31
+        self.assertIs(first, self.cache.get())
+        self.source.fetch.assert_called_with('v1')
+
+    def test_changed(self):
+        self.cache.get()
+        changed = dict(TEST_CONFIG, fromEmail='me@example.com')
+        self.source.fetch.return_value = (json.dumps(changed), 'v2')
+        self.clock.now += 31
+        self.assertEqual('me@example.com', self.cache.get()['fromEmail'])
+
+    def test_failed_refresh_keeps_config(self):
+        first = self.cache.get()
+        self.source.fetch.return_value = ('{"broken"', 'v2')
+        self.clock.now += 31
+        self.assertIs(first, self.cache.get())
+
+    def test_failed_first_load(self):
+        self.source.fetch.side_effect = SESForwarderError('unavailable')
+        self.assertRaises(SESForwarderError, self.cache.get)
+
+
+class testConfigSources(unittest.TestCase):
+
+    def test_s3(self):
+        client = Mock()
+        client.get_object.return_value = {
+            'Body': StringIO('{}'), 'ETag': '"abc"'}
+        source = S3ConfigSource(client, 'bucket', 'config.json')
+        self.assertEqual(('{}', '"abc"'), source.fetch())
+        client.get_object.side_effect = ClientError(NOT_MODIFIED, 'GetObject')
+        self.assertIsNone(source.fetch('"abc"'))
+        client.get_object.assert_called_with(Bucket='bucket',
+                                             Key='config.json',
+                                             IfNoneMatch='"abc"')
+
+    def test_s3_error(self):
+        client = Mock()
+        client.get_object.side_effect = ClientError(ERROR_RESPONSE,
+                                                    'GetObject')
+        source = S3ConfigSource(client, 'bucket', 'config.json')
+        self.assertRaises(SESForwarderError, source.fetch)
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as config_file:
+                config_file.write('{}')
+            source = FileConfigSource(path)
+            text, version = source.fetch()
+            self.assertEqual('{}', text)
+            self.assertIsNone(source.fetch(version))
+            self.assertRaises(SESForwarderError,
+                              FileConfigSource(path + '.missing').fetch)
+        finally:
+            shutil.rmtree(directory)
+
+    @patch.dict(os.environ, {'FORWARDER_TEST_CONFIG': '{}'})
+    def test_environment(self):
+        source = EnvironmentConfigSource('FORWARDER_TEST_CONFIG')
+        text, version = source.fetch()
+        self.assertEqual('{}', text)
+        self.assertIsNone(source.fetch(version))
+
+
+class testGetConfig(unittest.TestCase):
+
+    def tearDown(self):
+        SimpleForwarder._CONFIG_CACHES.clear()
+
+    def test_default(self):
+        with patch.dict(os.environ, {}):
+            os.environ.pop('FORWARDER_CONFIG', None)
+            os.environ.pop('FORWARDER_CONFIG_JSON', None)
+            self.assertIs(DEFAULT_CONFIG, get_config())
+
+    @patch.dict(os.environ, {'FORWARDER_CONFIG_JSON':
+                             json.dumps(TEST_CONFIG)})
+    def test_environment(self):
+        os.environ.pop('FORWARDER_CONFIG', None)
+        config = get_config()
+        self.assertEqual(TEST_CONFIG, config)
+        self.assertIs(config, get_config())
+
+    @patch('SimpleForwarder.get_client')
+    def test_s3(self, get_client_mock):
+        get_client_mock.return_value.get_object.return_value = {
+            'Body': StringIO(json.dumps(TEST_CONFIG)), 'ETag': '"abc"'}
+        with patch.dict(os.environ, {'FORWARDER_CONFIG':
+                                     's3://bucket/forwarder.json'}):
+            self.assertEqual(TEST_CONFIG, get_config())
+        get_client_mock.return_value.get_object.assert_called_with(
+            Bucket='bucket', Key='forwarder.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+import SimpleForwarder
+from SimpleForwarder import MemoryDedupeStore, SQLiteDedupeStore, \
+    DynamoDBDedupeStore, TieredDedupeStore, SESSender, SESSendError, \
+    SESForwarderError, dedupe_key, get_dedupe_store
+from mock import Mock
+from botocore.exceptions import ClientError
+from test_util import *
+
+LOGGER = logging.getLogger()
+
+
+class testMemoryDedupeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = MemoryDedupeStore(60, 2, self.clock)
+
+    def test_put_get(self):
+        self.assertIsNone(self.store.get('a'))
+        self.store.put('a', 'ses-a')
+        self.assertEqual('ses-a', self.store.get('a'))
+
+    def test_expiry(self):
+        self.store.put('a', 'ses-a')
+        self.clock.now += 61
+        self.assertIsNone(self.store.get('a'))
+
+    def test_lru(self):
+        self.store.put('a', 'ses-a')
+        self.store.put('b', 'ses-b')
+        self.store.get('a')
+        self.store.put('c', 'ses-c')
+        self.assertEqual(2, len(self.store))
+        self.assertIsNone(self.store.get('b'))
+        self.assertEqual('ses-a', self.store.get('a'))
+
+
+class testSQLiteDedupeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dedupe.db')
+        self.clock = FakeClock()
+        self.store = SQLiteDedupeStore(self.path, 60, self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_durable(self):
+        self.store.put('a', 'ses-a')
+        reopened = SQLiteDedupeStore(self.path, 60, self.clock)
+        self.assertEqual('ses-a', reopened.get('a'))
+        self.assertEqual(('ses-a', 1060.0), reopened.get_entry('a'))
+
+    def test_expiry(self):
+        self.store.put('a', 'ses-a')
+        self.clock.now += 61
+        self.assertIsNone(self.store.get('a'))
+        self.store.put('b', 'ses-b')
+        count = self.store._db.execute(
+            "SELECT COUNT(*) FROM delivered").fetchone()[0]
+        self.assertEqual(1, count)
+
+    def test_expiry_indexed(self):
+        plan = self.store._db.execute(
+            "EXPLAIN QUERY PLAN DELETE FROM delivered WHERE expires <= ?",
+            (0,)).fetchall()
+        self.assertIn('delivered_expires', str(plan))
+
+    def test_bad_path(self):
+        self.assertRaises(SESForwarderError, SQLiteDedupeStore,
+                          os.path.join(self.directory, 'missing', 'db'))
+
+
+class testDynamoDBDedupeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.clock = FakeClock()
+        self.store = DynamoDBDedupeStore(self.client, 'table', 60,
+                                         self.clock)
+
+    def test_put(self):
+        self.store.put('a', 'ses-a')
+        self.client.put_item.assert_called_with(TableName='table', Item={
+            'key': {'S': 'a'},
+            'messageId': {'S': 'ses-a'},
+            'expires': {'N': '1060'}
+        })
+
+    def test_get(self):
+        self.client.get_item.return_value = {'Item': {
+            'key': {'S': 'a'},
+            'messageId': {'S': 'ses-a'},
+            'expires': {'N': '1060'}
+        }}
+        self.assertEqual('ses-a', self.store.get('a'))
+        self.clock.now += 61
+        self.assertIsNone(self.store.get('a'))
+
+    def test_error(self):
+        self.client.get_item.side_effect = \
+            ClientError(ERROR_RESPONSE, 'GetItem')
+        self.assertRaises(SESForwarderError, self.store.get, 'a')
+
+
+class testTieredDedupeStore(unittest.TestCase):
+
+    def test_backend_fills_cache(self):
+        backend = Mock()
+        backend.get_entry.return_value = ('ses-a', 2000.0)
+        cache = MemoryDedupeStore(60, 10, FakeClock())
+        store = TieredDedupeStore(cache, backend)
+        self.assertEqual('ses-a', store.get('a'))
+        self.assertEqual('ses-a', store.get('a'))
+        self.assertEqual(1, backend.get_entry.call_count)
+        self.assertEqual('ses-a', cache.get('a'))
+
+    def test_put_writes_both(self):
+        backend = Mock()
+        cache = MemoryDedupeStore()
+        TieredDedupeStore(cache, backend).put('a', 'ses-a')
+        backend.put.assert_called_with('a', 'ses-a')
+        self.assertEqual('ses-a', cache.get('a'))
+
+
+class testDedupedSend(unittest.TestCase):
+
+    def setUp(self):
+        self.ses_mock = Mock()
+        self.ses_mock.send_raw_email.side_effect = \
+            lambda **kwargs: {'MessageId': 'ses-' + kwargs['Destinations'][0]}
+        self.store = MemoryDedupeStore()
+
+    def sender(self):
+        sender = SESSender(self.ses_mock, LOGGER, chunk_size=2,
+                           dedupe_store=self.store)
+        sender.set_email(TEST_SEND_EMAIL)
+        return sender
+
+    def test_duplicate_skipped(self):
+        self.sender().send(['a@b'], 'z@y', message_id='m1')
+        result = self.sender().send(['a@b'], 'z@y', message_id='m1')
+        self.assertEqual('ses-a@b', result['MessageId'])
+        self.assertTrue(result['Chunks'][0]['Duplicate'])
+        self.assertEqual(1, self.ses_mock.send_raw_email.call_count)
+
+    def test_other_message_sent(self):
+        self.sender().send(['a@b'], 'z@y', message_id='m1')
+        self.sender().send(['a@b'], 'z@y', message_id='m2')
+        self.assertEqual(2, self.ses_mock.send_raw_email.call_count)
+
+    def test_retry_sends_failed_chunks_only(self):
+        def fail_second(**kwargs):
+            if 'c@d' in kwargs['Destinations']:
+                raise ClientError(ERROR_RESPONSE, 'SendRawEmail')
+            return {'MessageId': 'ses-' + kwargs['Destinations'][0]}
+        self.ses_mock.send_raw_email.side_effect = fail_second
+        self.assertRaises(SESSendError, self.sender().send,
+                          ['a@b', 'c@d'], 'z@y', True, 'm1')
+
+        self.ses_mock.send_raw_email.reset_mock()
+        self.ses_mock.send_raw_email.side_effect = \
+            lambda **kwargs: {'MessageId': 'ses-' + kwargs['Destinations'][0]}
+        result = self.sender().send(['a@b', 'c@d'], 'z@y', True, 'm1')
+        self.assertEqual(1, self.ses_mock.send_raw_email.call_count)
+        self.assertTrue(result['Chunks'][0]['Duplicate'])
+        self.assertFalse('Duplicate' in result['Chunks'][1])
+
+    def test_store_unavailable(self):
+        store = Mock()
+        store.get.side_effect = SESForwarderError('down')
+        store.put.side_effect = SESForwarderError('down')
+        sender = SESSender(self.ses_mock, LOGGER, dedupe_store=store)
+        sender.set_email(TEST_SEND_EMAIL)
+        self.assertEqual('ses-a@b', sender.send(
+            ['a@b'], 'z@y', message_id='m1')['MessageId'])
+
+    def test_key(self):
+        self.assertEqual(dedupe_key('m1', ['A@b', 'c@d']),
+                         dedupe_key('m1', ['a@b', 'c@d']))
+        self.assertNotEqual(dedupe_key('m1', ['a@b']),
+                            dedupe_key('m1', ['c@d']))
+
+
+class testGetDedupeStore(unittest.TestCase):
+
+    def tearDown(self):
+        SimpleForwarder._DEDUPE_STORES.clear()
+
+    def test_none(self):
+        self.assertIsNone(get_dedupe_store({}))
+
+    def test_memory(self):
+        config = {'dedupe': {'backend': 'memory', 'ttl': 60}}
+        store = get_dedupe_store(config)
+        self.assertTrue(isinstance(store, MemoryDedupeStore))
+        self.assertIs(store, get_dedupe_store(config))
+
+    def test_sqlite(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = get_dedupe_store({'dedupe': {
+                'backend': 'sqlite',
+                'path': os.path.join(directory, 'dedupe.db')}})
+            self.assertTrue(isinstance(store, TieredDedupeStore))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_unknown(self):
+        self.assertRaises(SESForwarderError, get_dedupe_store,
+                          {'dedupe': {'backend': 'redis'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
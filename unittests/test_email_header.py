@@ -0,0 +1,114 @@
+import unittest
+import copy
+from SimpleForwarder import EmailHeader, SESEmail, SESEmailEvent, \
+    SESSender, unfold
+from mock import Mock
+from test_util import *
+
+FOLDED = [
+    'Received: from a.example.com',
+    '\tby b.example.com; Fri, 30 Dec 2016 03:27:23 -0800',
+    'From: "A Very Long Name"',
+    ' <someone@someplace.com>',
+    'Subject: Part one',
+    '  part two',
+    'Sender: someone@someplace.com',
+    'To: info@example.com'
+]
+
+
+class testEmailHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.header = EmailHeader(FOLDED)
+
+    def test_fields(self):
+        self.assertEqual(5, len(self.header))
+        self.assertEqual(FOLDED, self.header.lines())
+
+    def test_get_value(self):
+        self.assertEqual('"A Very Long Name"\r\n <someone@someplace.com>',
+                         self.header.get_value('from'))
+        self.assertEqual('"A Very Long Name" <someone@someplace.com>',
+                         unfold(self.header.get_value('From')))
+        self.assertIsNone(self.header.get_value('Reply-To'))
+
+    def test_has_field(self):
+        self.assertTrue(self.header.has_field('SENDER'))
+        self.assertFalse(self.header.has_field('Return-Path'))
+
+    def test_rewrite(self):
+        self.header.rewrite({'sender': None,
+                             'subject': 'Subject: [Pre] Part one\r\n  two'},
+                            ['Reply-To: <someone@someplace.com>'])
+        self.assertEqual(FOLDED[:4] +
+                         ['Subject: [Pre] Part one', '  two',
+                          'To: info@example.com',
+                          'Reply-To: <someone@someplace.com>'],
+                         self.header.lines())
+        self.assertEqual('<someone@someplace.com>',
+                         self.header.get_value('reply-to'))
+
+    def test_rewrite_duplicates(self):
+        header = EmailHeader(['From: a', 'From: b', 'Subject: c'])
+        header.rewrite({'from': 'From: d'})
+        self.assertEqual('From: d\r\nSubject: c', header.render())
+
+    def test_many_received(self):
+        lines = ['Received: from host{0}'.format(i) for i in range(500)]
+        header = EmailHeader(lines + ['From: a', 'Subject: b'])
+        header.rewrite({'received': None})
+        self.assertEqual(['From: a', 'Subject: b'], header.lines())
+
+
+class testFoldedEmail(unittest.TestCase):
+
+    def test_folded_from_and_subject(self):
+        email = TEST_EMAIL_BODY.replace(
+            'From: Some One <someone@someplace.com>',
+            'From: Some One\r\n <someone@someplace.com>')
+        email = email.replace('Subject: Testing for event format',
+                              'Subject: Testing for\r\n event format')
+        expected = TEST_SEND_EMAIL.replace(
+            'Subject: [TEST Info] Testing for event format',
+            'Subject: [TEST Info] Testing for\r\n event format')
+        expected = expected.replace(
+            'Reply-To: Some One <someone@someplace.com>',
+            'Reply-To: Some One\r\n <someone@someplace.com>')
+        testObj = SESEmail(email, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertEqual(expected, testObj.email())
+
+    def test_single_line_dkim(self):
+        email = 'DKIM-Signature: v=1; a=rsa-sha256\r\n' + TEST_EMAIL_BODY
+        testObj = SESEmail(email, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertEqual(TEST_SEND_EMAIL, testObj.email())
+
+    def test_dkim_in_body_untouched(self):
+        body = 'DKIM-Signature: quoted\r\n  in the body\r\n'
+        testObj = SESEmail(TEST_EMAIL_BODY + body, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertEqual(TEST_SEND_EMAIL + body, testObj.email())
+
+    def test_arc_headers(self):
+        arc = 'ARC-Seal: i=1; a=rsa-sha256\r\n\tcv=none\r\n' \
+              'ARC-Message-Signature: i=1\r\n'
+        config = copy.deepcopy(TEST_CONFIG)
+        testObj = SESEmail(arc + TEST_EMAIL_BODY, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), config, Mock())
+        self.assertEqual(arc + TEST_SEND_EMAIL, testObj.email())
+        config['stripArcHeaders'] = True
+        testObj = SESEmail(arc + TEST_EMAIL_BODY, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), config, Mock())
+        self.assertEqual(TEST_SEND_EMAIL, testObj.email())
+
+    def test_no_subject(self):
+        email = TEST_EMAIL_BODY.replace('Subject: ', 'Topic: ')
+        testObj = SESEmail(email, SESEmailEvent(TEST_EVENT),
+                           SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertTrue('Topic: Testing for event format' in testObj.email())
+
+
+if __name__ == '__main__':
+    unittest.main()
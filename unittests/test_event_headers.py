@@ -0,0 +1,126 @@
+import unittest
+import copy
+from SimpleForwarder import lambda_handler, S3Object, SESEmail, \
+    SESEmailEvent, SESSender, SESForwarderError
+from mock import Mock
+from StringIO import StringIO
+from test_util import *
+
+# The header fields of TEST_EMAIL_BODY as SES lists them in the event,
+# with folded values joined onto one line.
+TEST_HEADERS = [
+    {'name': 'Return-Path', 'value': '<someone@someplace.com>'},
+    {'name': 'DKIM-Signature',
+     'value': 'v=1; a=rsa-sha256; c=relaxed/relaxed; d=gmail.com; '
+              's=20161025; h=mime-version:from:date:message-id:subject:to; '
+              'bh=4c9vZm70ItvTkbMF9HikO6KKWJl5M95+W6HmkZxAYA0=; b=LUsCaJ4F'},
+    {'name': 'From', 'value': 'Some One <someone@someplace.com>'},
+    {'name': 'Subject', 'value': 'Testing for event format'},
+    {'name': 'To', 'value': 'info@example.com'}
+]
+
+
+def event_with_headers(headers=TEST_HEADERS, truncated=False):
+    event = copy.deepcopy(TEST_EVENT)
+    event['Records'][0]['ses']['mail']['headers'] = headers
+    event['Records'][0]['ses']['mail']['headersTruncated'] = truncated
+    return event
+
+
+def serve(stored):
+    """ A get_object that serves stored, honouring open-ended ranges. """
+    def get_object(Bucket, Key, Range=None):
+        start = int(Range[len('bytes='):-1]) if Range else 0
+        return {
+            'Body': StringIO(stored[start:]),
+            'ContentLength': len(stored) - start
+        }
+    return get_object
+
+
+get_object = serve(TEST_EMAIL_BODY)
+
+
+class testEventHeaders(unittest.TestCase):
+
+    def setUp(self):
+        self._ses_mock = Mock()
+        self._ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.side_effect = get_object
+        self._config = dict(TEST_CONFIG)
+        self._config['headersFromEvent'] = True
+
+    def email(self, event):
+        return SESEmail(S3Object(self._s3_mock, 'bucket', 'id'),
+                        SESEmailEvent(event),
+                        SESSender(self._ses_mock, Mock()),
+                        self._config, Mock())
+
+    def test_get_headers(self):
+        self.assertEqual(TEST_HEADERS,
+                         SESEmailEvent(event_with_headers()).get_headers())
+        self.assertIsNone(SESEmailEvent(TEST_EVENT).get_headers())
+        self.assertIsNone(SESEmailEvent(
+            event_with_headers(truncated=True)).get_headers())
+
+    def test_header_rewritten_without_s3(self):
+        email = self.email(event_with_headers())
+        self.assertFalse(self._s3_mock.get_object.called)
+        self.assertEqual(TEST_SEND_EMAIL, email.email())
+
+    def test_ranged_fetch(self):
+        self.email(event_with_headers()).email()
+        offset = int(self._s3_mock.get_object.call_args[1]['Range'][6:-1])
+        self.assertTrue(0 < offset <= TEST_EMAIL_BODY.index('\r\n\r\n'))
+
+    def test_header_only_message(self):
+        self._s3_mock.get_object.side_effect = serve(
+            TEST_EMAIL_BODY[:TEST_EMAIL_BODY.index('\r\n\r\n') + 2])
+        email = self.email(event_with_headers(TEST_HEADERS[2:]))
+        header_end = TEST_SEND_EMAIL.index('\r\n\r\n') + 2
+        self.assertEqual(TEST_SEND_EMAIL[:header_end], email.email())
+
+    def test_event_header_longer_than_stored(self):
+        # A Latin-1 Subject in S3 that the event gives as UTF-8 makes
+        # the event's fields longer than the stored header.
+        headers = copy.deepcopy(TEST_HEADERS[2:])
+        headers[1]['value'] = u'Caf\xe9 ' * 20
+        stored = ('From: Some One <someone@someplace.com>\r\n'
+                  'Subject: ' + 'Caf\xe9 ' * 20 + '\r\n'
+                  'To: info@example.com\r\n'
+                  '\r\n'
+                  '\r\npart one\r\n\r\npart two\r\n')
+        self._s3_mock.get_object.side_effect = serve(stored)
+        message = self.email(event_with_headers(headers)).email()
+        self.assertTrue(bytes(message).endswith(
+            b'\r\n\r\n\r\npart one\r\n\r\npart two\r\n'))
+        self.assertNotIn('Range',
+                         self._s3_mock.get_object.call_args[1])
+
+    def test_missing_end_of_header(self):
+        self._s3_mock.get_object.side_effect = None
+        self._s3_mock.get_object.return_value = {
+            'Body': StringIO('no header end'),
+            'ContentLength': 13
+        }
+        self.assertRaises(SESForwarderError,
+                          self.email(event_with_headers()).email)
+
+    def test_handler(self):
+        lambda_handler(event_with_headers(), {}, self._ses_mock,
+                       self._s3_mock, self._config)
+        self.assertIn('Range', self._s3_mock.get_object.call_args[1])
+        raw = self._ses_mock.send_raw_email.call_args[1]['RawMessage']['Data']
+        self.assertEqual(TEST_SEND_EMAIL, raw)
+
+    def test_truncated_headers_fetch_everything(self):
+        lambda_handler(event_with_headers(truncated=True), {}, self._ses_mock,
+                       self._s3_mock, self._config)
+        self.assertNotIn('Range', self._s3_mock.get_object.call_args[1])
+        raw = self._ses_mock.send_raw_email.call_args[1]['RawMessage']['Data']
+        self.assertEqual(TEST_SEND_EMAIL, raw)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import shutil
+import tempfile
+from SimpleForwarder import expand_groups, compile_alias_store, \
+    get_new_recipients, validate_config, AliasStore, RoutingIndex, \
+    SESForwarderError
+
+MAPPING = {
+    'all@example.com': ['Admin@example.com', 'members@example.com'],
+    'admin@example.com': ['user1@example.net', 'user2@example.net'],
+    'members@example.com': ['user2@example.net', 'user3@example.net'],
+    'everyone@example.com': ['all@example.com', 'guest@example.net'],
+    'example.com': ['admin@example.com']
+}
+
+
+def chain(length):
+    """ group0@ -> group1@ -> ... -> user@, length groups long. """
+    mapping = dict(('group{0}@example.com'.format(i),
+                    ['group{0}@example.com'.format(i + 1)])
+                   for i in range(length - 1))
+    mapping['group{0}@example.com'.format(length - 1)] = ['user@example.net']
+    return mapping
+
+
+class testExpandGroups(unittest.TestCase):
+
+    def test_group(self):
+        self.assertEqual(
+            ['user1@example.net', 'user2@example.net', 'user3@example.net'],
+            expand_groups(MAPPING)['all@example.com'])
+
+    def test_nested(self):
+        self.assertEqual(
+            ['user1@example.net', 'user2@example.net', 'user3@example.net',
+             'guest@example.net'],
+            expand_groups(MAPPING)['everyone@example.com'])
+
+    def test_domain_entry(self):
+        self.assertEqual(['user1@example.net', 'user2@example.net'],
+                         expand_groups(MAPPING)['example.com'])
+
+    def test_not_a_group_unchanged(self):
+        self.assertEqual(['user2@example.net', 'user3@example.net'],
+                         expand_groups(MAPPING)['members@example.com'])
+
+    def test_lists_itself(self):
+        mapping = {'info@example.com': ['info@example.com', 'team@x.com'],
+                   'team@x.com': ['user@example.net']}
+        self.assertEqual(['info@example.com', 'user@example.net'],
+                         expand_groups(mapping)['info@example.com'])
+
+    def test_cycle(self):
+        mapping = dict(MAPPING)
+        mapping['members@example.com'] = ['everyone@example.com']
+        with self.assertRaises(SESForwarderError) as raised:
+            expand_groups(mapping)
+        self.assertIn('cycle', str(raised.exception))
+
+    def test_depth_limit(self):
+        self.assertEqual(['user@example.net'],
+                         expand_groups(chain(4), 4)['group0@example.com'])
+        self.assertRaises(SESForwarderError, expand_groups, chain(5), 4)
+
+    def test_depth_limit_whatever_the_order(self):
+        # Expanding a deep group first mustn't hide it being nested
+        # again under another group.
+        mapping = chain(4)
+        mapping['top@example.com'] = ['group0@example.com']
+        for _ in range(10):
+            self.assertRaises(SESForwarderError, expand_groups,
+                              dict(mapping), 4)
+
+    def test_routing_index(self):
+        self.assertEqual(('user1@example.net', 'user2@example.net',
+                          'user3@example.net', 'guest@example.net'),
+                         RoutingIndex(MAPPING).lookup('everyone@example.com'))
+
+    def test_get_new_recipients(self):
+        config = validate_config({'emailBucket': 'bucket',
+                                  'forwardMapping': MAPPING})
+        self.assertEqual(
+            ['user1@example.net', 'user2@example.net', 'user3@example.net'],
+            get_new_recipients(['all@example.com', 'admin@example.com'],
+                               config))
+
+    def test_cycle_reported_at_load(self):
+        self.assertRaises(SESForwarderError, validate_config, {
+            'emailBucket': 'bucket',
+            'forwardMapping': {'a@example.com': ['b@example.com'],
+                               'b@example.com': ['a@example.com']}})
+
+
+class testCompiledGroups(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_store_expanded(self):
+        path = os.path.join(self._directory, 'aliases.db')
+        compile_alias_store(MAPPING, path)
+        self.assertEqual(('user1@example.net', 'user2@example.net',
+                          'user3@example.net'),
+                         AliasStore(path).get('all@example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from SimpleForwarder import HeaderTemplates, get_header_templates
+from test_util import *
+
+CONFIG = {
+    'fromEmail': '',
+    'subjectPrefix': {
+        'Default': '[Default] ',
+        'Info@Example.com': '[Info] ',
+        'example.org': '[Org] ',
+        '@Lists.example.org': '[Lists] ',
+        'admin@lists.example.org': '[Admin] '
+    }
+}
+
+
+class testHeaderTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.templates = HeaderTemplates(CONFIG, max_size=2)
+
+    def test_prefix_ignores_case(self):
+        template = self.templates.get(' INFO@example.com')
+        self.assertEqual('[Info] ', template.subject_prefix)
+        self.assertEqual('[Info] ',
+                         self.templates.get('info@example.com').subject_prefix)
+
+    def test_prefix_matched_like_routing(self):
+        for alias, prefix in [('info+news@example.com', '[Info] '),
+                              ('someone@example.org', '[Org] '),
+                              ('someone@mail.example.org', '[Org] '),
+                              ('someone@lists.example.org', '[Lists] '),
+                              ('admin+x@lists.example.org', '[Admin] '),
+                              ('someone@example.com', '[Default] ')]:
+            self.assertEqual(prefix, HeaderTemplates(CONFIG).get(
+                alias).subject_prefix)
+
+    def test_default_prefix(self):
+        template = self.templates.get('other@example.com')
+        self.assertEqual('[Default] ', template.subject_prefix)
+
+    def test_from_address(self):
+        self.assertEqual('info@example.com',
+                         self.templates.get('info@example.com').from_address)
+        config = dict(CONFIG, fromEmail='me@example.com')
+        self.assertEqual('me@example.com', HeaderTemplates(config).get(
+            'info@example.com').from_address)
+
+    def test_changes(self):
+        changes = self.templates.get('info@example.com').changes(
+            'Some One <someone@someplace.com>', 'Hello')
+        self.assertEqual('From: Some One at someone@someplace.com '
+                         '<info@example.com>', changes['from'])
+        self.assertEqual('Subject: [Info] Hello', changes['subject'])
+        for name in ['reply-to', 'return-path', 'sender', 'dkim-signature']:
+            self.assertIsNone(changes[name])
+        self.assertNotIn('arc-seal', changes)
+
+    def test_no_subject(self):
+        self.assertNotIn('subject', self.templates.get(
+            'info@example.com').changes('someone@someplace.com', None))
+
+    def test_strip_arc(self):
+        config = dict(CONFIG, stripArcHeaders=True)
+        changes = HeaderTemplates(config).get('info@example.com').changes(
+            'someone@someplace.com', None)
+        self.assertIsNone(changes['arc-seal'])
+
+    def test_reused(self):
+        template = self.templates.get('info@example.com')
+        self.assertIs(template, self.templates.get('info@example.com'))
+
+    def test_bounded(self):
+        first = self.templates.get('a@example.com')
+        self.templates.get('b@example.com')
+        self.templates.get('a@example.com')
+        self.templates.get('c@example.com')
+        self.assertEqual(2, len(self.templates))
+        self.assertIs(first, self.templates.get('a@example.com'))
+
+
+class testGetHeaderTemplates(unittest.TestCase):
+
+    def test_cached(self):
+        self.assertIs(get_header_templates(TEST_CONFIG),
+                      get_header_templates(TEST_CONFIG))
+
+    def test_rebuilt_when_settings_change(self):
+        config = dict(TEST_CONFIG)
+        templates = get_header_templates(config)
+        config['fromEmail'] = 'me@example.com'
+        self.assertIsNot(templates, get_header_templates(config))
+        self.assertEqual('me@example.com', get_header_templates(config).get(
+            'info@example.com').from_address)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,10 +15,11 @@ class testSESEmail(unittest.TestCase):
         'MessageId': 'some_message_id'
         }
         self._s3_mock = Mock()
-        self._read_dict = {'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY))}
-        self._get_mock = MagicMock()
-        self._get_mock.__getitem__.side_effect = self._read_dict.__getitem__
-        self._s3_mock.Object.return_value.get.return_value = self._get_mock
+        self._get_mock = {
+            'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY)),
+            'ContentLength': len(TEST_EMAIL_BODY)
+        }
+        self._s3_mock.get_object.return_value = self._get_mock
     
     def test_event_ok(self):
         self.assertIsNone(lambda_handler(TEST_EVENT, {},
@@ -44,5 +45,70 @@ class testSESEmail(unittest.TestCase):
 
         self.assertFalse(self._ses_mock.send_raw_email.called)
 
+    def test_multiple_records(self):
+        self._s3_mock.get_object.side_effect = \
+            lambda **kwargs: {'Body': StringIO(TEST_EMAIL_BODY)}
+        event = copy.deepcopy(TEST_EVENT)
+        second = copy.deepcopy(event['Records'][0])
+        second['ses']['mail']['messageId'] = 'second-message-id'
+        event['Records'].append(second)
+        report = lambda_handler(event, {},
+                                self._ses_mock,
+                                self._s3_mock,
+                                TEST_CONFIG)
+
+        self.assertEqual(2, self._ses_mock.send_raw_email.call_count)
+        self.assertEqual(2, report['succeeded'])
+        self.assertEqual(['3bnsm1c2akm1gded3speted0hpnglijt74jbd201',
+                          'second-message-id'],
+                         [r['messageId'] for r in report['results']])
+
+    def test_multiple_records_failure_raised(self):
+        self._s3_mock.get_object.side_effect = \
+            lambda **kwargs: {'Body': StringIO(TEST_EMAIL_BODY)}
+        self._ses_mock.send_raw_email.side_effect = \
+            ClientError(ERROR_RESPONSE, 'operation_name')
+        event = copy.deepcopy(TEST_EVENT)
+        event['Records'].append(copy.deepcopy(event['Records'][0]))
+        with self.assertRaises(SESForwarderError) as raised:
+            lambda_handler(event, {}, self._ses_mock, self._s3_mock,
+                           TEST_CONFIG)
+        self.assertIn('2 of 2 records', str(raised.exception))
+        self.assertEqual(2, self._ses_mock.send_raw_email.call_count)
+
+    def test_batch_report(self):
+        self._s3_mock.get_object.side_effect = \
+            lambda **kwargs: {'Body': StringIO(TEST_EMAIL_BODY)}
+        event = copy.deepcopy(TEST_EVENT)
+        spam = copy.deepcopy(event['Records'][0])
+        spam['ses']['receipt']['spamVerdict']['status'] = 'FAIL'
+        invalid = copy.deepcopy(event['Records'][0])
+        invalid['eventSource'] = 'aws:s3'
+        event['Records'].extend([spam, invalid])
+        report = batch_handler(event, {},
+                               self._ses_mock,
+                               self._s3_mock,
+                               TEST_CONFIG)
+
+        self.assertEqual(3, report['processed'])
+        self.assertEqual(1, report['failed'])
+        self.assertEqual(['sent', 'skipped', 'failed'],
+                         [r['status'] for r in report['results']])
+        self.assertEqual('some_message_id',
+                         report['results'][0]['sesMessageId'])
+
+    def test_batch_send_failure(self):
+        self._s3_mock.get_object.side_effect = \
+            lambda **kwargs: {'Body': StringIO(TEST_EMAIL_BODY)}
+        self._ses_mock.send_raw_email.side_effect = \
+            ClientError(ERROR_RESPONSE, 'operation_name')
+        report = batch_handler(TEST_EVENT, {},
+                               self._ses_mock,
+                               self._s3_mock,
+                               TEST_CONFIG)
+
+        self.assertEqual(1, report['failed'])
+        self.assertTrue('error' in report['results'][0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import io
+from SimpleForwarder import S3Object, S3Download, SESEmail, SESEmailEvent, SESSender
+from mock import Mock
+from test_util import *
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MESSAGE_HEADER = (b'From: Some One <someone@someplace.com>\r\n'
+                  b'To: info@example.com\r\n'
+                  b'Subject: A large message\r\n'
+                  b'\r\n')
+MESSAGE_BODY = b'0123456789abcdef' * (4 * 1024 * 1024 // 16)
+MESSAGE = MESSAGE_HEADER + MESSAGE_BODY
+
+
+@unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+class testPeakMemory(unittest.TestCase):
+
+    def setUp(self):
+        self._ses_mock = Mock()
+        self._ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.return_value = {
+            'Body': io.BytesIO(MESSAGE),
+            'ContentLength': len(MESSAGE)
+        }
+
+    def forward(self):
+        tracemalloc.start()
+        try:
+            download = S3Object(self._s3_mock, 'bucket', 'id').open('Body')
+            self.email = SESEmail(download, SESEmailEvent(TEST_EVENT),
+                                  SESSender(self._ses_mock, Mock()),
+                                  TEST_CONFIG, Mock())
+            self.email.send()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_near_message_size(self):
+        peak = self.forward()
+        self.assertLess(peak, 1.1 * len(MESSAGE))
+
+    def test_body_passed_through(self):
+        self.forward()
+        raw = self._ses_mock.send_raw_email.call_args[1]['RawMessage']['Data']
+        self.assertIs(self.email.email(), raw)
+        self.assertTrue(raw.endswith(MESSAGE_BODY))
+        self.assertIn(b'Subject: [TEST Info] A large message\r\n',
+                      bytes(raw[:1024]))
+        self.assertIn(b'\r\n\r\n0123', bytes(raw[:1024]))
+
+    def test_bytes_copied_once(self):
+        tracemalloc.start()
+        try:
+            email = SESEmail(MESSAGE, SESEmailEvent(TEST_EVENT),
+                             SESSender(self._ses_mock, Mock()),
+                             TEST_CONFIG, Mock())
+            raw = email.email()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1.1 * len(MESSAGE))
+        self.assertTrue(raw.endswith(MESSAGE_BODY))
+
+    def test_spilled_message_not_in_memory(self):
+        tracemalloc.start()
+        try:
+            download = S3Object(self._s3_mock, 'bucket', 'id').open(
+                'Body', spill_threshold=1024 * 1024)
+            email = SESEmail(download, SESEmailEvent(TEST_EVENT),
+                             SESSender(self._ses_mock, Mock()),
+                             TEST_CONFIG, Mock())
+            email.send()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 0.1 * len(MESSAGE))
+        raw = self._ses_mock.send_raw_email.call_args[1]['RawMessage']['Data']
+        self.assertTrue(bytes(raw).endswith(MESSAGE_BODY))
+
+    def test_header_larger_than_headroom(self):
+        download = S3Download(io.BytesIO(MESSAGE), len(MESSAGE),
+                              'bucket', 'id', headroom=0)
+        email = SESEmail(download, SESEmailEvent(TEST_EVENT),
+                         SESSender(self._ses_mock, Mock()),
+                         TEST_CONFIG, Mock())
+        self.assertTrue(email.email().endswith(MESSAGE_BODY))
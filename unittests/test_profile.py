@@ -0,0 +1,117 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from SimpleForwarder import lambda_handler, sample_profile, \
+    get_profile_sink, FileProfileSink, Profile, S3ProfileSink
+from mock import Mock, patch
+from StringIO import StringIO
+from test_util import *
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class testProfile(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._ses_mock = Mock()
+        self._ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.side_effect = lambda **kwargs: {
+            'Body': StringIO(TEST_EMAIL_BODY),
+            'ContentLength': len(TEST_EMAIL_BODY)
+        }
+        self._config = dict(TEST_CONFIG, profileRate=1,
+                            profileSink=self._directory)
+        self._context = Mock()
+        self._context.aws_request_id = 'request-1'
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def forward(self):
+        lambda_handler(TEST_EVENT, self._context, self._ses_mock,
+                       self._s3_mock, self._config)
+
+    def reports(self):
+        reports = []
+        for name in sorted(os.listdir(self._directory)):
+            with open(os.path.join(self._directory, name)) as fp:
+                reports.append(json.load(fp))
+        return reports
+
+    def test_report_written(self):
+        self.forward()
+        self.assertTrue(os.listdir(self._directory)[0].endswith(
+            '-request-1.json'))
+        report = self.reports()[0]
+        self.assertEqual('request-1', report['requestId'])
+        self.assertEqual([len(TEST_SEND_EMAIL)],
+                         [email['messageSize'] for email in report['emails']])
+        functions = [f['function'] for f in report['functions']]
+        self.assertTrue([f for f in functions if '(forward_email)' in f])
+        self.assertTrue(self._ses_mock.send_raw_email.called)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_allocations(self):
+        self.forward()
+        report = self.reports()[0]
+        self.assertIn('peakMemory', report)
+        self.assertTrue(report['allocations'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_not_sampled(self):
+        self._config['profileRate'] = 0
+        with patch('SimpleForwarder.Profile') as profile:
+            self.forward()
+        self.assertFalse(profile.called)
+        self.assertEqual([], os.listdir(self._directory))
+
+    def test_sampling_rate(self):
+        self._config['profileRate'] = 0.5
+        with patch('random.random', return_value=0.7):
+            self.assertIsNone(sample_profile(self._config))
+        with patch('random.random', return_value=0.2):
+            self.assertIsNotNone(sample_profile(self._config))
+
+    def test_rate_from_environment(self):
+        del self._config['profileRate']
+        with patch.dict('os.environ', {'FORWARDER_PROFILE_RATE': '1'}):
+            self.assertIsNotNone(sample_profile(self._config))
+        with patch.dict('os.environ', {'FORWARDER_PROFILE_RATE': ''}):
+            self.assertIsNone(sample_profile(self._config))
+
+    def test_error_recorded(self):
+        self._ses_mock.send_raw_email.side_effect = ValueError('failed')
+        self.assertRaises(ValueError, self.forward)
+        self.assertEqual('failed', self.reports()[0]['error'])
+
+    def test_sink_failure_ignored(self):
+        sink = Mock()
+        sink.write.side_effect = IOError()
+        self.assertEqual(2, Profile(sink).run(lambda x: x + 1, 1))
+
+
+class testProfileSinks(unittest.TestCase):
+
+    def test_s3(self):
+        client = Mock()
+        with patch('SimpleForwarder.get_client', return_value=client):
+            sink = get_profile_sink('s3://bucket/profiles/')
+        self.assertIsInstance(sink, S3ProfileSink)
+        self.assertEqual('s3://bucket/profiles/name.json',
+                         sink.write('name.json', {'elapsedTime': 1.0}))
+        self.assertEqual('profiles/name.json',
+                         client.put_object.call_args[1]['Key'])
+
+    def test_file(self):
+        self.assertIsInstance(get_profile_sink('/tmp'), FileProfileSink)
+
+
+if __name__ == '__main__':
+    unittest.main()
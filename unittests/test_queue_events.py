@@ -0,0 +1,139 @@
+import unittest
+import copy
+import json
+from SimpleForwarder import lambda_handler, batch_handler, is_queue_event, \
+    unwrap_record, SESForwarderError
+from botocore.exceptions import ClientError
+from mock import Mock
+from StringIO import StringIO
+from test_util import *
+
+
+def notification(message_id, notification_type='Received'):
+    record = TEST_EVENT['Records'][0]['ses']
+    mail = copy.deepcopy(record['mail'])
+    mail['messageId'] = message_id
+    return {
+        'notificationType': notification_type,
+        'mail': mail,
+        'receipt': copy.deepcopy(record['receipt'])
+    }
+
+
+def sns_envelope(message, message_type='Notification'):
+    return {
+        'Type': message_type,
+        'MessageId': 'sns-id',
+        'TopicArn': 'arn:aws:sns:eu-west-1:123456789012:inbound',
+        'Message': json.dumps(message)
+    }
+
+
+def sqs_record(item, body):
+    return {
+        'messageId': item,
+        'eventSource': 'aws:sqs',
+        'body': json.dumps(body)
+    }
+
+
+def sns_record(message):
+    return {
+        'EventSource': 'aws:sns',
+        'Sns': sns_envelope(message)
+    }
+
+
+class testUnwrap(unittest.TestCase):
+
+    def test_sqs_with_sns(self):
+        record = unwrap_record(sqs_record('1', sns_envelope(
+            notification('email-1'))))
+        self.assertEqual('aws:ses', record['eventSource'])
+        self.assertEqual('email-1', record['ses']['mail']['messageId'])
+
+    def test_sqs_raw_delivery(self):
+        record = unwrap_record(sqs_record('1', notification('email-1')))
+        self.assertEqual('email-1', record['ses']['mail']['messageId'])
+
+    def test_sns(self):
+        record = unwrap_record(sns_record(notification('email-1')))
+        self.assertEqual(['info@example.com', 'members@example.com'],
+                         record['ses']['receipt']['recipients'])
+
+    def test_not_received(self):
+        self.assertIsNone(unwrap_record(sqs_record('1', sns_envelope(
+            {'notificationType': 'AMAZON_SES_SETUP_NOTIFICATION'}))))
+        self.assertIsNone(unwrap_record(sqs_record('1', sns_envelope(
+            {}, 'SubscriptionConfirmation'))))
+
+    def test_invalid(self):
+        record = {'messageId': '1', 'eventSource': 'aws:sqs',
+                  'body': 'not json'}
+        self.assertRaises(SESForwarderError, unwrap_record, record)
+        self.assertRaises(SESForwarderError, unwrap_record,
+                          sqs_record('1', {'notificationType': 'Received'}))
+
+    def test_ses_record_unchanged(self):
+        record = TEST_EVENT['Records'][0]
+        self.assertIs(record, unwrap_record(record))
+
+    def test_is_queue_event(self):
+        self.assertTrue(is_queue_event({'Records': [sqs_record('1', {})]}))
+        self.assertTrue(is_queue_event({'Records': [sns_record({})]}))
+        self.assertFalse(is_queue_event(TEST_EVENT))
+        self.assertFalse(is_queue_event({}))
+
+
+class testQueueHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._ses_mock = Mock()
+        self._ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.side_effect = self.get_object
+
+    def get_object(self, Bucket, Key):
+        if Key == 'missing':
+            raise ClientError(ERROR_RESPONSE, 'GetObject')
+        return {'Body': StringIO(TEST_EMAIL_BODY),
+                'ContentLength': len(TEST_EMAIL_BODY)}
+
+    def test_sqs_batch(self):
+        event = {'Records': [
+            sqs_record('1', sns_envelope(notification('email-1'))),
+            sqs_record('2', notification('email-2'))
+        ]}
+        response = lambda_handler(event, {}, self._ses_mock, self._s3_mock,
+                                  TEST_CONFIG)
+        self.assertEqual({'batchItemFailures': []}, response)
+        self.assertEqual(2, self._ses_mock.send_raw_email.call_count)
+
+    def test_partial_failure(self):
+        event = {'Records': [
+            sqs_record('1', sns_envelope(notification('email-1'))),
+            sqs_record('2', sns_envelope(notification('missing'))),
+            {'messageId': '3', 'eventSource': 'aws:sqs', 'body': '{'},
+            sqs_record('4', sns_envelope({}, 'SubscriptionConfirmation'))
+        ]}
+        response = batch_handler(event, {}, self._ses_mock, self._s3_mock,
+                                 TEST_CONFIG)
+        self.assertEqual([{'itemIdentifier': '3'}, {'itemIdentifier': '2'}],
+                         response['batchItemFailures'])
+        self.assertEqual(1, self._ses_mock.send_raw_email.call_count)
+
+    def test_sns(self):
+        event = {'Records': [sns_record(notification('email-1'))]}
+        self.assertEqual({'batchItemFailures': []},
+                         lambda_handler(event, {}, self._ses_mock,
+                                        self._s3_mock, TEST_CONFIG))
+        self.assertEqual(1, self._ses_mock.send_raw_email.call_count)
+
+    def test_sns_failure_raised(self):
+        event = {'Records': [sns_record(notification('missing'))]}
+        self.assertRaises(SESForwarderError, lambda_handler, event, {},
+                          self._ses_mock, self._s3_mock, TEST_CONFIG)
+
+
+if __name__ == '__main__':
+    unittest.main()
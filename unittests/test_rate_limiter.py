@@ -0,0 +1,164 @@
+import unittest
+import logging
+import SimpleForwarder
+from SimpleForwarder import RateLimiter, SESSender, get_rate_limiter
+from mock import Mock
+from botocore.exceptions import ClientError, EndpointConnectionError, \
+    ReadTimeoutError
+from test_util import *
+
+LOGGER = logging.getLogger()
+
+THROTTLED = {'Error': {'Code': 'Throttling',
+                       'Message': 'Maximum sending rate exceeded.'}}
+DAILY_QUOTA = {'Error': {'Code': 'Throttling',
+                         'Message': 'Daily message quota exceeded.'}}
+UNAVAILABLE = {'Error': {'Code': 'ServiceUnavailable'},
+               'ResponseMetadata': {'HTTPStatusCode': 503}}
+
+
+class testRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(10, self.clock.time, self.clock.sleep)
+
+    def test_burst(self):
+        for _ in range(10):
+            self.assertEqual(0, self.limiter.acquire())
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_waits_when_empty(self):
+        self.limiter.acquire(10)
+        self.assertAlmostEqual(0.5, self.limiter.acquire(5))
+        self.assertAlmostEqual(0.5, self.limiter.get_total_wait())
+
+    def test_refills(self):
+        self.limiter.acquire(10)
+        self.clock.now += 1
+        self.assertEqual(0, self.limiter.acquire(10))
+
+    def test_larger_than_burst(self):
+        self.assertEqual(0, self.limiter.acquire(30))
+        # The bucket is now 20 tokens in debt.
+        self.assertAlmostEqual(2.1, self.limiter.acquire(1))
+
+
+class testThrottledSend(unittest.TestCase):
+
+    def setUp(self):
+        self.ses_mock = Mock()
+
+    def sender(self, **kwargs):
+        sender = SESSender(self.ses_mock, LOGGER, backoff=0, **kwargs)
+        sender.set_email(TEST_SEND_EMAIL)
+        return sender
+
+    def test_retries_throttling(self):
+        self.ses_mock.send_raw_email.side_effect = [
+            ClientError(THROTTLED, 'SendRawEmail'),
+            ClientError(THROTTLED, 'SendRawEmail'),
+            {'MessageId': 'id'}
+        ]
+        sender = self.sender()
+        self.assertEqual('id', sender.send(['a@b'], 'z@y')['MessageId'])
+        metrics = sender.get_metrics()
+        self.assertEqual(1, metrics['sends'])
+        self.assertEqual(2, metrics['throttled'])
+
+    def test_gives_up(self):
+        self.ses_mock.send_raw_email.side_effect = \
+            ClientError(THROTTLED, 'SendRawEmail')
+        sender = self.sender(max_retries=2)
+        self.assertRaises(ClientError, sender.send, ['a@b'], 'z@y')
+        self.assertEqual(3, self.ses_mock.send_raw_email.call_count)
+
+    def test_daily_quota_not_retried(self):
+        self.ses_mock.send_raw_email.side_effect = \
+            ClientError(DAILY_QUOTA, 'SendRawEmail')
+        self.assertRaises(ClientError, self.sender().send, ['a@b'], 'z@y')
+        self.assertEqual(1, self.ses_mock.send_raw_email.call_count)
+
+    def test_other_errors_not_retried(self):
+        self.ses_mock.send_raw_email.side_effect = \
+            ClientError(ERROR_RESPONSE, 'SendRawEmail')
+        self.assertRaises(ClientError, self.sender().send, ['a@b'], 'z@y')
+        self.assertEqual(1, self.ses_mock.send_raw_email.call_count)
+
+    def test_transient_errors_retried(self):
+        self.ses_mock.send_raw_email.side_effect = [
+            ClientError(UNAVAILABLE, 'SendRawEmail'),
+            EndpointConnectionError(endpoint_url='https://ses'),
+            {'MessageId': 'id'}
+        ]
+        sender = self.sender()
+        self.assertEqual('id', sender.send(['a@b'], 'z@y')['MessageId'])
+        self.assertEqual(0, sender.get_metrics()['throttled'])
+
+    def test_read_timeout_not_retried(self):
+        # SES may have sent the message before the response was lost.
+        self.ses_mock.send_raw_email.side_effect = ReadTimeoutError(
+            endpoint_url='https://ses')
+        self.assertRaises(ReadTimeoutError, self.sender().send,
+                          ['a@b'], 'z@y')
+        self.assertEqual(1, self.ses_mock.send_raw_email.call_count)
+
+    def test_every_attempt_paced(self):
+        clock = FakeClock()
+        limiter = RateLimiter(1, clock.time, clock.sleep)
+        self.ses_mock.send_raw_email.side_effect = [
+            ClientError(THROTTLED, 'SendRawEmail'),
+            {'MessageId': 'id'}
+        ]
+        self.sender(rate_limiter=limiter).send(['a@b'], 'z@y')
+        self.assertEqual([1.0], clock.sleeps)
+
+    def test_rate_limited(self):
+        clock = FakeClock()
+        limiter = RateLimiter(1, clock.time, clock.sleep)
+        self.ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        sender = self.sender(rate_limiter=limiter, max_workers=1)
+        sender.send(['a@b', 'c@d', 'e@f'], 'z@y', per_recipient=True)
+        self.assertEqual([1.0, 1.0], clock.sleeps)
+        self.assertAlmostEqual(2.0, sender.get_metrics()['waitTime'])
+
+
+class testGetRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        SimpleForwarder._RATE_LIMITERS.clear()
+
+    def tearDown(self):
+        SimpleForwarder._RATE_LIMITERS.clear()
+
+    def test_from_quota(self):
+        ses_mock = Mock()
+        ses_mock.get_send_quota.return_value = {'MaxSendRate': 14.0}
+        limiter = get_rate_limiter(ses_mock, {})
+        self.assertEqual(14.0, limiter.get_rate())
+        self.assertIs(limiter, get_rate_limiter(ses_mock, {}))
+        self.assertEqual(1, ses_mock.get_send_quota.call_count)
+
+    def test_quota_unavailable(self):
+        ses_mock = Mock()
+        ses_mock.get_send_quota.side_effect = \
+            ClientError(ERROR_RESPONSE, 'GetSendQuota')
+        self.assertIsNone(get_rate_limiter(ses_mock, {}))
+
+    def test_configured(self):
+        ses_mock = Mock()
+        self.assertEqual(5, get_rate_limiter(ses_mock,
+                                             {'maxSendRate': 5}).get_rate())
+        self.assertIsNone(get_rate_limiter(ses_mock, {'maxSendRate': 0}))
+        self.assertFalse(ses_mock.get_send_quota.called)
+
+    def test_quota_shared_between_containers(self):
+        ses_mock = Mock()
+        ses_mock.get_send_quota.return_value = {'MaxSendRate': 14.0}
+        limiter = get_rate_limiter(ses_mock, {'expectedContainers': 4})
+        self.assertEqual(3.5, limiter.get_rate())
+        self.assertEqual(14.0, get_rate_limiter(ses_mock, {}).get_rate())
+
+
+if __name__ == '__main__':
+    unittest.main()
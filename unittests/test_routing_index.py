@@ -0,0 +1,88 @@
+import unittest
+from SimpleForwarder import RoutingIndex, get_new_recipients, \
+    get_routing_index
+from test_util import *
+
+MAPPING = {
+    'Info@Example.com': ['user1@example.com', 'user2@example.com'],
+    'admin@example.com': ['user2@example.com', 'user3@example.com'],
+    'example.com': ['postmaster@example.com'],
+    '@lists.example.org': ['lists@example.com'],
+    '@': ['everything@example.com']
+}
+
+
+class testRoutingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RoutingIndex(MAPPING)
+
+    def test_exact(self):
+        self.assertEqual(('user1@example.com', 'user2@example.com'),
+                         self.index.lookup('info@example.com'))
+
+    def test_case_insensitive(self):
+        self.assertEqual(('user1@example.com', 'user2@example.com'),
+                         self.index.lookup(' INFO@example.COM '))
+
+    def test_plus_address(self):
+        self.assertEqual(('user1@example.com', 'user2@example.com'),
+                         self.index.lookup('info+news@example.com'))
+
+    def test_domain(self):
+        self.assertEqual(('postmaster@example.com',),
+                         self.index.lookup('nobody@example.com'))
+
+    def test_parent_domain(self):
+        self.assertEqual(('postmaster@example.com',),
+                         self.index.lookup('nobody@mail.example.com'))
+        self.assertEqual(('lists@example.com',),
+                         self.index.lookup('a@b.lists.example.org'))
+
+    def test_catch_all(self):
+        self.assertEqual(('everything@example.com',),
+                         self.index.lookup('someone@elsewhere.net'))
+        self.assertEqual(('everything@example.com',),
+                         self.index.lookup('no-domain'))
+
+    def test_has_route(self):
+        self.assertTrue(self.index.has_route('info+news@example.com'))
+        self.assertTrue(self.index.has_route('nobody@mail.example.com'))
+        self.assertFalse(self.index.has_route('someone@elsewhere.net'))
+        self.assertFalse(self.index.has_route('example.com'))
+
+    def test_no_match(self):
+        index = RoutingIndex({'admin@example.com': ['a@example.com']})
+        self.assertIsNone(index.lookup('info@example.org'))
+        self.assertEqual([], index.get_recipients(['info@example.org']))
+
+    def test_ordered_dedupe(self):
+        self.assertEqual(['user1@example.com', 'user2@example.com',
+                          'user3@example.com'],
+                         self.index.get_recipients(['info@example.com',
+                                                    'admin@example.com']))
+
+    def test_len(self):
+        self.assertEqual(5, len(self.index))
+
+
+class testGetNewRecipients(unittest.TestCase):
+
+    def test_get_new_recipients(self):
+        self.assertEqual(TEST_EMAILS['info'],
+                         get_new_recipients(['INFO@example.com'],
+                                            TEST_CONFIG))
+
+    def test_index_is_cached(self):
+        self.assertIs(get_routing_index(TEST_CONFIG),
+                      get_routing_index(TEST_CONFIG))
+
+    def test_new_mapping_rebuilds(self):
+        config = dict(TEST_CONFIG)
+        config['forwardMapping'] = {'info@example.com': ['a@example.com']}
+        self.assertEqual(['a@example.com'],
+                         get_new_recipients(['info@example.com'], config))
+
+
+if __name__ == '__main__':
+    unittest.main()
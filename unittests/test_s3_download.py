@@ -0,0 +1,114 @@
+import unittest
+import socket
+from SimpleForwarder import S3Object, S3Download, SpilledDownload, \
+    SESEmail, SESEmailEvent, SESSender, SESForwarderError
+from mock import Mock
+from StringIO import StringIO
+from test_util import *
+
+
+class testS3Download(unittest.TestCase):
+
+    def download(self, body=TEST_EMAIL_BODY, length=None, **kwargs):
+        if length is None:
+            length = len(body)
+        return S3Download(StringIO(body), length, 'bucket', 'some-id',
+                          **kwargs)
+
+    def test_read_all(self):
+        download = self.download(chunk_size=16)
+        self.assertEqual(TEST_EMAIL_BODY, download.read_all())
+        self.assertEqual(len(TEST_EMAIL_BODY), download.get_bytes_read())
+
+    def test_chunks(self):
+        chunks = list(self.download(chunk_size=100))
+        self.assertEqual(100, len(chunks[0]))
+        self.assertEqual(TEST_EMAIL_BODY, ''.join(chunks))
+
+    def test_unknown_length(self):
+        download = S3Download(StringIO(TEST_EMAIL_BODY), None,
+                              'bucket', 'some-id', chunk_size=16)
+        self.assertEqual(TEST_EMAIL_BODY, download.read_all())
+
+    def test_too_large(self):
+        self.assertRaises(SESForwarderError, self.download, max_size=10)
+
+    def test_too_large_unknown_length(self):
+        download = S3Download(StringIO(TEST_EMAIL_BODY), None,
+                              'bucket', 'some-id', max_size=10)
+        self.assertRaises(SESForwarderError, download.read_all)
+
+    def test_incomplete(self):
+        download = self.download(length=len(TEST_EMAIL_BODY) + 10)
+        self.assertRaises(SESForwarderError, download.read_all)
+
+    def test_overflow(self):
+        download = self.download(length=10)
+        self.assertRaises(SESForwarderError, download.read_all)
+
+    def test_chunk_timeout(self):
+        stream = Mock()
+        stream.read.side_effect = socket.timeout()
+        download = S3Download(stream, 100, 'bucket', 'some-id',
+                              chunk_timeout=2)
+        stream.set_socket_timeout.assert_called_with(2)
+        self.assertRaises(SESForwarderError, download.read_all)
+
+
+class testStreamingFetch(unittest.TestCase):
+
+    def setUp(self):
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.return_value = {
+            'Body': StringIO(TEST_EMAIL_BODY),
+            'ContentLength': len(TEST_EMAIL_BODY)
+        }
+
+    def test_open(self):
+        download = S3Object(self._s3_mock, 'bucket', 'some-id').open(
+            'Body', chunk_size=32)
+        self.assertEqual(len(TEST_EMAIL_BODY), download.get_content_length())
+        self.assertEqual(0, download.get_bytes_read())
+        self.assertEqual(TEST_EMAIL_BODY, download.read_all())
+
+    def test_email_from_download(self):
+        body = TEST_EMAIL_BODY + 'More.\r\n' * 100
+        self._s3_mock.get_object.return_value = {
+            'Body': StringIO(body),
+            'ContentLength': len(body)
+        }
+        download = S3Object(self._s3_mock, 'bucket', 'some-id').open(
+            'Body', chunk_size=32)
+        email = SESEmail(download, SESEmailEvent(TEST_EVENT),
+                         SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertTrue(download.get_bytes_read() < len(body))
+        self.assertEqual(TEST_SEND_EMAIL + 'More.\r\n' * 100, email.email())
+
+    def test_small_object_in_memory(self):
+        download = S3Object(self._s3_mock, 'bucket', 'some-id').open(
+            'Body', spill_threshold=len(TEST_EMAIL_BODY))
+        self.assertNotIsInstance(download, SpilledDownload)
+
+    def test_large_object_spilled(self):
+        download = S3Object(self._s3_mock, 'bucket', 'some-id').open(
+            'Body', chunk_size=32, spill_threshold=100)
+        self.assertIsInstance(download, SpilledDownload)
+        self.assertEqual(TEST_EMAIL_BODY, bytes(download.read_all()))
+
+    def test_email_from_spilled_download(self):
+        download = S3Object(self._s3_mock, 'bucket', 'some-id').open(
+            'Body', chunk_size=32, spill_threshold=100)
+        email = SESEmail(download, SESEmailEvent(TEST_EVENT),
+                         SESSender(Mock(), Mock()), TEST_CONFIG, Mock())
+        self.assertEqual(TEST_SEND_EMAIL, email.email()[:])
+
+    def test_splice_after_read_all(self):
+        download = SpilledDownload(StringIO(TEST_EMAIL_BODY),
+                                   len(TEST_EMAIL_BODY), 'bucket', 'some-id')
+        download.read_all()
+        self.assertEqual(b'Header\r\n\r\nTest message.\r\n',
+                         download.splice(b'Header\r\n',
+                                         TEST_EMAIL_BODY.index('\r\n\r\n') + 2))
+
+if __name__ == '__main__':
+    unittest.main()
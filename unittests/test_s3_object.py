@@ -13,7 +13,7 @@ class testS3Object(unittest.TestCase):
         get_mock = MagicMock()
         read_dict = {'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY))}
         get_mock.__getitem__.side_effect = read_dict.__getitem__
-        self._s3_mock.Object.return_value.get.return_value = get_mock
+        self._s3_mock.get_object.return_value = get_mock
         self._bucket = "bucket"
         self._id = "some-id"
 
@@ -29,8 +29,8 @@ class testS3Object(unittest.TestCase):
         get_mock = MagicMock()
         read_dict = {'Body': MagicMock(spec=file, wraps=StringIO(TEST_EMAIL_BODY))}
         get_mock.__getitem__.side_effect = read_dict.__getitem__
-        s3_mock.Object.return_value.get.return_value = get_mock
-        s3_mock.Object.return_value.get.side_effect = ClientError(ERROR_RESPONSE,'operation_name')
+        s3_mock.get_object.return_value = get_mock
+        s3_mock.get_object.side_effect = ClientError(ERROR_RESPONSE,'operation_name')
         testObj = S3Object(s3_mock,
                            self._bucket,
                            self._id)
@@ -128,6 +128,30 @@ class testSESEmail(unittest.TestCase):
                            self._logger)
         self.assertRaises(SESForwarderError, testObj.send)
 
+    def test_send_per_recipient(self):
+        ses_mock = Mock()
+        ses_mock.send_raw_email.side_effect = \
+            lambda **kwargs: {'MessageId': kwargs['Destinations'][0]}
+        config = copy.deepcopy(self._config)
+        config['perRecipientDelivery'] = ['INFO@example.com']
+        testObj = SESEmail(TEST_EMAIL_BODY, self._event,
+                           SESSender(ses_mock, LOGGER), config,
+                           self._logger)
+        result = testObj.send()
+        self.assertEqual(3, ses_mock.send_raw_email.call_count)
+        self.assertEqual(['user1@example.com', 'user2@example.com',
+                          'user3@example.com'],
+                         [c['MessageId'] for c in result['Chunks']])
+
+    def test_send_per_recipient_not_listed(self):
+        config = copy.deepcopy(self._config)
+        config['perRecipientDelivery'] = ['admin@example.com']
+        testObj = SESEmail(TEST_EMAIL_BODY, self._event,
+                           self._sender, config, self._logger)
+        self.assertEqual('some_message_id', testObj.send()['MessageId'])
+        self.assertEqual('some_message_id',
+                         testObj.send(per_recipient=True)['MessageId'])
+
     def test_send_raw_exception(self):
         sender = Mock()
         sender.send_raw_email.return_value = {
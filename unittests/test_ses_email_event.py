@@ -1,6 +1,7 @@
 import unittest
 from SimpleForwarder import SESEmailEvent, SESForwarderError
 from test_util import TEST_EVENT
+import copy
 
 class testSESEmailEvent(unittest.TestCase):
 
@@ -25,6 +26,17 @@ class testSESEmailEvent(unittest.TestCase):
         expected = ['info@example.com', 'members@example.com']
         self.assertEqual(recipients, expected)
 
+    def test_second_record(self):
+        event = copy.deepcopy(TEST_EVENT)
+        second = copy.deepcopy(event['Records'][0])
+        second['ses']['receipt']['recipients'] = ['admin@example.com']
+        event['Records'].append(second)
+        test = SESEmailEvent(event, 1)
+        self.assertEqual(test.get_recipients(), ['admin@example.com'])
+
+    def test_missing_record(self):
+        self.assertRaises(SESForwarderError, SESEmailEvent, TEST_EVENT, 1)
+
     def test_invalid_event(self):
         invalid = TEST_EVENT['eventVersion'] = '2.0'
         self.assertRaises(SESForwarderError, SESEmailEvent, invalid)
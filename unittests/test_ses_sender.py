@@ -1,7 +1,9 @@
 import unittest
 import logging
-from SimpleForwarder import SESSender, SESForwarderError
+import time
+from SimpleForwarder import SESSender, SESForwarderError, SESSendError
 from mock import Mock
+from botocore.exceptions import ClientError, ReadTimeoutError
 from test_util import *
 
 LOGGER = logging.getLogger()
@@ -21,7 +23,10 @@ class testSESSender(unittest.TestCase):
     def test_send_ok(self):
         self.sender.set_email(TEST_SEND_EMAIL)
         result = self.sender.send(self.recipients, self.original[0])
-        self.assertEqual(result, {'MessageId': 'some_message_id'})
+        self.assertEqual(result, {
+            'MessageId': 'some_message_id',
+            'Chunks': [{'Destinations': self.recipients,
+                        'MessageId': 'some_message_id'}]})
 
     def test_send_ko(self):
         self.assertRaises(SESForwarderError,
@@ -32,7 +37,85 @@ class testSESSender(unittest.TestCase):
     def test_set_email(self):
         self.sender.set_email(TEST_SEND_EMAIL)
         self.assertEqual(TEST_SEND_EMAIL, self.sender.get_email())
+
+    def test_send_chunks(self):
+        ses_mock = Mock()
+        ses_mock.send_raw_email.side_effect = \
+            lambda **kwargs: {'MessageId': kwargs['Destinations'][0]}
+        sender = SESSender(ses_mock, LOGGER, chunk_size=2)
+        sender.set_email(TEST_SEND_EMAIL)
+        recipients = ['a@b', 'c@d', 'e@f', 'g@h', 'i@j']
+        result = sender.send(recipients, self.original[0])
+
+        self.assertEqual(3, ses_mock.send_raw_email.call_count)
+        self.assertEqual('a@b', result['MessageId'])
+        self.assertEqual([['a@b', 'c@d'], ['e@f', 'g@h'], ['i@j']],
+                         [c['Destinations'] for c in result['Chunks']])
+        self.assertEqual(['a@b', 'e@f', 'i@j'],
+                         [c['MessageId'] for c in result['Chunks']])
+        data = [call[1]['RawMessage']['Data']
+                for call in ses_mock.send_raw_email.call_args_list]
+        self.assertTrue(all(d is data[0] for d in data))
+
+    def test_ses_limit(self):
+        ses_mock = Mock()
+        ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        sender = SESSender(ses_mock, LOGGER, chunk_size=500)
+        sender.set_email(TEST_SEND_EMAIL)
+        sender.send(['user{0}@example.com'.format(i) for i in range(120)],
+                    self.original[0])
+        self.assertEqual(3, ses_mock.send_raw_email.call_count)
+
+    def test_send_chunks_partial_failure(self):
+        def send(**kwargs):
+            if 'e@f' in kwargs['Destinations']:
+                raise ClientError(ERROR_RESPONSE, 'operation_name')
+            return {'MessageId': 'id'}
+        ses_mock = Mock()
+        ses_mock.send_raw_email.side_effect = send
+        sender = SESSender(ses_mock, LOGGER, chunk_size=2)
+        sender.set_email(TEST_SEND_EMAIL)
+        try:
+            sender.send(['a@b', 'c@d', 'e@f', 'g@h'], self.original[0])
+            self.fail('SESSendError not raised')
+        except SESSendError as err:
+            self.assertEqual(['e@f', 'g@h'], err.get_failed_recipients())
+            self.assertEqual('id', err.chunks[0]['MessageId'])
+
+    def test_send_chunks_timeout(self):
+        def send(**kwargs):
+            if 'e@f' in kwargs['Destinations']:
+                raise ReadTimeoutError(endpoint_url='https://ses')
+            return {'MessageId': kwargs['Destinations'][0]}
+        ses_mock = Mock()
+        ses_mock.send_raw_email.side_effect = send
+        sender = SESSender(ses_mock, LOGGER, chunk_size=2)
+        sender.set_email(TEST_SEND_EMAIL)
+        try:
+            sender.send(['a@b', 'c@d', 'e@f', 'g@h'], self.original[0])
+            self.fail('SESSendError not raised')
+        except SESSendError as err:
+            self.assertEqual(['e@f', 'g@h'], err.get_failed_recipients())
+            self.assertEqual('a@b', err.chunks[0]['MessageId'])
     
+    def test_per_recipient(self):
+        def send(**kwargs):
+            time.sleep(0.2)
+            return {'MessageId': kwargs['Destinations'][0]}
+        ses_mock = Mock()
+        ses_mock.send_raw_email.side_effect = send
+        sender = SESSender(ses_mock, LOGGER, max_workers=5)
+        sender.set_email(TEST_SEND_EMAIL)
+        recipients = ['a@b', 'c@d', 'e@f', 'g@h', 'i@j']
+        start = time.time()
+        result = sender.send(recipients, self.original[0],
+                             per_recipient=True)
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEqual(recipients,
+                         [c['MessageId'] for c in result['Chunks']])
+        self.assertEqual([[r] for r in recipients],
+                         [c['Destinations'] for c in result['Chunks']])
+
 
 if __name__ == '__main__':
     unittest.main()        
@@ -0,0 +1,122 @@
+import unittest
+from SimpleForwarder import StageTimer, lambda_handler, print_metrics
+from mock import Mock, patch
+from StringIO import StringIO
+from test_util import *
+
+
+class testStageTimer(unittest.TestCase):
+
+    def setUp(self):
+        self._clock = FakeClock(100.0)
+        self._timer = StageTimer('cold', clock=self._clock)
+
+    def test_stages(self):
+        with self._timer.stage('fetch'):
+            self._clock.now += 0.25
+        with self._timer.stage('send'):
+            self._clock.now += 0.5
+        with self._timer.stage('fetch'):
+            self._clock.now += 0.25
+        self.assertEqual({'fetch': 500.0, 'send': 500.0},
+                         self._timer.get_stages())
+
+    def test_stage_timed_on_error(self):
+        try:
+            with self._timer.stage('send'):
+                self._clock.now += 1
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual({'send': 1000.0}, self._timer.get_stages())
+
+    def test_record(self):
+        with self._timer.stage('route'):
+            self._clock.now += 0.002
+        self._timer.set('messageSize', 1234)
+        self._timer.set('recipients', 3)
+        record = self._timer.get_record('Test')
+        self.assertEqual('cold', record['start'])
+        self.assertEqual(1234, record['messageSize'])
+        self.assertAlmostEqual(2.0, record['routeTime'])
+        self.assertAlmostEqual(2.0, record['totalTime'])
+        emf = record['_aws']
+        self.assertEqual(100000, emf['Timestamp'])
+        self.assertEqual('Test', emf['CloudWatchMetrics'][0]['Namespace'])
+        self.assertEqual([['start']],
+                         emf['CloudWatchMetrics'][0]['Dimensions'])
+        self.assertEqual(
+            [{'Name': 'routeTime', 'Unit': 'Milliseconds'},
+             {'Name': 'totalTime', 'Unit': 'Milliseconds'},
+             {'Name': 'messageSize', 'Unit': 'Bytes'},
+             {'Name': 'recipients', 'Unit': 'Count'}],
+            emf['CloudWatchMetrics'][0]['Metrics'])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_print_metrics(self, stdout):
+        print_metrics({'totalTime': 1.5})
+        self.assertEqual('{"totalTime":1.5}\n', stdout.getvalue())
+
+
+class testEmitMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self._ses_mock = Mock()
+        self._ses_mock.send_raw_email.return_value = {'MessageId': 'id'}
+        self._s3_mock = Mock()
+        self._s3_mock.get_object.side_effect = lambda **kwargs: {
+            'Body': StringIO(TEST_EMAIL_BODY),
+            'ContentLength': len(TEST_EMAIL_BODY)
+        }
+        self._sink = Mock()
+        patcher = patch('SimpleForwarder.METRICS_SINK', self._sink)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stages_emitted(self):
+        lambda_handler(TEST_EVENT, {}, self._ses_mock, self._s3_mock,
+                       TEST_CONFIG)
+        record = self._sink.call_args[0][0]
+        for stage in ['validate', 'route', 'fetch', 'rewrite', 'send',
+                      'total']:
+            self.assertIn(stage + 'Time', record)
+        self.assertEqual(len(TEST_SEND_EMAIL), record['messageSize'])
+        self.assertEqual(3, record['recipients'])
+        self.assertEqual('3bnsm1c2akm1gded3speted0hpnglijt74jbd201',
+                         record['messageId'])
+        self.assertIn(record['start'], ['cold', 'warm'])
+
+    def test_warm_after_first_invocation(self):
+        lambda_handler(TEST_EVENT, {}, self._ses_mock, self._s3_mock,
+                       TEST_CONFIG)
+        lambda_handler(TEST_EVENT, {}, self._ses_mock, self._s3_mock,
+                       TEST_CONFIG)
+        self.assertEqual('warm', self._sink.call_args[0][0]['start'])
+
+    def test_emitted_on_failure(self):
+        self._ses_mock.send_raw_email.side_effect = ValueError()
+        self.assertRaises(ValueError, lambda_handler, TEST_EVENT, {},
+                          self._ses_mock, self._s3_mock, TEST_CONFIG)
+        self.assertIn('sendTime', self._sink.call_args[0][0])
+
+    def test_sink_failure_ignored(self):
+        self._sink.side_effect = ValueError()
+        lambda_handler(TEST_EVENT, {}, self._ses_mock, self._s3_mock,
+                       TEST_CONFIG)
+        self.assertTrue(self._ses_mock.send_raw_email.called)
+
+    def test_one_record_per_email_in_batch(self):
+        event = {'Records': TEST_EVENT['Records'] * 3}
+        lambda_handler(event, {}, self._ses_mock, self._s3_mock,
+                       TEST_CONFIG)
+        self.assertEqual(3, self._sink.call_count)
+
+    def test_disabled(self):
+        with patch('SimpleForwarder.METRICS_SINK', None):
+            lambda_handler(TEST_EVENT, {}, self._ses_mock, self._s3_mock,
+                           TEST_CONFIG)
+        self.assertFalse(self._sink.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -92,3 +92,24 @@ TEST_CONFIG = {
         ]
     }
 }
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when told to. Call it, or its time method,
+    for the time; sleep moves it on and records how long for.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
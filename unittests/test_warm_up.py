@@ -0,0 +1,84 @@
+import unittest
+from SimpleForwarder import lambda_handler, batch_handler, is_warmup_event, \
+    warm_up, get_routing_index, get_header_templates
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import Mock, patch
+from test_util import *
+
+SCHEDULED_EVENT = {
+    'version': '0',
+    'id': '53dc4d37-cffa-4f76-80c9-8b7d4a4d2eaa',
+    'detail-type': 'Scheduled Event',
+    'source': 'aws.events',
+    'resources': ['arn:aws:events:eu-west-1:123456789012:rule/warm'],
+    'detail': {}
+}
+
+
+class testWarmUp(unittest.TestCase):
+
+    def setUp(self):
+        self._ses_mock = Mock()
+        self._ses_mock.get_send_quota.return_value = {'MaxSendRate': 14.0}
+        self._s3_mock = Mock()
+        self._config = dict(TEST_CONFIG, maxSendRate=0)
+
+    def test_is_warmup_event(self):
+        self.assertTrue(is_warmup_event({'warmup': True}))
+        self.assertTrue(is_warmup_event(SCHEDULED_EVENT))
+        self.assertTrue(is_warmup_event(
+            {'source': 'serverless-plugin-warmup'}))
+        self.assertFalse(is_warmup_event(TEST_EVENT))
+        self.assertFalse(is_warmup_event({}))
+        self.assertFalse(is_warmup_event(None))
+
+    def test_handler(self):
+        summary = lambda_handler(SCHEDULED_EVENT, {}, self._ses_mock,
+                                 self._s3_mock, self._config)
+        self.assertTrue(summary['warmup'])
+        self.assertEqual(4, summary['routes'])
+        self.assertEqual(['ses', 's3'], summary['connections'])
+        self.assertFalse(self._ses_mock.send_raw_email.called)
+        self.assertFalse(self._s3_mock.get_object.called)
+        self.assertEqual('test-bucket',
+                         self._s3_mock.head_bucket.call_args[1]['Bucket'])
+
+    def test_batch_handler(self):
+        self.assertTrue(batch_handler({'warmup': True}, {}, self._ses_mock,
+                                      self._s3_mock, self._config)['warmup'])
+
+    def test_caches_built(self):
+        self._config['forwardMapping'] = dict(TEST_CONFIG['forwardMapping'])
+        self._config['subjectPrefix'] = dict(TEST_CONFIG['subjectPrefix'])
+        with patch('SimpleForwarder.RoutingIndex') as index, \
+                patch('SimpleForwarder.HeaderTemplates') as templates:
+            index.return_value.__len__.return_value = 4
+            warm_up(self._ses_mock, self._s3_mock, self._config)
+            self.assertTrue(index.called)
+            self.assertTrue(templates.called)
+            self.assertIs(index.return_value,
+                          get_routing_index(self._config))
+            self.assertIs(templates.return_value,
+                          get_header_templates(self._config))
+
+    def test_clients_created(self):
+        with patch('SimpleForwarder.get_client') as get_client:
+            warm_up(config=self._config)
+        self.assertEqual(['ses', 's3'], [call[0][0] for call in
+                                         get_client.call_args_list])
+
+    def test_refused_request_still_connects(self):
+        self._s3_mock.head_bucket.side_effect = ClientError(
+            {'Error': {'Code': '403'}}, 'HeadBucket')
+        summary = warm_up(self._ses_mock, self._s3_mock, self._config)
+        self.assertEqual(['ses', 's3'], summary['connections'])
+
+    def test_connection_failure(self):
+        self._ses_mock.get_send_quota.side_effect = \
+            EndpointConnectionError(endpoint_url='https://ses')
+        summary = warm_up(self._ses_mock, self._s3_mock, self._config)
+        self.assertEqual(['s3'], summary['connections'])
+
+
+if __name__ == '__main__':
+    unittest.main()